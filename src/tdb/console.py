@@ -13,8 +13,10 @@ from prompt_toolkit.history import InMemoryHistory
 from rich.console import Console
 from rich.rule import Rule
 from tdb.data.relational import Database
+from tdb.execution.cache import PayloadCache, VerdictCache
 from tdb.execution.constraints import Constraints
 from tdb.execution.engine import ExecutionEngine
+from tdb.operators.semantic_operator import SemanticOperator
 from tdb.queries.query import Query
 from tdb.ui.util import print_df
 
@@ -102,12 +104,34 @@ def run_console():
     parser.add_argument(
         '--modelconfigpath', type=str, default='config/models.json',
         help='Path to model configuration file (JSON).')
+    parser.add_argument(
+        '--cachepath', type=str, default=None,
+        help='Path to database caching LLM verdicts (default: no cache).')
+    parser.add_argument(
+        '--cachesize', type=int, default=1000000,
+        help='Maximal number of cached verdicts (default: 1000000).')
+    parser.add_argument(
+        '--cachettl', type=float, default=None,
+        help='Maximal age of cached verdicts in seconds (default: none).')
+    parser.add_argument(
+        '--payloadcachemb', type=int, default=256,
+        help='Memory for caching encoded files in MB (default: 256).')
+    parser.add_argument(
+        '--streaming', action='store_true',
+        help='Submit LLM calls as slots free up, without batch barriers.')
     args = parser.parse_args()
     
     db = Database(args.dbpath)
     dop = args.dop
     model_config_path = args.modelconfigpath
-    engine = ExecutionEngine(db, dop, model_config_path)
+    cache = None
+    if args.cachepath is not None:
+        cache = VerdictCache(
+            db, args.cachepath, args.cachesize, args.cachettl)
+    SemanticOperator.payload_cache = PayloadCache(
+        args.payloadcachemb * 1024 * 1024)
+    engine = ExecutionEngine(
+        db, dop, model_config_path, cache, args.streaming)
     constraints = Constraints()
     history = InMemoryHistory()
     
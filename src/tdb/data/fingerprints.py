@@ -0,0 +1,104 @@
+'''
+Computes fingerprints of files to detect duplicates.
+'''
+import hashlib
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ContentHasher():
+    """ Computes hashes of file contents to detect duplicate files.
+
+    Cryptographic hashes detect exact duplicates. Optionally,
+    perceptual hashes detect near-duplicate images (requires the
+    Pillow library). Hashes are cached per file version and shared
+    by all instances in the same process.
+    """
+    identity2hash = {}
+    """ Maps file versions to cryptographic hashes of their content. """
+    identity2perceptual = {}
+    """ Maps file versions to perceptual hashes of images. """
+
+    def __init__(self, perceptual=False):
+        """
+        Initializes the hasher.
+
+        Args:
+            perceptual (bool): Whether to use perceptual hashes for images.
+        """
+        self.perceptual = perceptual
+        if perceptual and Image is None:
+            print(
+                'Warning: install Pillow to detect near-duplicate images '
+                '(detecting exact duplicates only).')
+            self.perceptual = False
+
+    def content_hash(self, file_path, file_identity):
+        """ Computes a cryptographic hash of the file content.
+
+        Args:
+            file_path (Path): Path of the file.
+            file_identity (str): Identifies the current file version.
+
+        Returns:
+            str: SHA-256 hash of the file content.
+        """
+        content_hash = self.identity2hash.get(file_identity)
+        if content_hash is None:
+            hasher = hashlib.sha256()
+            with file_path.open('rb') as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+            content_hash = hasher.hexdigest()
+            self.identity2hash[file_identity] = content_hash
+        return content_hash
+
+    def duplicate_key(self, file_path, file_identity, modality):
+        """ Computes a key that is shared by (near-)duplicate files.
+
+        Args:
+            file_path (Path): Path of the file.
+            file_identity (str): Identifies the current file version.
+            modality (str): Data type of the file ('image' or 'audio').
+
+        Returns:
+            str: Key shared by duplicate files.
+        """
+        if self.perceptual and modality == 'image':
+            return 'perceptual:' + self.perceptual_hash(
+                file_path, file_identity)
+        else:
+            return 'content:' + self.content_hash(file_path, file_identity)
+
+    def perceptual_hash(self, file_path, file_identity):
+        """ Computes a difference hash of an image.
+
+        The hash compares the brightness of neighboring pixels
+        in a downscaled, grayscale version of the image. Images
+        that differ only slightly (e.g., due to compression or
+        rescaling) obtain the same hash.
+
+        Args:
+            file_path (Path): Path of the image.
+            file_identity (str): Identifies the current file version.
+
+        Returns:
+            str: 64-bit hash in hexadecimal representation.
+        """
+        perceptual_hash = self.identity2perceptual.get(file_identity)
+        if perceptual_hash is None:
+            with Image.open(file_path) as image:
+                small = image.convert('L').resize((9, 8))
+                pixels = list(small.getdata())
+            bits = 0
+            for row in range(8):
+                for col in range(8):
+                    left = pixels[row * 9 + col]
+                    right = pixels[row * 9 + col + 1]
+                    bits = (bits << 1) | (left > right)
+            perceptual_hash = f'{bits:016x}'
+            self.identity2perceptual[file_identity] = perceptual_hash
+        return perceptual_hash
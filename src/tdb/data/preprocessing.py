@@ -0,0 +1,340 @@
+'''
+Reduces the size of media files before sending them to LLMs.
+'''
+import hashlib
+import json
+import numpy as np
+import shutil
+import subprocess
+import tempfile
+import wave
+
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class MediaPreprocessor():
+    """ Base class for reducing media files before LLM calls.
+
+    Reduced files are stored in a cache directory next to the
+    database and reused as long as the original files remain
+    unchanged. Each reduced file is accompanied by a file with
+    metadata (in JSON format) describing the reduction.
+    """
+    def __init__(self, db_path, cache_dir_name, enabled):
+        """
+        Initializes the cache for reduced files.
+
+        Args:
+            db_path (str): Path of the database (cache is stored nearby).
+            cache_dir_name (str): Name of the cache directory.
+            enabled (bool): Whether to reduce media files.
+        """
+        self.cache_dir = Path(db_path).parent / cache_dir_name
+        self.enabled = enabled
+        self.identity2reduced = {}
+
+    def _extension(self):
+        """ Returns the file extension of reduced files.
+
+        Returns:
+            str: File extension (without leading dot).
+        """
+        raise NotImplementedError()
+
+    def _reduce(self, file_path, reduced_path):
+        """ Writes a reduced version of a media file.
+
+        Args:
+            file_path (Path): Path of the original file.
+            reduced_path (Path): Path at which to store the reduced file.
+
+        Returns:
+            dict: Metadata describing the reduction.
+        """
+        raise NotImplementedError()
+
+    def _reduced(self, file_path, file_identity):
+        """ Retrieves or creates the reduced version of a file.
+
+        Args:
+            file_path (Path): Path of the original file.
+            file_identity (str): Identifies the current file version.
+
+        Returns:
+            tuple: path of file to send and metadata of the reduction.
+        """
+        reduced = self.identity2reduced.get(file_identity)
+        if reduced is None:
+            settings = json.dumps([file_identity, *self._settings()])
+            file_name = hashlib.sha256(settings.encode('utf-8')).hexdigest()
+            reduced_path = self.cache_dir / f'{file_name}.{self._extension()}'
+            metadata_path = self.cache_dir / f'{file_name}.json'
+            if reduced_path.exists() and metadata_path.exists():
+                metadata = json.loads(metadata_path.read_text())
+            else:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.cache_dir / f'{file_name}.tmp'
+                metadata = self._reduce(file_path, tmp_path)
+                tmp_path.replace(reduced_path)
+                metadata_path.write_text(json.dumps(metadata))
+            # Keep original files if reduction does not save space
+            if reduced_path.stat().st_size >= file_path.stat().st_size:
+                reduced_path = file_path
+                metadata = {}
+            reduced = (reduced_path, metadata)
+            self.identity2reduced[file_identity] = reduced
+
+        return reduced
+
+    def _settings(self):
+        """ Returns the settings that determine reduced files.
+
+        Returns:
+            list: Settings that are part of the cache key.
+        """
+        raise NotImplementedError()
+
+    def metadata(self, file_path, file_identity):
+        """ Retrieves metadata describing the reduction of a file.
+
+        Args:
+            file_path (Path): Path of the original file.
+            file_identity (str): Identifies the current file version.
+
+        Returns:
+            dict: Metadata describing the reduction (empty if disabled).
+        """
+        if not self.enabled:
+            return {}
+        return self._reduced(file_path, file_identity)[1]
+
+    def preprocess(self, file_path, file_identity):
+        """ Retrieves the path of the file version to send to the LLM.
+
+        Args:
+            file_path (Path): Path of the original file.
+            file_identity (str): Identifies the current file version.
+
+        Returns:
+            Path: Path of the reduced file or of the original file.
+        """
+        if not self.enabled:
+            return file_path
+        return self._reduced(file_path, file_identity)[0]
+
+
+class ImagePreprocessor(MediaPreprocessor):
+    """ Downscales and re-encodes images to reduce image tokens.
+
+    Preprocessing requires the Pillow library; if it is not
+    installed, original images are used.
+    """
+    format2extension = {'jpeg': 'jpg', 'webp': 'webp'}
+
+    def __init__(self, db_path, config=None):
+        """
+        Initializes preprocessing with the given settings.
+
+        Args:
+            db_path (str): Path of the database (cache is stored nearby).
+            config: None (no preprocessing) or dictionary with settings
+                "max_edge", "format" ("jpeg" or "webp"), "quality", and
+                "detail" (detail level requested from the model).
+        """
+        config = {} if config is None else config
+        super().__init__(
+            db_path, 'thalamusdb_images', 'max_edge' in config)
+        self.max_edge = config.get('max_edge')
+        self.format = config.get('format', 'jpeg')
+        self.quality = config.get('quality', 85)
+        self.detail = config.get('detail', 'low')
+        if self.format not in self.format2extension:
+            raise ValueError(
+                f'Unsupported image format: {self.format}!')
+        if self.enabled and Image is None:
+            print(
+                'Warning: install Pillow to downscale images '
+                '(sending original images).')
+            self.enabled = False
+
+    def _extension(self):
+        """ Returns the file extension of reduced images.
+
+        Returns:
+            str: File extension (without leading dot).
+        """
+        return self.format2extension[self.format]
+
+    def _reduce(self, file_path, reduced_path):
+        """ Writes a downscaled and re-encoded version of an image.
+
+        Args:
+            file_path (Path): Path of the original image.
+            reduced_path (Path): Path at which to store the reduced image.
+
+        Returns:
+            dict: Metadata describing the reduction.
+        """
+        with Image.open(file_path) as image:
+            original_size = image.size
+            image.thumbnail((self.max_edge, self.max_edge))
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(reduced_path, format=self.format, quality=self.quality)
+            return {'original_size': original_size, 'size': image.size}
+
+    def _settings(self):
+        """ Returns the settings that determine reduced images.
+
+        Returns:
+            list: Settings that are part of the cache key.
+        """
+        return [self.max_edge, self.format, self.quality]
+
+
+class AudioPreprocessor(MediaPreprocessor):
+    """ Downmixes, resamples, and trims audio files.
+
+    Reduced audio files are stored as 16-bit mono WAV files.
+    WAV files are processed directly while other formats (e.g.,
+    MP3) are decoded via ffmpeg. If ffmpeg is not installed,
+    original files in such formats are used.
+    """
+    def __init__(self, db_path, config=None):
+        """
+        Initializes preprocessing with the given settings.
+
+        Args:
+            db_path (str): Path of the database (cache is stored nearby).
+            config: None (no preprocessing) or dictionary with settings
+                "sample_rate" (in Hz), "max_seconds" (maximal duration,
+                optional), and "segments" (number of evenly spaced
+                segments making up the reduced clip, one by default).
+        """
+        config = {} if config is None else config
+        super().__init__(db_path, 'thalamusdb_audio', bool(config))
+        self.sample_rate = config.get('sample_rate', 16000)
+        self.max_seconds = config.get('max_seconds')
+        self.nr_segments = config.get('segments', 1)
+        self.ffmpeg_path = shutil.which('ffmpeg')
+        if self.enabled and self.ffmpeg_path is None:
+            print(
+                'Warning: install ffmpeg to reduce audio files '
+                'other than WAV files (sending original files).')
+
+    def _decode(self, file_path):
+        """ Decodes an audio file into mono samples.
+
+        Args:
+            file_path (Path): Path of the audio file.
+
+        Returns:
+            tuple: samples (floats between -1 and 1) and sample rate.
+        """
+        if file_path.suffix.lower() != '.wav':
+            # Let ffmpeg convert other formats into WAV files
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                wav_path = Path(tmp_dir) / 'decoded.wav'
+                subprocess.run(
+                    [self.ffmpeg_path, '-loglevel', 'error', '-i',
+                     str(file_path), '-ac', '1', '-ar',
+                     str(self.sample_rate), str(wav_path)],
+                    check=True)
+                return self._decode(wav_path)
+
+        with wave.open(str(file_path), 'rb') as wav_file:
+            nr_channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            frame_rate = wav_file.getframerate()
+            frames = wav_file.readframes(wav_file.getnframes())
+
+        if sample_width == 1:
+            samples = (np.frombuffer(frames, np.uint8) - 128) / 128
+        elif sample_width == 3:
+            raw = np.frombuffer(frames, np.uint8).reshape(-1, 3)
+            padded = np.zeros((len(raw), 4), np.uint8)
+            padded[:, 1:] = raw
+            samples = padded.view('<i4').ravel() / 2 ** 31
+        else:
+            dtype = {2: '<i2', 4: '<i4'}[sample_width]
+            samples = np.frombuffer(frames, dtype) / 2 ** (8 * sample_width - 1)
+
+        samples = samples.reshape(-1, nr_channels).mean(axis=1)
+        return samples, frame_rate
+
+    def _extension(self):
+        """ Returns the file extension of reduced audio files.
+
+        Returns:
+            str: File extension (without leading dot).
+        """
+        return 'wav'
+
+    def _reduce(self, file_path, reduced_path):
+        """ Writes a downmixed, resampled, and trimmed audio file.
+
+        Args:
+            file_path (Path): Path of the original audio file.
+            reduced_path (Path): Path at which to store the reduced file.
+
+        Returns:
+            dict: Metadata, including original and reduced duration.
+        """
+        samples, frame_rate = self._decode(file_path)
+        original_seconds = len(samples) / frame_rate
+
+        # Resample via linear interpolation
+        if frame_rate != self.sample_rate:
+            nr_samples = int(original_seconds * self.sample_rate)
+            positions = np.arange(nr_samples) * frame_rate / self.sample_rate
+            samples = np.interp(positions, np.arange(len(samples)), samples)
+
+        # Sample evenly spaced segments of limited total duration
+        max_samples = None if self.max_seconds is None \
+            else int(self.max_seconds * self.sample_rate)
+        if max_samples is not None and len(samples) > max_samples:
+            segment_length = max_samples // self.nr_segments
+            gap = (len(samples) - segment_length * self.nr_segments) \
+                // max(self.nr_segments - 1, 1)
+            samples = np.concatenate([
+                samples[i * (segment_length + gap):
+                        i * (segment_length + gap) + segment_length]
+                for i in range(self.nr_segments)])
+
+        pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+        with wave.open(str(reduced_path), 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(pcm.tobytes())
+
+        return {
+            'original_seconds': original_seconds,
+            'seconds': len(pcm) / self.sample_rate}
+
+    def _reduced(self, file_path, file_identity):
+        """ Retrieves or creates the reduced version of an audio file.
+
+        Args:
+            file_path (Path): Path of the original file.
+            file_identity (str): Identifies the current file version.
+
+        Returns:
+            tuple: path of file to send and metadata of the reduction.
+        """
+        if file_path.suffix.lower() != '.wav' and self.ffmpeg_path is None:
+            return file_path, {}
+        return super()._reduced(file_path, file_identity)
+
+    def _settings(self):
+        """ Returns the settings that determine reduced audio files.
+
+        Returns:
+            list: Settings that are part of the cache key.
+        """
+        return [self.sample_rate, self.max_seconds, self.nr_segments]
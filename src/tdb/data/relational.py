@@ -58,7 +58,26 @@ class Database():
         """
         # print(f'Executing: {query}')
         return self.con.execute(query).fetchall()
-    
+
+    def register(self, view_name, df):
+        """
+        Makes a pandas data frame accessible as a view in SQL queries.
+
+        Args:
+            view_name (str): Name under which the data frame is accessible.
+            df: pandas data frame to register.
+        """
+        self.con.register(view_name, df)
+
+    def unregister(self, view_name):
+        """
+        Removes a view created via the register method.
+
+        Args:
+            view_name (str): Name of the view to remove.
+        """
+        self.con.unregister(view_name)
+
     def schema(self):
         """ Retrieves the schema of the DuckDB database.
 
@@ -78,10 +97,14 @@ class Database():
     def tables(self):
         """ Retrieves the names of all tables in the DuckDB database.
 
+        Tables of other attached databases (e.g., caches) are excluded.
+
         Returns:
             List of table names.
         """
-        query = "SELECT table_name FROM duckdb_tables()"
+        query = (
+            "SELECT table_name FROM duckdb_tables() "
+            "WHERE database_name IN (current_database(), 'temp')")
         result = self.con.execute(query).fetchall()
         return [table[0] for table in result]
 
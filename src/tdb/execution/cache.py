@@ -0,0 +1,214 @@
+'''
+Caches for verdicts of semantic operators and for encoded items.
+'''
+import hashlib
+import json
+import time
+
+from collections import OrderedDict
+
+
+class VerdictCache():
+    """ Caches verdicts of semantic operators across queries.
+
+    Verdicts are stored in a separate DuckDB database that is
+    attached to the connection of the queried database. That
+    way, operators can match their tasks against cached verdicts
+    without leaving DuckDB. Each verdict is keyed by a context
+    (operator type, model arguments, condition, and prompt format)
+    and by the fingerprints of the items involved (the right item
+    is empty for unary filters). Expired verdicts are removed when
+    the cache is attached and ignored by lookups.
+    """
+    def __init__(
+            self, db, cache_path=':memory:',
+            max_entries=1000000, max_age_seconds=None):
+        """
+        Attaches the cache database and removes expired entries.
+
+        Args:
+            db: Database containing the data to query.
+            cache_path (str): Path of cache database or ':memory:'.
+            max_entries (int): Maximal number of cached verdicts.
+            max_age_seconds: None or maximal age of cached verdicts.
+        """
+        self.db = db
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.schema = 'ThalamusDB_Cache'
+        self.table = f'{self.schema}.verdicts'
+        escaped_path = cache_path.replace("'", "''")
+        self.db.execute2list(
+            f"ATTACH IF NOT EXISTS '{escaped_path}' AS {self.schema};")
+        self.db.execute2list(
+            f'CREATE TABLE IF NOT EXISTS {self.table}('
+            'context VARCHAR, left_item VARCHAR, right_item VARCHAR, '
+            'result BOOLEAN, created DOUBLE, last_used DOUBLE, '
+            'PRIMARY KEY (context, left_item, right_item));')
+        if self.max_age_seconds is not None:
+            min_created = time.time() - self.max_age_seconds
+            self.db.execute2list(
+                f'DELETE FROM {self.table} '
+                f'WHERE created < {min_created};')
+        self.nr_entries = self.db.execute2list(
+            f'SELECT COUNT(*) FROM {self.table};')[0][0]
+        self._evict()
+
+    @staticmethod
+    def context(kind, model_args, condition, prompt=None):
+        """ Computes the cache context for verdicts of one operator.
+
+        Args:
+            kind (str): Type of semantic operator ('filter' or 'join').
+            model_args (dict): Keyword arguments of the LLM call.
+            condition (str): Condition in natural language.
+            prompt: None (single item and condition) or prompt format.
+
+        Returns:
+            str: Hash identifying the context of cached verdicts.
+        """
+        context = [kind, model_args, condition]
+        if prompt is not None:
+            context.append(prompt)
+        context_json = json.dumps(context, sort_keys=True, default=str)
+        return hashlib.sha256(context_json.encode('utf-8')).hexdigest()
+
+    def _evict(self):
+        """ Removes least recently used verdicts if the cache is full. """
+        nr_surplus = self.nr_entries - self.max_entries
+        if nr_surplus > 0:
+            self.db.execute2list(
+                f'DELETE FROM {self.table} WHERE rowid IN ('
+                f'SELECT rowid FROM {self.table} '
+                f'ORDER BY last_used LIMIT {nr_surplus});')
+            self.nr_entries -= nr_surplus
+
+    def lookup(self, keys_df):
+        """ Retrieves cached verdicts for given keys.
+
+        Args:
+            keys_df: data frame with context, left_item, right_item columns.
+
+        Returns:
+            Rows of the input data frame with cached verdicts (result column).
+        """
+        view_name = f'{self.schema}_Keys'
+        self.db.register(view_name, keys_df)
+        try:
+            return self.lookup_relation(f'SELECT * FROM {view_name}')
+        finally:
+            self.db.unregister(view_name)
+
+    def lookup_relation(self, keys_sql):
+        """ Retrieves cached verdicts for keys produced by a SQL query.
+
+        This avoids materializing keys outside of DuckDB, e.g. when
+        keys are generated via joins between large tables.
+
+        Args:
+            keys_sql (str): query producing context, left_item, right_item.
+
+        Returns:
+            Rows of the query result with cached verdicts (result column).
+        """
+        match_sql = (
+            f'k.context = v.context '
+            f'AND k.left_item = v.left_item '
+            f'AND k.right_item = v.right_item')
+        if self.max_age_seconds is not None:
+            min_created = time.time() - self.max_age_seconds
+            match_sql += f' AND v.created >= {min_created}'
+
+        hits_df = self.db.execute2df(
+            f'SELECT k.*, v.result FROM ({keys_sql}) k '
+            f'JOIN {self.table} v ON {match_sql};')
+        self.db.execute2list(
+            f'UPDATE {self.table} v SET last_used = {time.time()} '
+            f'FROM ({keys_sql}) k WHERE {match_sql};')
+        return hits_df
+
+    def store(self, verdicts_df):
+        """ Stores new verdicts in the cache.
+
+        Args:
+            verdicts_df: data frame with key columns and result column.
+        """
+        if len(verdicts_df) == 0:
+            return
+
+        view_name = f'{self.schema}_Verdicts'
+        self.db.register(view_name, verdicts_df)
+        try:
+            # Track the cache size without scanning all verdicts
+            nr_new = self.db.execute2list(
+                'SELECT COUNT(*) FROM (SELECT DISTINCT '
+                f'context, left_item, right_item FROM {view_name}) k '
+                f'WHERE NOT EXISTS (SELECT 1 FROM {self.table} v '
+                'WHERE v.context = k.context '
+                'AND v.left_item = k.left_item '
+                'AND v.right_item = k.right_item);')[0][0]
+            now = time.time()
+            self.db.execute2list(
+                f'INSERT OR REPLACE INTO {self.table} '
+                'SELECT DISTINCT ON (context, left_item, right_item) '
+                f'context, left_item, right_item, result, {now}, {now} '
+                f'FROM {view_name};')
+        finally:
+            self.db.unregister(view_name)
+
+        self.nr_entries += nr_new
+        self._evict()
+
+
+class PayloadCache():
+    """ Caches encoded payloads of files in memory (LRU policy).
+
+    The cache size is bounded by the total number of bytes of
+    cached payloads. If adding a payload exceeds that bound, the
+    least recently used payloads are evicted first.
+    """
+    def __init__(self, max_bytes):
+        """
+        Initializes an empty cache.
+
+        Args:
+            max_bytes (int): Maximal number of bytes of cached payloads.
+        """
+        self.max_bytes = max_bytes
+        self.nr_bytes = 0
+        self.key2payload = OrderedDict()
+
+    def get(self, key):
+        """ Retrieves a cached payload.
+
+        Args:
+            key: Identifies the payload (e.g., path, size, and mtime).
+
+        Returns:
+            Cached payload or None if the payload is not cached.
+        """
+        payload = self.key2payload.get(key)
+        if payload is not None:
+            self.key2payload.move_to_end(key)
+        return payload
+
+    def put(self, key, payload):
+        """ Adds a payload to the cache, evicting other payloads if needed.
+
+        Payloads larger than the maximal cache size are not cached.
+
+        Args:
+            key: Identifies the payload (e.g., path, size, and mtime).
+            payload (str): Encoded payload to cache.
+        """
+        if key in self.key2payload:
+            self.nr_bytes -= len(self.key2payload.pop(key))
+        if len(payload) > self.max_bytes:
+            return
+
+        self.key2payload[key] = payload
+        self.nr_bytes += len(payload)
+        while self.nr_bytes > self.max_bytes:
+            _, evicted = self.key2payload.popitem(last=False)
+            self.nr_bytes -= len(evicted)
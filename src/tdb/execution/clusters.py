@@ -0,0 +1,90 @@
+'''
+Infers verdicts of equivalence joins from previous verdicts.
+'''
+
+
+class EquivalenceClusters():
+    """ Groups items that satisfy an equivalence condition.
+
+    Matching items are merged into clusters via union-find. As
+    the join condition is transitive, all items in a cluster are
+    equivalent. Evaluated non-matches separate the associated
+    clusters: no item of the first cluster matches any item of
+    the second cluster.
+    """
+    def __init__(self):
+        """ Initializes an empty set of clusters. """
+        self.item2parent = {}
+        self.root2separated = {}
+
+    def find(self, item):
+        """ Finds the representative item of the item's cluster.
+
+        Args:
+            item: Item (e.g., a join key).
+
+        Returns:
+            Representative (root) of the cluster containing the item.
+        """
+        root = item
+        while self.item2parent.get(root, root) != root:
+            root = self.item2parent[root]
+        # Compress path to speed up future lookups
+        while item != root:
+            parent = self.item2parent.get(item, item)
+            self.item2parent[item] = root
+            item = parent
+        return root
+
+    def separate(self, item_1, item_2):
+        """ Records that two items do not match.
+
+        Args:
+            item_1: First item.
+            item_2: Second item.
+        """
+        root_1 = self.find(item_1)
+        root_2 = self.find(item_2)
+        if root_1 != root_2:
+            self.root2separated.setdefault(root_1, set()).add(root_2)
+            self.root2separated.setdefault(root_2, set()).add(root_1)
+
+    def union(self, item_1, item_2):
+        """ Merges the clusters of two matching items.
+
+        Clusters that were separated before (due to inconsistent
+        verdicts) are not merged.
+
+        Args:
+            item_1: First item.
+            item_2: Second item.
+        """
+        root_1 = self.find(item_1)
+        root_2 = self.find(item_2)
+        if root_1 == root_2 or self.verdict(root_1, root_2) is False:
+            return
+        self.item2parent[root_2] = root_1
+        separated = self.root2separated.pop(root_2, set())
+        for other_root in separated:
+            other_separated = self.root2separated[other_root]
+            other_separated.discard(root_2)
+            other_separated.add(root_1)
+        self.root2separated.setdefault(root_1, set()).update(separated)
+
+    def verdict(self, item_1, item_2):
+        """ Infers whether two items match.
+
+        Args:
+            item_1: First item.
+            item_2: Second item.
+
+        Returns:
+            True or False if the verdict can be inferred, None otherwise.
+        """
+        root_1 = self.find(item_1)
+        root_2 = self.find(item_2)
+        if root_1 == root_2:
+            return True
+        elif root_2 in self.root2separated.get(root_1, ()):
+            return False
+        return None
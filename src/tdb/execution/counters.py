@@ -71,9 +71,41 @@ class TdbCounters:
     """ Number of processed tasks requiring LLM invocations. """
     unprocessed_tasks: int = 0
     """ Number of unprocessed tasks that require LLM invocations. """
+    cache_hits: int = 0
+    """ Number of tasks resolved via cached verdicts. """
+    cache_misses: int = 0
+    """ Number of tasks without cached verdicts. """
+    payload_hits: int = 0
+    """ Number of file encodings retrieved from the payload cache. """
+    payload_misses: int = 0
+    """ Number of file encodings not found in the payload cache. """
+    image_bytes_saved: int = 0
+    """ Number of bytes saved by sending downscaled images. """
+    audio_seconds_saved: float = 0
+    """ Seconds of audio saved by trimming audio files. """
+    pruned_tasks: int = 0
+    """ Number of tasks skipped without evaluation (e.g., blocking). """
+    inferred_tasks: int = 0
+    """ Number of tasks resolved by inference (equivalence joins). """
+    join_pairs: int = 0
+    """ Number of key pairs evaluated by semantic joins via LLMs. """
+    join_calls: int = 0
+    """ Number of LLM calls issued by semantic joins. """
+    parse_failures: int = 0
+    """ Number of LLM replies that could not be parsed. """
     model2counters: dict = field(default_factory=dict)
     """ Maps LLM model IDs to their respective counters. """
     
+    def pairs_per_call(self):
+        """ Returns the average number of key pairs per join call.
+        
+        Returns:
+            Number of evaluated key pairs per LLM call of joins.
+        """
+        if self.join_calls == 0:
+            return 0
+        return self.join_pairs / self.join_calls
+    
     def total_input_tokens(self):
         """ Returns total number of input tokens processed.
         
@@ -117,6 +149,18 @@ class TdbCounters:
             'Can only add TdbCounters instances!'
         processed_tasks=self.processed_tasks + other.processed_tasks
         unprocessed_tasks=self.unprocessed_tasks + other.unprocessed_tasks
+        cache_hits = self.cache_hits + other.cache_hits
+        cache_misses = self.cache_misses + other.cache_misses
+        payload_hits = self.payload_hits + other.payload_hits
+        payload_misses = self.payload_misses + other.payload_misses
+        image_bytes_saved = self.image_bytes_saved + other.image_bytes_saved
+        audio_seconds_saved = \
+            self.audio_seconds_saved + other.audio_seconds_saved
+        pruned_tasks = self.pruned_tasks + other.pruned_tasks
+        inferred_tasks = self.inferred_tasks + other.inferred_tasks
+        join_pairs = self.join_pairs + other.join_pairs
+        join_calls = self.join_calls + other.join_calls
+        parse_failures = self.parse_failures + other.parse_failures
         model2counters = self.model2counters.copy()
         for model_id, counters in other.model2counters.items():
             if model_id in model2counters:
@@ -127,12 +171,62 @@ class TdbCounters:
         return TdbCounters(
             processed_tasks=processed_tasks,
             unprocessed_tasks=unprocessed_tasks,
+            cache_hits=cache_hits,
+            cache_misses=cache_misses,
+            payload_hits=payload_hits,
+            payload_misses=payload_misses,
+            image_bytes_saved=image_bytes_saved,
+            audio_seconds_saved=audio_seconds_saved,
+            pruned_tasks=pruned_tasks,
+            inferred_tasks=inferred_tasks,
+            join_pairs=join_pairs,
+            join_calls=join_calls,
+            parse_failures=parse_failures,
             model2counters=model2counters
         )
     
     def pretty_print(self):
         """ Prints counters for updates during query execution. """
         print_progress(self.processed_tasks, self.unprocessed_tasks)
+        if self.cache_hits + self.cache_misses > 0:
+            cache_df = pd.DataFrame({
+                'Cache Hits': [self.cache_hits],
+                'Cache Misses': [self.cache_misses],
+                })
+            print_df(cache_df, title='Verdict Cache')
+        if self.payload_hits + self.payload_misses > 0:
+            payload_df = pd.DataFrame({
+                'Cache Hits': [self.payload_hits],
+                'Cache Misses': [self.payload_misses],
+                })
+            print_df(payload_df, title='Encoded File Cache')
+        if self.image_bytes_saved + self.audio_seconds_saved > 0:
+            saved_df = pd.DataFrame({
+                'Image Bytes Saved': [self.image_bytes_saved],
+                'Audio Seconds Saved': [round(self.audio_seconds_saved, 1)],
+                })
+            print_df(saved_df, title='Media Preprocessing')
+        if self.pruned_tasks > 0:
+            nr_tasks = self.processed_tasks + self.unprocessed_tasks \
+                + self.pruned_tasks
+            pruned_df = pd.DataFrame({
+                'Pruned Tasks': [self.pruned_tasks],
+                'Pruned Fraction': [round(self.pruned_tasks / nr_tasks, 3)],
+                })
+            print_df(pruned_df, title='Task Pruning')
+        if self.join_calls + self.inferred_tasks > 0:
+            join_df = pd.DataFrame({
+                'Evaluated Pairs': [self.join_pairs],
+                'Inferred Pairs': [self.inferred_tasks],
+                'Join Calls': [self.join_calls],
+                'Pairs per Call': [round(self.pairs_per_call(), 1)],
+                })
+            print_df(join_df, title='Join Batching')
+        if self.parse_failures > 0:
+            parse_df = pd.DataFrame({
+                'Parse Failures': [self.parse_failures],
+                })
+            print_df(parse_df, title='LLM Replies')
         for model_id, counters in self.model2counters.items():
             title = f'LLM Counters for {model_id}'
             counters.pretty_print(title=title)
\ No newline at end of file
@@ -0,0 +1,99 @@
+'''
+Dispatches LLM calls for all semantic operators.
+'''
+import asyncio
+import litellm
+import threading
+
+from litellm import RateLimitError, acompletion
+from tdb.execution.rate_limits import RateLimiter
+
+
+class LLMDispatcher():
+    """ Dispatches LLM calls asynchronously with bounded concurrency.
+
+    The dispatcher runs an asyncio event loop in a background thread.
+    Semantic operators submit LLM calls and receive futures for the
+    replies. A semaphore shared by all operators limits the number
+    of LLM calls that are in flight at the same time. Also, calls
+    are paced according to per-model rate limits and retried if
+    the provider rejects them due to rate limits.
+    """
+    def __init__(self, dop, models_config=None, max_retries=6):
+        """
+        Starts the event loop processing LLM calls.
+
+        Args:
+            dop (int): Maximal number of concurrent LLM calls.
+            models_config: None or content of model configuration file.
+            max_retries (int): Maximal number of retries per call.
+        """
+        self.dop = dop
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(models_config)
+        self.semaphore = asyncio.Semaphore(dop)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    async def _complete(self, kwargs):
+        """ Invokes the LLM once rate limits admit it and a slot is available.
+
+        Args:
+            kwargs (dict): Keyword arguments for the completion function.
+
+        Returns:
+            Reply of the LLM.
+        """
+        model = kwargs['model']
+        nr_tokens = self.rate_limiter.estimate_tokens(kwargs)
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(model, nr_tokens)
+            async with self.semaphore:
+                try:
+                    # Ensure parameters are dropped for logging where applicable
+                    litellm.drop_params = True
+                    response = await acompletion(**kwargs)
+                except RateLimitError:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay_s = self.rate_limiter.back_off(model, attempt)
+                else:
+                    self.rate_limiter.record_success(
+                        model, nr_tokens, response)
+                    return response
+            
+            # Wait without occupying a slot, then retry
+            await asyncio.sleep(delay_s)
+            attempt += 1
+
+    def close(self):
+        """ Stops the event loop and its thread. """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def complete_all(self, kwargs_list):
+        """ Invokes the LLM concurrently and waits for all replies.
+
+        Args:
+            kwargs_list: List of keyword arguments for LLM calls.
+
+        Returns:
+            List of LLM replies (same order as keyword arguments).
+        """
+        futures = [self.submit(kwargs) for kwargs in kwargs_list]
+        return [future.result() for future in futures]
+
+    def submit(self, kwargs):
+        """ Submits an LLM call for asynchronous processing.
+
+        Args:
+            kwargs (dict): Keyword arguments for the completion function.
+
+        Returns:
+            concurrent.futures.Future: Future for the LLM reply.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._complete(kwargs), self.loop)
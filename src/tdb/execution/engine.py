@@ -3,12 +3,16 @@ Created on Jul 16, 2025
 
 @author: immanueltrummer
 '''
+import json
 import time
 
+from concurrent.futures import FIRST_COMPLETED, wait
 from pandas.api.types import is_numeric_dtype
 from rich.console import Console
 from rich.rule import Rule
+from tdb.execution.dispatcher import LLMDispatcher
 from tdb.execution.results import AggregateResults, RetrievalResults
+from tdb.operators.fused_filter import FusedFilter
 from tdb.operators.semantic_filter import UnaryFilter
 from tdb.operators.semantic_join import BatchJoin
 from tdb.queries.query import JoinPredicate, UnaryPredicate
@@ -19,17 +23,27 @@ from tdb.execution.counters import TdbCounters
 class ExecutionEngine:
     """ Execution engine for processing SQL queries with NL predicates. """
 
-    def __init__(self, db, dop, model_config_path):
+    def __init__(
+            self, db, dop, model_config_path, 
+            cache=None, streaming=False):
         """ Initializes the execution engine with a database and connection.
         
         Args:
             db: Relational database instance.
             dop: Degree of parallelism for query execution.
             model_config_path: Path to the model configuration file.
+            cache: None or cache for verdicts across queries.
+            streaming: Whether to pipeline LLM calls without batch barriers.
         """
         self.db = db
         self.dop = dop
         self.model_config_path = model_config_path
+        self.cache = cache
+        self.streaming = streaming
+        with open(model_config_path) as file:
+            models_config = json.load(file)
+        self.filter_fusion = models_config.get('filter_fusion', False)
+        self.dispatcher = LLMDispatcher(dop, models_config)
     
     def _aggregate_counters(self, semantic_operators):
         """ Aggregate counters from all semantic operators.
@@ -56,7 +70,8 @@ class ExecutionEngine:
         Returns:
             List of semantic operators.
         """
-        semantic_operators = []
+        semantic_filters = []
+        semantic_joins = []
         for predicate_id, predicate in enumerate(
             query.semantic_predicates):
             if isinstance(predicate, UnaryPredicate):
@@ -64,21 +79,59 @@ class ExecutionEngine:
                 operator_id = f'UnaryFilter{predicate_id}'
                 semantic_filter = UnaryFilter(
                     self.db, operator_id, self.dop, 
-                    self.model_config_path, query, predicate)
-                semantic_operators.append(semantic_filter)
+                    self.model_config_path, query, predicate,
+                    self.cache, self.dispatcher)
+                semantic_filters.append(semantic_filter)
             
             elif isinstance(predicate, JoinPredicate):
                 # Create a semantic join operator
                 operator_id = f'Join{predicate_id}'
                 semantic_join = BatchJoin(
                     self.db, operator_id, 10, 
-                    self.model_config_path, query, predicate)
-                semantic_operators.append(semantic_join)
+                    self.model_config_path, query, predicate,
+                    self.cache, self.dispatcher, self.dop)
+                semantic_joins.append(semantic_join)
             else:
                 raise ValueError(
                     f'Unknown predicate type: {type(predicate)}')
+        
+        # Joins exploit results of filters on the same tables
+        for semantic_join in semantic_joins:
+            aliases = [
+                semantic_join.pred.left_alias, 
+                semantic_join.pred.right_alias]
+            semantic_join.sibling_filters = [
+                f for f in semantic_filters \
+                if f.conjunctive and f.filtered_alias in aliases]
+
+        # Conjunctive filters on the same table form a chain
+        for semantic_filter in semantic_filters:
+            if semantic_filter.conjunctive:
+                semantic_filter.sibling_filters = [
+                    f for f in semantic_filters \
+                    if f is not semantic_filter and f.conjunctive \
+                    and f.filtered_alias == semantic_filter.filtered_alias]
 
-        return semantic_operators
+        # Filters on the same column share LLM calls (if enabled)
+        column2filters = {}
+        fusable_filters = semantic_filters if self.filter_fusion else []
+        for semantic_filter in fusable_filters:
+            column = (
+                semantic_filter.filtered_alias, 
+                semantic_filter.filtered_column)
+            column2filters.setdefault(column, []).append(semantic_filter)
+        fused_filters = []
+        for filters in column2filters.values():
+            if len(filters) > 1:
+                operator_id = f'FusedFilter{len(fused_filters)}'
+                fused_filter = FusedFilter(
+                    self.db, operator_id, self.dop, 
+                    self.model_config_path, query, filters,
+                    self.cache, self.dispatcher)
+                fused_filters.append(fused_filter)
+
+        # Filters are executed before joins in each iteration
+        return semantic_filters + fused_filters + semantic_joins
     
     def _is_agg_results(self, results):
         """ Checks if results are consistent with aggregation query.
@@ -106,35 +159,42 @@ class ExecutionEngine:
         
         return True
     
-    def _results(self, query, semantic_filters):
-        """ Computes multiple possible query results.
+    def _possible_queries(self, query, semantic_filters):
+        """ Generates queries computing multiple possible results.
         
-        This method tries all combinations of default values for
-        semantic filters and computes the corresponding results.
+        This method tries combinations of default values for
+        semantic filters and generates the corresponding queries.
+        If the query is monotone in its semantic predicates, the
+        two extreme combinations (all defaults False or all True)
+        yield the smallest and largest possible results. Otherwise,
+        all combinations are tried.
         
         Args:
             query: Represents a query with semantic operators.
             semantic_filters: List of semantic filters.
         
         Returns:
-            List of possible results, obtained with different default values.
+            List of pure SQL queries, using different default values.
         """
-        # Try all combinations of default values
-        results = []
         nr_operators = len(semantic_filters)
-        for i in range(2 ** nr_operators):
-            # Get default value for each semantic filter
-            default_vals = [(i >> j) & 1 for j in range(nr_operators)]
-            # Compute result with default values
-            result = self._result_with_defaults(
+        if query.monotone:
+            combinations = [[0] * nr_operators, [1] * nr_operators]
+        else:
+            combinations = [
+                [(i >> j) & 1 for j in range(nr_operators)] \
+                for i in range(2 ** nr_operators)]
+        
+        # Generate query for each combination of default values
+        queries = []
+        for default_vals in combinations:
+            rewritten_query = self._query_with_defaults(
                 query, semantic_filters, default_vals)
-            # Add result to set of results
-            results.append(result)
+            queries.append(rewritten_query)
         
-        return results
+        return queries
     
-    def _result_with_defaults(self, query, semantic_filters, default_values):
-        """ Computes result with default values for semantic filters.
+    def _query_with_defaults(self, query, semantic_filters, default_values):
+        """ Generates query with default values for semantic filters.
         
         Args:
             query: Represents a query with semantic operators.
@@ -142,16 +202,83 @@ class ExecutionEngine:
             default_values: List of default values for each filter.
         
         Returns:
-            Query results when using default values for unevaluated rows.
+            Pure SQL query using default values for unevaluated rows.
         """
         rewriter = QueryRewriter(self.db, query)
         op2default = {}
         for op, default_val in zip(semantic_filters, default_values):
             op2default[op] = default_val
         
-        rewritten_query = rewriter.pure_sql(op2default)
-        result = self.db.execute2df(rewritten_query)
-        return result
+        return rewriter.pure_sql(op2default)
+    
+    def _results(self, query, semantic_filters):
+        """ Computes a summary of possible query results.
+        
+        Results of retrieval queries are summarized in DuckDB,
+        without materializing each possible result. Results
+        are only materialized if they consist of one row each
+        and may therefore belong to an aggregation query.
+        
+        Args:
+            query: Represents a query with semantic operators.
+            semantic_filters: List of semantic filters.
+        
+        Returns:
+            Aggregate or retrieval results summarizing possible results.
+        """
+        queries = self._possible_queries(query, semantic_filters)
+        if not query.single_row:
+            retrieval_results = RetrievalResults(self.db, queries)
+            if any(nr_rows != 1 for nr_rows \
+                   in retrieval_results.row_counts):
+                return retrieval_results
+        
+        results = [self.db.execute2df(q) for q in queries]
+        if self._is_agg_results(results):
+            return AggregateResults(results)
+        else:
+            return RetrievalResults(self.db, queries)
+
+    def _schedule_filters(self, semantic_operators):
+        """ Selects filters to evaluate next in each chain of filters.
+        
+        Filters in a chain (i.e., conjunctive filters on the same
+        table) share rejected items. Filters that have not evaluated
+        any tasks yet are evaluated first to estimate their cost and
+        selectivity. Afterwards, only the filter with minimal cost
+        per rejected item is evaluated while others are deferred.
+        
+        Args:
+            semantic_operators: List of semantic operators used in the query.
+        """
+        for op in semantic_operators:
+            if not isinstance(op, UnaryFilter) or not op.sibling_filters:
+                continue
+            chain = [
+                f for f in semantic_operators \
+                if f is op or f in op.sibling_filters]
+            candidates = [
+                f for f in chain \
+                if f.counters.unprocessed_tasks > 0 and not f.fused]
+            unexplored = [f for f in candidates if f.nr_evaluated == 0]
+            if unexplored or not candidates:
+                op.deferred = op not in unexplored
+            else:
+                best_filter = min(
+                    candidates, key=lambda f: f.elimination_cost())
+                op.deferred = op is not best_filter
+    
+    def _wait_for_calls(self, semantic_operators):
+        """ Waits until one of the pending LLM calls finishes.
+        
+        Args:
+            semantic_operators: List of semantic operators used in the query.
+        """
+        futures = [
+            future for op in semantic_operators \
+            for future in op.pending_calls()]
+        if futures:
+            wait(futures, return_when=FIRST_COMPLETED)
 
     def run(self, query, constraints):
         """ Run an SQL query with natural language components.
@@ -173,16 +300,20 @@ class ExecutionEngine:
         error = float('inf')
         while error > 0:
             # Process more rows for each operator
+            self._schedule_filters(semantic_operators)
             for op in semantic_operators:
-                op.execute(None)
+                if self.streaming:
+                    op.execute_streaming(None)
+                else:
+                    op.execute(None)
             
-            results = self._results(query, semantic_operators)
+            # In streaming mode, LLM calls remain in flight meanwhile
+            aggregate_results = self._results(query, [
+                op for op in semantic_operators \
+                if not isinstance(op, FusedFilter)])
             
-            if self._is_agg_results(results):
-                aggregate_results = AggregateResults(results)
-            else:
-                aggregate_results = RetrievalResults(results)
-                nr_certain_rows = len(aggregate_results.intersection)
+            if isinstance(aggregate_results, RetrievalResults):
+                nr_certain_rows = aggregate_results.intersection_rows
                 if nr_certain_rows >= query.limit:
                     console.print(
                         Rule('Query Limit Reached'),
@@ -200,6 +331,14 @@ class ExecutionEngine:
             if constraints.terminate(
                 counter_sum, total_s, error):
                 break
+            
+            # Wait until at least one pending LLM call finishes
+            if self.streaming:
+                self._wait_for_calls(semantic_operators)
+        
+        # Calls still in flight do not contribute to the result
+        for op in semantic_operators:
+            op.cancel_pending()
         
         # Depending on the termination condition, we may
         # have processed only a subset of the data. In that
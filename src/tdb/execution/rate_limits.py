@@ -0,0 +1,203 @@
+'''
+Paces LLM calls according to per-model rate limits.
+'''
+import asyncio
+import random
+import time
+
+
+class TokenBucket():
+    """ Token bucket refilled continuously at a per-minute rate. """
+
+    def __init__(self, per_minute):
+        """
+        Initializes a full bucket.
+
+        Args:
+            per_minute (int): Number of tokens added per minute.
+        """
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.last_refill = time.monotonic()
+
+    def _refill(self, rate_factor):
+        """ Adds tokens accumulated since the last refill.
+
+        Args:
+            rate_factor (float): Scales the refill rate (adaptive backoff).
+        """
+        now = time.monotonic()
+        elapsed_s = now - self.last_refill
+        self.tokens = min(
+            self.capacity,
+            self.tokens + elapsed_s * self.rate * rate_factor)
+        self.last_refill = now
+
+    def debit(self, amount):
+        """ Removes tokens from the bucket (may become negative).
+
+        Args:
+            amount (float): Number of tokens to remove.
+        """
+        self.tokens -= amount
+
+    def wait_time(self, amount, rate_factor):
+        """ Calculates seconds until the given amount of tokens is available.
+
+        Args:
+            amount (float): Number of tokens required.
+            rate_factor (float): Scales the refill rate (adaptive backoff).
+
+        Returns:
+            float: Seconds to wait (zero if tokens are available).
+        """
+        self._refill(rate_factor)
+        amount = min(amount, self.capacity)
+        missing = amount - self.tokens
+        if missing <= 0:
+            return 0
+        return missing / (self.rate * rate_factor)
+
+
+class RateLimiter():
+    """ Paces LLM calls to stay within per-model rate limits.
+
+    Rate limits are specified in the model configuration, via
+    the optional "limits" property of each model entry (with
+    requests per minute as "rpm" and tokens per minute as "tpm").
+    Token consumption is estimated before each call and corrected
+    once the reply arrives. If the provider rejects calls due to
+    rate limits, the refill rate of the model's buckets decreases
+    and recovers gradually after successful calls.
+
+    The rate limiter is not thread-safe and must only be used
+    from the event loop of the LLM dispatcher.
+    """
+    # Rough token estimates for content without text representation
+    image_tokens = 765
+    audio_tokens_per_kb = 1
+    default_output_tokens = 100
+
+    # Parameters for adaptive backoff on rate limit errors
+    min_rate_factor = 0.1
+    decrease_factor = 0.7
+    recovery_step = 0.05
+    base_delay_s = 1
+    max_delay_s = 60
+
+    def __init__(self, models_config=None):
+        """
+        Initializes token buckets for models with configured limits.
+
+        Args:
+            models_config: None or content of model configuration file.
+        """
+        self.model2buckets = {}
+        self.model2factor = {}
+        models = [] if models_config is None \
+            else models_config['models']
+        for model in models:
+            limits = model.get('limits', {})
+            for kind_kwargs in model['kwargs'].values():
+                model_name = kind_kwargs['model']
+                buckets = self.model2buckets.setdefault(model_name, {})
+                for limit_type in ['rpm', 'tpm']:
+                    if limit_type in limits and limit_type not in buckets:
+                        buckets[limit_type] = TokenBucket(limits[limit_type])
+
+    def _rate_factor(self, model):
+        """ Retrieves the current factor scaling the rate limits of a model.
+
+        Args:
+            model (str): Name of the model.
+
+        Returns:
+            float: Factor between min_rate_factor and one.
+        """
+        return self.model2factor.get(model, 1.0)
+
+    def estimate_tokens(self, kwargs):
+        """ Estimates the number of tokens consumed by an LLM call.
+
+        Args:
+            kwargs (dict): Keyword arguments for the completion function.
+
+        Returns:
+            int: Estimated number of input and output tokens.
+        """
+        nr_tokens = 0
+        for message in kwargs['messages']:
+            content = message['content']
+            if isinstance(content, str):
+                content = [{'type': 'text', 'text': content}]
+            for content_part in content:
+                match content_part['type']:
+                    case 'text':
+                        nr_tokens += len(content_part['text']) // 4 + 1
+                    case 'image_url':
+                        nr_tokens += self.image_tokens
+                    case 'input_audio':
+                        audio_data = content_part['input_audio']['data']
+                        audio_kb = len(audio_data) * 3 / 4 / 1000
+                        nr_tokens += int(audio_kb * self.audio_tokens_per_kb)
+
+        max_output = kwargs.get(
+            'max_tokens', kwargs.get('max_completion_tokens'))
+        nr_tokens += self.default_output_tokens \
+            if max_output is None else max_output
+        return nr_tokens
+
+    async def acquire(self, model, nr_tokens):
+        """ Waits until the model's rate limits admit another call.
+
+        Args:
+            model (str): Name of the model to call.
+            nr_tokens (int): Estimated number of tokens for the call.
+        """
+        buckets = self.model2buckets.get(model, {})
+        rate_factor = self._rate_factor(model)
+        type2amount = {'rpm': 1, 'tpm': nr_tokens}
+        while True:
+            wait_s = max(
+                [bucket.wait_time(type2amount[limit_type], rate_factor) \
+                 for limit_type, bucket in buckets.items()], default=0)
+            if wait_s <= 0:
+                break
+            await asyncio.sleep(wait_s)
+
+        for limit_type, bucket in buckets.items():
+            bucket.debit(type2amount[limit_type])
+
+    def back_off(self, model, attempt):
+        """ Reduces the rate for a model after a rate limit error.
+
+        Args:
+            model (str): Name of the model that rejected a call.
+            attempt (int): Number of prior attempts for the same call.
+
+        Returns:
+            float: Seconds to wait before retrying the call.
+        """
+        rate_factor = self._rate_factor(model)
+        self.model2factor[model] = max(
+            self.min_rate_factor, rate_factor * self.decrease_factor)
+        delay_s = min(self.max_delay_s, self.base_delay_s * 2 ** attempt)
+        return delay_s * random.uniform(0.5, 1)
+
+    def record_success(self, model, nr_tokens, llm_reply):
+        """ Corrects token estimates and recovers rates after a call.
+
+        Args:
+            model (str): Name of the called model.
+            nr_tokens (int): Estimated number of tokens for the call.
+            llm_reply: Reply of the LLM (including token usage).
+        """
+        rate_factor = self._rate_factor(model)
+        self.model2factor[model] = min(
+            1.0, rate_factor + self.recovery_step)
+
+        usage = getattr(llm_reply, 'usage', None)
+        tpm_bucket = self.model2buckets.get(model, {}).get('tpm')
+        if usage is not None and tpm_bucket is not None:
+            tpm_bucket.debit(usage.total_tokens - nr_tokens)
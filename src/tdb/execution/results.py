@@ -6,7 +6,7 @@ Created on Jul 22, 2025
 import numpy as np
 import pandas as pd
 
-from tdb.ui.util import df2set, print_df
+from tdb.ui.util import print_df
 
 
 class PossibleResults():
@@ -21,7 +21,7 @@ class PossibleResults():
         Initializes the possible results with a list of results.
         
         Args:
-            results (list): List of possible query results.
+            results (list): List of possible query results (or queries).
         """
         self.results = results
     
@@ -119,35 +119,74 @@ class RetrievalResults(PossibleResults):
     that does not qualify as an aggregation query. I.e., the
     query may produce multiple result rows or some of the result
     fields are not of numerical type.
+    
+    Possible results are represented by the SQL queries producing
+    them. Intersections and row counts are calculated by DuckDB,
+    only rows that are output are materialized.
     """
-    def __init__(self, results):
+    def __init__(self, db, queries, preview_rows=10):
         """
-        Initializes the retrieval results with a list of results.
+        Initializes the retrieval results with a list of queries.
         
         Args:
-            results (list): List of retrieval results.
+            db: Database on which to evaluate queries.
+            queries (list): List of queries producing possible results.
+            preview_rows (int): Maximal number of rows to output.
         """
-        super().__init__(results)
-        self.intersection = self._intersect_results(results)
+        super().__init__(queries)
+        self.db = db
+        self.preview_rows = preview_rows
+        self.intersection_sql = self._intersection_sql(queries)
+        self.row_counts, self.max_rows, self.intersection_rows = \
+            self._count_rows(queries)
     
-    def _intersect_results(self, results):
-        """ Computes the intersection of all retrieval results.
+    def _count_rows(self, queries):
+        """ Counts rows of possible results and of their intersection.
+        
+        All counts are calculated in a single SQL statement, each
+        possible result is calculated only once.
         
         Args:
-            results: List of possible query results.
+            queries: List of queries producing possible results.
         
         Returns:
-            Set of common results across all retrieval results.
+            Tuple: row counts, maximal number of distinct rows, number
+            of rows in the intersection of all possible results.
         """
-        assert len(results) > 0, 'No results to intersect!'
-        columns = results[0].columns
-        common_results = df2set(results[0])
-        for result in results[1:]:
-            next_result = df2set(result)
-            common_results = common_results.intersection(
-                next_result)
+        variants_sql = ', '.join(
+            f'ThalamusDB_Variant{idx} AS MATERIALIZED ({query})' \
+            for idx, query in enumerate(queries))
+        variants = [
+            f'ThalamusDB_Variant{idx}' for idx in range(len(queries))]
+        intersection_sql = ' INTERSECT '.join(
+            f'SELECT * FROM {variant}' for variant in variants)
+        count_items = [
+            f'(SELECT COUNT(*) FROM ({intersection_sql}))']
+        for variant in variants:
+            count_items += [
+                f'(SELECT COUNT(*) FROM {variant})',
+                f'(SELECT COUNT(*) FROM (SELECT DISTINCT * FROM {variant}))']
+        count_sql = (
+            f'WITH {variants_sql} '
+            f'SELECT {", ".join(count_items)};')
+        counts = self.db.execute2list(count_sql)[0]
+        intersection_rows = counts[0]
+        row_counts = list(counts[1::2])
+        max_rows = max(counts[2::2])
+        return row_counts, max_rows, intersection_rows
+    
+    def _intersection_sql(self, queries):
+        """ Generates SQL query for the intersection of all results.
+        
+        Args:
+            queries: List of queries producing possible results.
         
-        return pd.DataFrame(common_results, columns=columns)
+        Returns:
+            str: SQL query retrieving rows that appear in all results.
+        """
+        assert len(queries) > 0, 'No results to intersect!'
+        return ' INTERSECT '.join(
+            f'SELECT * FROM ({query})' for query in queries)
     
     def error(self):
         """ Computes the error metric for the retrieval results.
@@ -161,24 +200,22 @@ class RetrievalResults(PossibleResults):
         """
         if not self.results:
             return 0.0
-        max_rows = max(len(df2set(result)) for result in self.results)
-        intersection_rows = len(self.intersection)
-        if max_rows == intersection_rows:
+        if self.max_rows == self.intersection_rows:
             return 0.0
-        if intersection_rows == 0:
+        if self.intersection_rows == 0:
             return float('inf')
-        # print('Results:')
-        # for result in self.results:
-        #     print(result)
-        error = max_rows / intersection_rows - 1
+        error = self.max_rows / self.intersection_rows - 1
         return error
     
     def output(self):
-        """ Outputs the intersection of all retrieval results. """
+        """ Outputs rows that appear in all retrieval results. """
+        preview = self.db.execute2df(
+            f'SELECT * FROM ({self.intersection_sql}) '
+            f'LIMIT {self.preview_rows}')
         print_df(
-            self.intersection, 
+            preview, 
             'Rows that Appear in Each Possible Result')
-        print(f'Total #certain rows: {len(self.intersection)}')
+        print(f'Total #certain rows: {self.intersection_rows}')
     
     def result(self):
         """ Use the intersection as our best guess result.
@@ -186,4 +223,4 @@ class RetrievalResults(PossibleResults):
         Returns:
             Rows that appear in all possible results.
         """
-        return self.intersection
\ No newline at end of file
+        return self.db.execute2df(self.intersection_sql)
\ No newline at end of file
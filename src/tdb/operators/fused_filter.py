@@ -0,0 +1,230 @@
+'''
+Evaluates multiple semantic filters on the same column via shared LLM calls.
+'''
+import re
+
+from tdb.operators.semantic_filter import UnaryFilter
+from tdb.queries.query import UnaryPredicate
+
+
+class FusedFilter(UnaryFilter):
+    """ Evaluates all conditions of several filters on one column.
+
+    Each LLM call evaluates all filter conditions on the same items
+    and returns one verdict per item and condition. Verdicts are
+    written into the temporary tables of the fused filters, which
+    are otherwise not executed. The fused filters apply to the same
+    table alias and column (with the same pure SQL predicates) so
+    their temporary tables share task IDs.
+    """
+    def __init__(
+            self, db, operator_ID, batch_size,
+            config_path, query, filters,
+            cache=None, dispatcher=None):
+        """ Initializes the fused filter.
+
+        Args:
+            db: Database containing the filtered table.
+            operator_ID (str): Unique identifier for the operator.
+            batch_size (int): Number of items to process per call.
+            config_path (str): Path to the configuration file for models.
+            query: Query containing the predicates.
+            filters: Unary filters on the same alias and column.
+            cache: None or cache for verdicts across queries.
+            dispatcher: Dispatches LLM calls (None to create a new one).
+        """
+        first_filter = filters[0]
+        predicate = UnaryPredicate(
+            table=first_filter.filtered_table,
+            alias=first_filter.filtered_alias,
+            column=first_filter.filtered_column,
+            condition=' and '.join(f.filter_condition for f in filters),
+            sql=' AND '.join(f.filter_sql for f in filters))
+        super().__init__(
+            db, operator_ID, batch_size, config_path,
+            query, predicate, cache, dispatcher)
+        self.filters = filters
+        self.tmp_table = first_filter.tmp_table
+        for fused_filter in filters:
+            fused_filter.fused = True
+            fused_filter.prompt_conditions = [
+                f.filter_condition for f in filters]
+
+    def _apply_merges(self, merges):
+        """ Merge tasks of duplicate files in the tables of all fused filters.
+
+        Args:
+            merges (dict): Maps IDs of merged tasks to IDs of first duplicates.
+        """
+        for fused_filter in self.filters:
+            fused_filter._apply_merges(merges)
+
+    def _batch_message(self, item_texts):
+        """ Create a message for the LLM evaluating multiple items.
+
+        Args:
+            item_texts: List of items to evaluate.
+
+        Returns:
+            dict: Message for the LLM.
+        """
+        task = (
+            'For each of the items below, determine which of the '
+            'following conditions it satisfies. Write one line per '
+            'item, containing the item ID, a colon, and one digit per '
+            'condition in the order of the conditions (1 if satisfied, '
+            '0 otherwise). Sample output: "I0:10\nI1:01". Conditions: '
+            + self._conditions_text())
+        content = [{'type': 'text', 'text': task}]
+        for item_idx, item_text in enumerate(item_texts):
+            content.append({'type': 'text', 'text': f'I{item_idx}:'})
+            content.append(self._encode_item(item_text))
+        return {'role': 'user', 'content': content}
+
+    def _completion_kwargs(self, item_texts):
+        """ Prepare keyword arguments of the LLM call evaluating items.
+
+        Args:
+            item_texts: List of items to evaluate in one call.
+
+        Returns:
+            dict: Keyword arguments for the completion function.
+        """
+        if len(item_texts) == 1:
+            messages = [self._message(item_texts[0])]
+        else:
+            messages = [self._batch_message(item_texts)]
+        base = self._best_model_args(messages)['filter']
+        # Replies contain one digit per condition
+        base = {
+            k: v for k, v in base.items() \
+            if k not in ['max_tokens', 'logit_bias']}
+        return {**base, 'messages': messages}
+
+    def _conditions_text(self):
+        """ Lists the conditions of all fused filters.
+
+        Returns:
+            str: Numbered list of conditions.
+        """
+        return ' '.join(
+            f'C{condition_idx}: "{f.filter_condition}".' \
+            for condition_idx, f in enumerate(self.filters))
+
+    def _extract_results(self, item_texts, kwargs, response):
+        """ Extract evaluation results from the LLM reply.
+
+        Also updates cost counters for the LLM call. Replies for
+        single items must consist of exactly one digit per condition.
+
+        Args:
+            item_texts: List of items evaluated in the LLM call.
+            kwargs (dict): Keyword arguments of the LLM call.
+            response: Reply of the LLM.
+
+        Returns:
+            List of tuples with one Boolean result per condition.
+
+        Raises:
+            ValueError: if the reply cannot be parsed.
+        """
+        model = kwargs['model']
+        self.update_cost_counters(model, response)
+        content = str(response.choices[0].message.content)
+        nr_conditions = len(self.filters)
+        if len(item_texts) == 1:
+            digits = content.strip().strip('."\'').strip()
+            if not re.fullmatch(f'[01]{{{nr_conditions}}}', digits):
+                raise ValueError(f'Invalid verdicts: {content}')
+            return [tuple(digit == '1' for digit in digits)]
+
+        # Parse one line with digits per item
+        item2results = {}
+        for item_ref, digits in re.findall(r'I(\d+)\s*:\s*([01]+)', content):
+            item_idx = int(item_ref)
+            if item_idx >= len(item_texts):
+                raise ValueError(f'Unknown item ID: I{item_ref}')
+            if len(digits) != nr_conditions:
+                raise ValueError(f'Invalid verdicts for I{item_ref}: {digits}')
+            item2results[item_idx] = tuple(digit == '1' for digit in digits)
+        if len(item2results) != len(item_texts):
+            raise ValueError(f'Missing items in reply: {content}')
+        return [item2results[item_idx] for item_idx in range(len(item_texts))]
+
+    def _message(self, item_text):
+        """ Create a message for the LLM describing the evaluation task.
+
+        Args:
+            item_text (str): Text representation of the item.
+
+        Returns:
+            dict: Message for the LLM.
+        """
+        question = (
+            'Does the following item satisfy each of the conditions '
+            'below? Answer with one digit per condition in the order '
+            'of the conditions (1 for yes, 0 for no), e.g., "10". '
+            'Conditions: ' + self._conditions_text())
+        return {
+            'role': 'user',
+            'content': [
+                {'type': 'text', 'text': question},
+                self._encode_item(item_text)]}
+
+    def _reject_tasks(self, excluded_ids=()):
+        """ Resolve tasks whose items are rejected by sibling filters.
+
+        Args:
+            excluded_ids: IDs of tasks to skip (e.g., tasks in flight).
+        """
+        for fused_filter in self.filters:
+            fused_filter._reject_tasks(excluded_ids)
+
+    def _unresolved_sql(self):
+        """ Returns SQL condition selecting tasks that need evaluation.
+
+        Returns:
+            str: SQL condition selecting tasks unresolved for any filter.
+        """
+        unresolved_sql = ' UNION '.join(
+            f'SELECT task_id FROM {f.tmp_table} WHERE result IS NULL' \
+            for f in self.filters)
+        return f'task_id IN ({unresolved_sql})'
+
+    def _write_results(self, task_ids, item_texts, results):
+        """ Write back verdicts into the tables of the fused filters.
+
+        Verdicts only apply to tasks that are unresolved for the
+        associated filter (e.g., tasks may have been resolved via
+        cached verdicts).
+
+        Args:
+            task_ids: List of evaluated task IDs.
+            item_texts: List of evaluated items (same order as task IDs).
+            results: List of tuples with one result per condition.
+        """
+        for condition_idx, fused_filter in enumerate(self.filters):
+            unresolved_ids = set(
+                row[0] for row in self.db.execute2list(
+                    f'SELECT DISTINCT task_id FROM {fused_filter.tmp_table} '
+                    'WHERE result IS NULL'))
+            verdicts = [
+                (task_id, item_text, task_results[condition_idx]) \
+                for task_id, item_text, task_results \
+                in zip(task_ids, item_texts, results) \
+                if task_id in unresolved_ids]
+            if verdicts:
+                fused_filter._write_results(
+                    [task_id for task_id, _, _ in verdicts],
+                    [item_text for _, item_text, _ in verdicts],
+                    [result for _, _, result in verdicts])
+
+    def prepare(self):
+        """ Fused filters use the temporary tables of the fused filters.
+
+        Hence, this method assumes that fused filters are prepared
+        first and only initializes counters (all tasks are counted
+        by the fused filters).
+        """
+        self.counters.processed_tasks = 0
+        self.counters.unprocessed_tasks = 0
@@ -6,35 +6,22 @@ Created on Jul 16, 2025
 @rewrite: Jiale Lao
 Rewritten to use multi-threading (ThreadPoolExecutor) instead of multi-processing.
 '''
-import litellm
-from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
 
-from litellm import completion
 from tdb.operators.semantic_operator import SemanticOperator
 
 
-def _filter_completion_wrapper(item_text, kwargs):
-    """Invoke completion function with given keyword arguments.
-
-    Args:
-        item_text (str): Text representation of the item.
-        kwargs (dict): Keyword arguments for the completion function.
+class UnaryFilter(SemanticOperator):
+    """Base class for unary filters specified in natural language.
 
-    Returns:
-        tuple: (item_text, kwargs, LLM response).
+    LLM calls are issued via the (asyncio-based) LLM dispatcher that
+    is shared by all semantic operators.
     """
-    # Ensure parameters are dropped for logging where applicable
-    litellm.drop_params = True
-    response = completion(**kwargs)
-    return item_text, kwargs, response
-
-
-class UnaryFilter(SemanticOperator):
-    """Base class for unary filters specified in natural language."""
 
     def __init__(
             self, db, operator_ID, batch_size,
-            config_path, query, predicate):
+            config_path, query, predicate, 
+            cache=None, dispatcher=None):
         """
         Initializes the unary filter.
 
@@ -45,51 +32,218 @@ class UnaryFilter(SemanticOperator):
             config_path (str): Path to the configuration file for models.
             query: Query containing the predicate.
             predicate: predicate expressed in natural language.
+            cache: None or cache for verdicts across queries.
+            dispatcher: Dispatches LLM calls (None to create a new one).
         """
-        super().__init__(db, operator_ID, batch_size, config_path)
+        super().__init__(
+            db, operator_ID, batch_size, config_path, 
+            cache, dispatcher)
         self.query = query
         self.filtered_table = predicate.table
         self.filtered_alias = predicate.alias
         self.filtered_column = predicate.column
         self.filter_condition = predicate.condition
         self.filter_sql = predicate.sql
+        self.conjunctive = predicate.conjunctive
         self.tmp_table = f'ThalamusDB_{self.operator_ID}'
+        self.sibling_filters = []
+        self.deferred = False
+        self.fused = False
+        self.prompt_conditions = [self.filter_condition]
+        self.nr_evaluated = 0
+        self.nr_satisfied = 0
+        self.key2task = {}
+        self.task2result = {}
+
+    def _apply_merges(self, merges):
+        """Assign tasks of duplicate files the IDs of their first duplicates.
+
+        Merged tasks adopt verdicts known for any task they merge
+        with (e.g., verdicts of evaluated tasks). Otherwise, merged
+        tasks are evaluated once, unless all their rows are rejected
+        by sibling filters. Task counters are updated accordingly.
 
-    def _evaluate_predicate_parallel(self, item_texts):
-        """Evaluates the filter conditions using the LLM concurrently (threads).
+        Args:
+            merges (dict): Maps IDs of merged tasks to IDs of first duplicates.
+        """
+        target_ids = sorted(set(merges.values()))
+        before = self._task_states(list(merges) + target_ids)
+        merges_df = pd.DataFrame({
+            'task_id': list(merges.keys()),
+            'new_id': list(merges.values())})
+        merges_view = f'{self.tmp_table}_Merges'
+        self.db.register(merges_view, merges_df)
+        try:
+            self.db.execute2list(
+                f'UPDATE {self.tmp_table} SET task_id = m.new_id '
+                f'FROM {merges_view} m '
+                f'WHERE {self.tmp_table}.task_id = m.task_id')
+        finally:
+            self.db.unregister(merges_view)
+
+        # Adopt known verdicts, preferring verdicts of first duplicates
+        target2result = {}
+        for task_id, target_id in [
+                *zip(target_ids, target_ids), *merges.items()]:
+            if task_id in self.task2result:
+                target2result.setdefault(target_id, self.task2result[task_id])
+        if target2result:
+            self._update_results(
+                list(target2result.keys()), list(target2result.values()))
+
+        # Evaluate tasks with rows that are not rejected by sibling filters
+        id_list = ', '.join(map(str, target_ids))
+        self.db.execute2list(
+            f'UPDATE {self.tmp_table} SET result = NULL, simulated = NULL '
+            f'WHERE task_id IN ({id_list}) AND task_id IN ('
+            f'SELECT task_id FROM {self.tmp_table} WHERE result IS NULL)')
+
+        after = self._task_states(target_ids)
+        self.counters.unprocessed_tasks += after[0] - before[0]
+        self.counters.processed_tasks += after[1] - before[1]
+        self.counters.pruned_tasks += after[2] - before[2]
+
+    def _batch_message(self, item_texts):
+        """Create a message for the LLM evaluating multiple items.
 
         Args:
             item_texts: List of items to evaluate.
 
         Returns:
-            List of tuples (item_text, result) where result is True or False.
+            dict: Message for the LLM.
         """
-        # Prepare keyword inputs for completion function
-        inputs = []
-        for item_text in item_texts:
-            messages = [self._message(item_text)]
+        task = (
+            'Identify the items that satisfy the condition '
+            f'"{self.filter_condition}". '
+            'Write only the IDs of those items (e.g., "I3"), '
+            'separated by commas. Write "." after the last ID. '
+            'Sample output: "I0,I3,I4." The output may be empty.')
+        content = [{'type': 'text', 'text': task}]
+        for item_idx, item_text in enumerate(item_texts):
+            content.append({'type': 'text', 'text': f'I{item_idx}:'})
+            content.append(self._encode_item(item_text))
+        return {'role': 'user', 'content': content}
+
+    def _cache_keys(self, item_texts):
+        """Computes keys of cached verdicts for given items.
+
+        Args:
+            item_texts: List of items to evaluate.
+
+        Returns:
+            Data frame associating items with keys of cached verdicts.
+        """
+        modalities = [
+            self._item_modality(item_text) for item_text in item_texts]
+        contexts = [
+            self._cache_context(
+                'filter', [modality], self.filter_condition,
+                self._prompt_format(modality))
+            for modality in modalities]
+        fingerprints = [
+            self._item_fingerprint(item_text)
+            for item_text in item_texts]
+        return pd.DataFrame({
+            'item': item_texts,
+            'context': contexts,
+            'left_item': fingerprints,
+            'right_item': ''})
+
+    def _completion_kwargs(self, item_texts):
+        """Prepare keyword arguments of the LLM call evaluating items.
+
+        Args:
+            item_texts: List of items to evaluate in one call.
+
+        Returns:
+            dict: Keyword arguments for the completion function.
+        """
+        if len(item_texts) == 1:
+            messages = [self._message(item_texts[0])]
+            base = self._best_model_args(messages)['filter']
+        else:
+            messages = [self._batch_message(item_texts)]
             base = self._best_model_args(messages)['filter']
-            kwargs = {**base, 'messages': messages}
-            inputs.append((item_text, kwargs))
-
-        # Use a thread pool to evaluate predicates concurrently
-        # Threads are appropriate here since LLM calls are I/O-bound.
-        with ThreadPoolExecutor(max_workers=self.batch_size) as executor:
-            futures = [executor.submit(_filter_completion_wrapper, it, kw)
-                       for (it, kw) in inputs]
-            inputs_outputs = [f.result() for f in futures]
-
-        # Update cost counters
-        for _, kwargs, response in inputs_outputs:
-            model = kwargs['model']
-            self.update_cost_counters(model, response)
-
-        # Extract evaluation results
-        results = []
-        for item_text, _, response in inputs_outputs:
-            result = str(response.choices[0].message.content)
-            results.append((item_text, result == '1'))
+            # Replies list item IDs, rather than a single token
+            base = {
+                k: v for k, v in base.items() \
+                if k not in ['max_tokens', 'logit_bias']}
+        return {**base, 'messages': messages}
+
+    def _evaluate_predicate_parallel(self, item_texts):
+        """Evaluates the filter conditions using the LLM concurrently.
+
+        Items are grouped into batches, evaluated via one LLM call
+        per batch. Items of batches whose reply cannot be parsed
+        are evaluated again, using one LLM call per item. Items
+        whose replies in calls for single items cannot be parsed
+        remain unresolved.
+
+        Args:
+            item_texts: List of items to evaluate.
+
+        Returns:
+            List of tuples (item_text, result) for resolved items.
+        """
+        item2result = {}
+        batches = self._item_batches(item_texts)
+        while batches:
+            # Submit all calls to the shared dispatcher and wait for replies
+            kwargs_list = [self._completion_kwargs(b) for b in batches]
+            responses = self.dispatcher.complete_all(kwargs_list)
+
+            # Extract evaluation results, retry failed batches per item
+            failed_batches = []
+            for batch, kwargs, response in zip(
+                    batches, kwargs_list, responses):
+                try:
+                    results = self._extract_results(batch, kwargs, response)
+                    item2result.update(zip(batch, results))
+                except ValueError:
+                    self.counters.parse_failures += 1
+                    if len(batch) > 1:
+                        failed_batches += [[item] for item in batch]
+            batches = failed_batches
+
+        return [
+            (item_text, item2result[item_text]) \
+            for item_text in item_texts if item_text in item2result]
+
+    def _extract_results(self, item_texts, kwargs, response):
+        """Extract evaluation results from the LLM reply.
+
+        Also updates cost counters for the LLM call.
+
+        Args:
+            item_texts: List of items evaluated in the LLM call.
+            kwargs (dict): Keyword arguments of the LLM call.
+            response: Reply of the LLM.
 
+        Returns:
+            List of Boolean results (same order as items).
+
+        Raises:
+            ValueError: if the reply for multiple items cannot be parsed.
+        """
+        model = kwargs['model']
+        self.update_cost_counters(model, response)
+        content = str(response.choices[0].message.content)
+        if len(item_texts) == 1:
+            return [content == '1']
+
+        # Parse comma-separated list of IDs of satisfying items
+        nr_items = len(item_texts)
+        results = [False] * nr_items
+        content = content.strip().rstrip('.').strip()
+        if content:
+            for item_ref in content.split(','):
+                item_ref = item_ref.strip()
+                if not (item_ref[:1] == 'I' and item_ref[1:].isdigit()):
+                    raise ValueError(f'Invalid item ID: {item_ref}')
+                item_idx = int(item_ref[1:])
+                if item_idx >= nr_items:
+                    raise ValueError(f'Unknown item ID: {item_ref}')
+                results[item_idx] = True
         return results
 
     def _gpt_filter_bias(self, model):
@@ -106,6 +260,67 @@ class UnaryFilter(SemanticOperator):
         else:
             return {}
 
+    def _item_batches(self, item_texts):
+        """Groups items into batches for evaluation via one LLM call each.
+
+        Batches contain items of the same data type. The batch size
+        is configured per data type in the model configuration (one
+        item per call by default).
+
+        Args:
+            item_texts: List of items to evaluate.
+
+        Returns:
+            List of batches (lists of items).
+        """
+        batch_sizes = self.models.get('filter_batch_sizes', {})
+        modality2items = {}
+        for item_text in item_texts:
+            modality = self._item_modality(item_text)
+            modality2items.setdefault(modality, []).append(item_text)
+
+        batches = []
+        for modality, items in modality2items.items():
+            batch_size = batch_sizes.get(modality, 1)
+            for start_idx in range(0, len(items), batch_size):
+                batches.append(items[start_idx:start_idx + batch_size])
+        return batches
+
+    def _max_batch_size(self):
+        """Determine the maximal number of items evaluated per LLM call.
+
+        Returns:
+            int: Maximal batch size over all data types.
+        """
+        batch_sizes = self.models.get('filter_batch_sizes', {})
+        return max(batch_sizes.values(), default=1)
+
+    def _merge_duplicates(self, tasks):
+        """Merge retrieved tasks referring to duplicate files.
+
+        Rows referring to files with the same content (or similar
+        images, if perceptual deduplication is enabled) share one
+        task. Files are hashed when their tasks are retrieved for
+        evaluation, not up front. Tasks of duplicates merge into
+        the first task retrieved for the same file content.
+
+        Args:
+            tasks: List of tuples (task ID, item text).
+
+        Returns:
+            List of retrieved tasks that were not merged.
+        """
+        merges = {}
+        for task_id, item_text in tasks:
+            if self._item_modality(item_text) != 'text':
+                duplicate_key = self._duplicate_key(item_text)
+                target_id = self.key2task.setdefault(duplicate_key, task_id)
+                if target_id != task_id:
+                    merges[task_id] = target_id
+        if merges:
+            self._apply_merges(merges)
+        return [task for task in tasks if task[0] not in merges]
+
     def _message(self, item_text):
         """Create a message for the LLM describing the evaluation task.
 
@@ -132,82 +347,369 @@ class UnaryFilter(SemanticOperator):
         }
         return message
 
-    def _retrieve_items(self, nr_rows, order):
+    def _next_tasks(self, nr_calls, order, excluded_ids=()):
+        """Retrieve tasks to evaluate via the given number of LLM calls.
+
+        Args:
+            nr_calls (int): Maximal number of LLM calls.
+            order (tuple): None or tuple (filtered column, ascending flag).
+            excluded_ids: IDs of tasks to skip (e.g., tasks in flight).
+
+        Returns:
+            List of batches, each a list of tuples (task ID, item text).
+        """
+        nr_rows = nr_calls * self._max_batch_size()
+        tasks = self._retrieve_items(nr_rows, order, excluded_ids)
+        # Evaluate duplicate files only once
+        tasks = self._merge_duplicates(tasks)
+        item2task = {item_text: task_id for task_id, item_text in tasks}
+        batches = self._item_batches(list(item2task.keys()))[:nr_calls]
+        return [
+            [(item2task[item_text], item_text) for item_text in batch] \
+            for batch in batches]
+
+    def _prompt_format(self, modality):
+        """Describes the format of prompts evaluating items of a data type.
+
+        Verdicts obtained via different prompt formats (e.g., prompts
+        evaluating multiple items or conditions) are cached separately.
+
+        Args:
+            modality (str): Data type of the items.
+
+        Returns:
+            None for prompts evaluating one item and one condition,
+            otherwise the batch size and the evaluated conditions.
+        """
+        batch_sizes = self.models.get('filter_batch_sizes', {})
+        batch_size = batch_sizes.get(modality, 1)
+        if batch_size == 1 and len(self.prompt_conditions) == 1:
+            return None
+        return {'batch_size': batch_size, 'conditions': self.prompt_conditions}
+
+    def _reject_tasks(self, excluded_ids=()):
+        """Resolve tasks whose items are rejected by sibling filters.
+
+        Sibling filters are semantic filters on the same table that
+        must be satisfied by all result rows. If each row containing
+        an item is rejected by a sibling filter (or violates pure SQL
+        predicates), the item cannot appear in the query result and
+        is marked as not satisfying the filter, without evaluation.
+
+        Args:
+            excluded_ids: IDs of tasks to skip (e.g., tasks in flight).
+        """
+        if not self.sibling_filters:
+            return
+
+        alias = self.filtered_alias
+        column = f'{alias}.{self.filtered_column}'
+        other_filters = self.query.alias2unary_sql[alias]
+        sibling_sql = ' AND '.join(
+            f'{alias}.{f.filtered_column} IN ('
+            f'SELECT base_{f.filtered_column} FROM {f.tmp_table} '
+            'WHERE result IS NULL OR result)' \
+            for f in self.sibling_filters)
+        exclude_sql = '' if not excluded_ids else \
+            f'AND task_id NOT IN ({", ".join(map(str, excluded_ids))}) '
+        reject_condition = (
+            'WHERE result IS NULL '
+            f'{exclude_sql}'
+            'AND task_id NOT IN ('
+            f'SELECT task_id FROM {self.tmp_table} '
+            f'WHERE base_{self.filtered_column} IN ('
+            f'SELECT {column} '
+            f'FROM {self.filtered_table} AS {alias} '
+            f'WHERE {other_filters.sql()} AND {column} IS NOT NULL '
+            f'AND {sibling_sql}))')
+        nr_rejected = self.db.execute2list(
+            f'SELECT COUNT(DISTINCT task_id) FROM {self.tmp_table} '
+            f'{reject_condition}')[0][0]
+        if nr_rejected > 0:
+            self.db.execute2list(
+                f'UPDATE {self.tmp_table} '
+                'SET result = FALSE, simulated = FALSE '
+                f'{reject_condition}')
+            self.counters.pruned_tasks += nr_rejected
+            self.counters.unprocessed_tasks -= nr_rejected
+
+    def _retrieve_items(self, nr_rows, order, excluded_ids=()):
         """Retrieve items to process next from the filtered table.
 
         This method is used to retrieve items from the filtered table
-        based on the specified number of rows and order.
+        based on the specified number of rows and order. Each item is
+        retrieved at most once, together with its task ID.
 
         Args:
-            nr_rows (int): Number of rows to retrieve.
-            order (tuple): None or tuple (column, ascending flag).
+            nr_rows (int): Number of rows to retrieve (None for all rows).
+            order (tuple): None or tuple (filtered column, ascending flag).
+            excluded_ids: IDs of tasks to skip (e.g., tasks in flight).
+
+        Returns:
+            List of tuples (task ID, item text).
         """
-        # Retrieve items from the filtered table
-        order_sql = '' if order is None \
-            else f'ORDER BY {order[0]} {"ASC" if order[1] else "DESC"}'
+        # Prioritize tasks resolving many rows of the filtered table
+        column = f'base_{self.filtered_column}'
+        order_sql = 'ORDER BY nr_rows DESC, task_id' if order is None \
+            else f'ORDER BY base_{order[0]} {"ASC" if order[1] else "DESC"}'
+        limit_sql = '' if nr_rows is None else f'LIMIT {nr_rows}'
+        exclude_sql = '' if not excluded_ids else \
+            f'AND task_id NOT IN ({", ".join(map(str, excluded_ids))}) '
         sql = (
-            f'SELECT base_{self.filtered_column} FROM {self.tmp_table} '
-            'WHERE result IS NULL '
-            f'{order_sql} LIMIT {nr_rows}')
+            f'SELECT task_id, {column} FROM ('
+            f'SELECT task_id, {column}, '
+            'SUM(multiplicity) OVER (PARTITION BY task_id) AS nr_rows, '
+            'row_number() OVER '
+            f'(PARTITION BY task_id ORDER BY {column}) AS task_rank '
+            f'FROM {self.tmp_table} '
+            f'WHERE {self._unresolved_sql()} '
+            f'{exclude_sql}) '
+            'WHERE task_rank = 1 '
+            f'{order_sql} {limit_sql}')
         rows = self.db.execute2list(sql)
-        return [row[0] for row in rows]
+        return [(row[0], row[1]) for row in rows]
+
+    def _submit(self, tasks):
+        """Submit an LLM call evaluating the given tasks.
+
+        Args:
+            tasks: List of tuples (task ID, item text).
+        """
+        task_ids = tuple(task_id for task_id, _ in tasks)
+        item_texts = [item_text for _, item_text in tasks]
+        kwargs = self._completion_kwargs(item_texts)
+        future = self.dispatcher.submit(kwargs)
+        self.in_flight[task_ids] = (item_texts, [kwargs], [future])
+
+    def _task_states(self, task_ids):
+        """Count tasks with given IDs by their evaluation state.
+
+        Args:
+            task_ids: List of task IDs.
+
+        Returns:
+            Tuple with numbers of unresolved tasks, tasks with known
+            verdicts, and tasks rejected by sibling filters.
+        """
+        id_list = ', '.join(map(str, task_ids))
+        rows = self.db.execute2list(
+            'SELECT task_id, BOOL_OR(result IS NULL) '
+            f'FROM {self.tmp_table} WHERE task_id IN ({id_list}) '
+            'GROUP BY task_id')
+        nr_unresolved = sum(1 for _, unresolved in rows if unresolved)
+        nr_verdicts = sum(
+            1 for task_id, unresolved in rows \
+            if not unresolved and task_id in self.task2result)
+        nr_rejected = len(rows) - nr_unresolved - nr_verdicts
+        return nr_unresolved, nr_verdicts, nr_rejected
+
+    def _unresolved_sql(self):
+        """Returns SQL condition selecting tasks that need evaluation.
+
+        Returns:
+            str: SQL condition on rows of the temporary table.
+        """
+        return 'result IS NULL'
+
+    def _update_results(self, task_ids, results):
+        """Write results for multiple tasks into the temporary table.
+
+        Args:
+            task_ids: List of task IDs.
+            results: List of Boolean results (same order as task IDs).
+        """
+        self.task2result.update(zip(task_ids, results))
+        results_df = pd.DataFrame({
+            'task_id': task_ids,
+            'result': results})
+        results_view = f'{self.tmp_table}_Results'
+        self.db.register(results_view, results_df)
+        try:
+            update_sql = (
+                f'UPDATE {self.tmp_table} '
+                f'SET result = r.result, simulated = r.result '
+                f'FROM {results_view} r '
+                f'WHERE {self.tmp_table}.task_id = r.task_id')
+            self.db.execute2list(update_sql)
+        finally:
+            self.db.unregister(results_view)
+
+    def _use_cached_results(self):
+        """Fill in results of items with cached verdicts."""
+        tasks = self._retrieve_items(None, None)
+        task_ids = [task_id for task_id, _ in tasks]
+        item_texts = [item_text for _, item_text in tasks]
+        keys_df = self._cache_keys(item_texts)
+        keys_df['task_id'] = task_ids
+        hits_df = self.cache.lookup(keys_df)
+        self.counters.cache_hits += len(hits_df)
+        self.counters.cache_misses += len(item_texts) - len(hits_df)
+        self._update_results(
+            hits_df['task_id'].tolist(), hits_df['result'].tolist())
+
+    def _write_results(self, task_ids, item_texts, results):
+        """Write back results of evaluated tasks and update counters.
+
+        Args:
+            task_ids: List of evaluated task IDs.
+            item_texts: List of evaluated items (same order as task IDs).
+            results: List of Boolean results (same order as task IDs).
+        """
+        # Update results in the temporary table (one statement)
+        self._update_results(task_ids, results)
+        # Store new verdicts for future queries
+        if self.cache is not None:
+            verdicts_df = self._cache_keys(item_texts)
+            verdicts_df['result'] = results
+            self.cache.store(verdicts_df)
+        # Update task counters
+        self.counters.processed_tasks += len(task_ids)
+        self.counters.unprocessed_tasks -= len(task_ids)
+        self.nr_evaluated += len(task_ids)
+        self.nr_satisfied += sum(1 for result in results if result)
 
     def prepare(self):
         """Prepare for execution by creating intermediate result table.
 
-        The temporary table contains the columns of the filtered table,
-        as well as columns storing the result of filter evaluations (via
-        LLMs) and a result used for simulating optimizer choices.
+        The temporary table contains one row for each distinct value
+        in the filtered column (after applying pure SQL predicates),
+        together with the number of rows containing that value, the
+        result of filter evaluations (via LLMs), and a result used for
+        simulating optimizer choices. Tasks referring to duplicate
+        files are merged once they are retrieved for evaluation.
         """
-        base_columns = self.db.columns(self.filtered_table)
-        temp_schema_parts = ['result BOOLEAN', 'simulated BOOLEAN']
-        for col_name, col_type in base_columns:
-            tmp_col_name = f'base_{col_name}'
-            temp_schema_parts.append(f'{tmp_col_name} {col_type}')
-
-        create_table_sql = \
-            f'CREATE OR REPLACE TEMPORARY TABLE {self.tmp_table}(' + \
-            ', '.join(temp_schema_parts) + ')'
+        # Column names are case-insensitive
+        column2type = {
+            column.lower(): column_type for column, column_type \
+            in self.db.columns(self.filtered_table)}
+        column_type = column2type[self.filtered_column.lower()]
+        create_table_sql = (
+            f'CREATE OR REPLACE TEMPORARY TABLE {self.tmp_table}('
+            'task_id INTEGER, '
+            f'base_{self.filtered_column} {column_type}, '
+            'multiplicity BIGINT, result BOOLEAN, simulated BOOLEAN)')
         self.db.execute2list(create_table_sql)
 
         # Use pure SQL predicates for pruning, if available
         other_filters = self.query.alias2unary_sql[self.filtered_alias]
-        where_sql = (
-            f'WHERE {other_filters.sql()} '
-            f'AND {self.filtered_column} IS NOT NULL')
-        fill_table_sql = \
-            f'INSERT INTO {self.tmp_table} ' + \
-            'SELECT NULL, NULL, ' + \
-            ', '.join(c[0] for c in base_columns) + ' ' + \
-            'FROM ' + self.filtered_table + ' ' + \
-            where_sql
+        column = f'{self.filtered_alias}.{self.filtered_column}'
+        fill_table_sql = (
+            f'INSERT INTO {self.tmp_table} '
+            f'SELECT DENSE_RANK() OVER (ORDER BY {column}), '
+            f'{column}, COUNT(*), NULL, NULL '
+            f'FROM {self.filtered_table} AS {self.filtered_alias} '
+            f'WHERE {other_filters.sql()} AND {column} IS NOT NULL '
+            f'GROUP BY {column}')
         self.db.execute2list(fill_table_sql)
 
-        # Initialize count of unprocessed tasks
-        count_sql = f'SELECT COUNT(*) FROM {self.tmp_table}'
+        # Duplicate files are merged once retrieved for evaluation
+        self.key2task = {}
+        self.task2result = {}
+
+        # Reuse verdicts from prior queries, if available
+        if self.cache is not None:
+            self._use_cached_results()
+
+        # Initialize counts of processed and unprocessed tasks
+        count_sql = (
+            'SELECT COUNT(DISTINCT task_id) FILTER (result IS NOT NULL), '
+            'COUNT(DISTINCT task_id) FILTER (result IS NULL) '
+            f'FROM {self.tmp_table}')
         count_result = self.db.execute2list(count_sql)
-        self.counters.unprocessed_tasks = count_result[0][0]
+        self.counters.processed_tasks = count_result[0][0]
+        self.counters.unprocessed_tasks = count_result[0][1]
+        self.nr_evaluated = 0
+        self.nr_satisfied = 0
+
+    def elimination_cost(self):
+        """Estimate LLM tokens consumed per item rejected by the filter.
+
+        The estimate is based on tokens per evaluated task and on
+        the fraction of evaluated tasks that satisfy the filter.
+        Only tasks evaluated via LLM calls of this filter count
+        (i.e., not tasks resolved via cached verdicts or rejected
+        by sibling filters). Filters with low elimination cost are
+        preferably evaluated before sibling filters.
+
+        Returns:
+            Estimated number of tokens per rejected item.
+        """
+        selectivity = (self.nr_satisfied + 1) / (self.nr_evaluated + 2)
+        nr_tokens = self.counters.total_input_tokens() \
+            + self.counters.total_output_tokens()
+        tokens_per_task = nr_tokens / max(self.nr_evaluated, 1)
+        return tokens_per_task / (1 - selectivity)
 
     def execute(self, order):
         """Execute operator on a given number of ordered rows.
 
+        No tasks are evaluated if the operator is deferred in favor
+        of sibling filters or if a fused filter evaluates its tasks.
+
         Args:
-            order (tuple): None or tuple (column, ascending flag).
+            order (tuple): None or tuple (filtered column, ascending flag).
         """
-        # Retrieve nr_rows in sort order from temporary table
-        items_to_process = self._retrieve_items(self.batch_size, order)
-        # Evaluate predicates on different items concurrently (threads)
+        if self.deferred or self.fused:
+            return
+        self._reject_tasks()
+
+        # Retrieve items for batch_size LLM calls in sort order
+        batches = self._next_tasks(self.batch_size, order)
+        tasks = [task for batch in batches for task in batch]
+        task_ids = [task_id for task_id, _ in tasks]
+        items_to_process = [item_text for _, item_text in tasks]
+        # Evaluate predicates on different items concurrently
         results = self._evaluate_predicate_parallel(items_to_process)
-        # Update results in the temporary table
-        for item_text, result in results:
-            # Escape single quotes in item text for SQL
-            escaped_item_text = item_text.replace("'", "''")
-            update_sql = (
-                f'UPDATE {self.tmp_table} '
-                f'SET result = {result}, '
-                f'simulated = {result} '
-                f"WHERE base_{self.filtered_column} = '{escaped_item_text}'")
-            self.db.execute2list(update_sql)
-        # Update task counters
-        self.counters.processed_tasks += len(items_to_process)
-        self.counters.unprocessed_tasks -= len(items_to_process)
+        item2task = dict(zip(items_to_process, task_ids))
+        self._write_results(
+            [item2task[item_text] for item_text, _ in results],
+            [item_text for item_text, _ in results],
+            [result for _, result in results])
+
+    def execute_streaming(self, order):
+        """Collect finished evaluations and submit new tasks.
+
+        Up to batch_size LLM calls of this operator are in flight
+        at any time. New calls are submitted as soon as slots free
+        up, without waiting for other calls of the same batch. If
+        the reply for multiple items cannot be parsed, the items
+        are resubmitted, using one call per item. Items whose
+        replies in calls for single items cannot be parsed remain
+        unresolved. No new tasks are submitted if the operator is
+        deferred or fused.
+
+        Args:
+            order (tuple): None or tuple (filtered column, ascending flag).
+        """
+        # Collect results of finished LLM calls
+        task_ids, item_texts, results = [], [], []
+        for call_task_ids, (call_items, kwargs_list, futures) in list(
+                self.in_flight.items()):
+            if futures[0].done():
+                del self.in_flight[call_task_ids]
+                try:
+                    call_results = self._extract_results(
+                        call_items, kwargs_list[0], futures[0].result())
+                except ValueError:
+                    self.counters.parse_failures += 1
+                    if len(call_items) > 1:
+                        for task_id, item_text in zip(
+                                call_task_ids, call_items):
+                            self._submit([(task_id, item_text)])
+                else:
+                    task_ids += call_task_ids
+                    item_texts += call_items
+                    results += call_results
+        if task_ids:
+            self._write_results(task_ids, item_texts, results)
+
+        # Submit new tasks for free slots
+        nr_free_slots = self.batch_size - len(self.in_flight)
+        if nr_free_slots > 0 and not (self.deferred or self.fused):
+            in_flight_ids = [
+                task_id for call_task_ids in self.in_flight \
+                for task_id in call_task_ids]
+            self._reject_tasks(in_flight_ids)
+            batches = self._next_tasks(nr_free_slots, order, in_flight_ids)
+            for batch in batches:
+                self._submit(batch)
@@ -3,59 +3,355 @@ Created on Jul 20, 2025
 
 @author: immanueltrummer
 '''
+import json
+import litellm
+import math
+import pandas as pd
+import re
 import traceback
 
-from litellm import completion
+from sqlglot import exp
+from tdb.execution.clusters import EquivalenceClusters
+from tdb.execution.rate_limits import RateLimiter
 from tdb.operators.semantic_operator import SemanticOperator
 
 
 class SemanticJoin(SemanticOperator):
-    """ Represents a semantic join operator in a query. """
+    """ Represents a semantic join operator in a query.
+    
+    The operator does not materialize all pairs of rows from the
+    joined tables. Instead, it stores the distinct join keys of
+    each side, divided into blocks of consecutive keys, and one
+    row for each pair of left and right blocks, marking whether
+    all key pairs in the two blocks have been processed. Candidate
+    pairs are generated on demand from unprocessed blocks. Only
+    key pairs satisfying the join condition are materialized.
+    
+    Optionally, joins on text columns use lexical blocking: the
+    TF-IDF cosine similarity between keys is computed locally,
+    pairs of blocks are processed in decreasing order of their
+    maximal similarity, and key pairs below a similarity threshold
+    are skipped.
+    
+    For join conditions that are equivalence relations (e.g., two
+    pictures showing the same person), verdicts for pairs that
+    follow from previous verdicts via transitivity are inferred
+    instead of evaluated. Self-joins on the same column evaluate
+    each unordered pair of keys once and pairs of identical keys
+    are matches without evaluation.
+    
+    Semantic filters on the joined tables that must be satisfied
+    by all result rows (sibling filters) are evaluated concurrently.
+    Keys whose rows are all rejected by such filters (according to
+    verdicts known so far) are excluded from evaluation.
+    
+    Key pairs for which LLM replies cannot be parsed remain
+    unresolved. They are stored in a separate table and evaluated
+    again once all pairs of blocks have been processed.
+    """
+    prompt_format = None
+    """ Format of prompts (None for prompts evaluating single pairs). """
     
     def __init__(
             self, db, operator_ID, batch_size, 
-            config_path, query, join_predicate):
+            config_path, query, join_predicate, 
+            cache=None, dispatcher=None, dop=1):
         """
         Initializes the semantic join operator.
         
         Args:
             db: Database containing the joined tables.
             operator_ID (str): Unique identifier for the operator.
-            batch_size (int): Number of items to process per call.
+            batch_size (int): Number of keys per block on each side.
             config_path (str): Path to the configuration file for models.
             query: Query containing the join predicate.
             join_predicate: Join predicate expressed in natural language.
+            cache: None or cache for verdicts across queries.
+            dispatcher: Dispatches LLM calls (None to create a new one).
+            dop (int): Maximal number of block pairs evaluated in parallel.
         """
-        super().__init__(db, operator_ID, batch_size, config_path)
+        super().__init__(
+            db, operator_ID, batch_size, config_path, 
+            cache, dispatcher)
+        self.dop = dop
         self.query = query
         self.pred = join_predicate
         self.tmp_table = f'ThalamusDB_{self.operator_ID}'
+        self.left_keys_table = f'{self.tmp_table}_Left'
+        self.right_keys_table = f'{self.tmp_table}_Right'
+        self.blocks_table = f'{self.tmp_table}_Blocks'
+        self.similarities_table = f'{self.tmp_table}_Similarities'
+        self.unresolved_table = f'{self.tmp_table}_Unresolved'
+        self.retry_block = (-1, -1)
+        self.blocking = self.models.get('join_blocking')
+        self.pruning = False
+        self.nr_matches = 0
+        self.equivalence = join_predicate.equivalence
+        self.symmetric = False
+        self.clusters = EquivalenceClusters()
+        self.sibling_filters = []
+    
+    def _apply_blocking(self):
+        """ Prioritizes similar key pairs and prunes dissimilar ones.
+        
+        Blocking applies only if both join columns contain text.
+        Pairs of blocks are prioritized according to the maximal
+        similarity of their key pairs. If a similarity threshold
+        is configured, key pairs below the threshold are skipped
+        and pairs of blocks without remaining key pairs are marked
+        as processed.
+        """
+        for keys_table in [self.left_keys_table, self.right_keys_table]:
+            nr_files = self.db.execute2list(
+                f'SELECT COUNT(*) FROM {keys_table} '
+                f'WHERE {self._is_file_sql("key")};')[0][0]
+            if nr_files > 0:
+                return
+        
+        self._score_pairs()
+        priority_sql = (
+            f'UPDATE {self.blocks_table} b '
+            'SET priority = p.priority '
+            'FROM (SELECT l.block_id AS block_left, '
+            'r.block_id AS block_right, '
+            'MAX(s.similarity) AS priority '
+            f'FROM {self.similarities_table} s '
+            f'JOIN {self.left_keys_table} l ON l.key_id = s.left_key_id '
+            f'JOIN {self.right_keys_table} r ON r.key_id = s.right_key_id '
+            'GROUP BY l.block_id, r.block_id) p '
+            'WHERE b.block_left = p.block_left '
+            'AND b.block_right = p.block_right;')
+        self.db.execute2list(priority_sql)
+        
+        threshold = self.blocking.get('threshold', 0)
+        if threshold > 0:
+            self.pruning = True
+            self.db.execute2list(
+                f'DELETE FROM {self.similarities_table} '
+                f'WHERE similarity < {threshold};')
+            nr_pairs_sql = (
+                f'UPDATE {self.blocks_table} b '
+                'SET nr_pairs = (SELECT COUNT(*) '
+                f'FROM {self.similarities_table} s '
+                f'JOIN {self.left_keys_table} l '
+                'ON l.key_id = s.left_key_id '
+                f'JOIN {self.right_keys_table} r '
+                'ON r.key_id = s.right_key_id '
+                'WHERE l.block_id = b.block_left '
+                'AND r.block_id = b.block_right);')
+            nr_all_pairs = self.db.execute2list(
+                f'SELECT SUM(nr_pairs) FROM {self.blocks_table};')[0][0]
+            self.db.execute2list(nr_pairs_sql)
+            self.db.execute2list(
+                f'UPDATE {self.blocks_table} SET processed = TRUE '
+                'WHERE nr_pairs = 0;')
+            nr_candidates = self.db.execute2list(
+                f'SELECT SUM(nr_pairs) FROM {self.blocks_table};')[0][0]
+            self.counters.pruned_tasks = int(
+                (nr_all_pairs or 0) - (nr_candidates or 0))
     
-    def _get_join_candidates(self, order):
-        """ Retrieves a given number of ordered row pairs in given order.
+    def _block_pairs(self, block):
+        """ Generates the key pairs associated with a pair of blocks.
         
         Args:
-            order (str): None or tuple (table, column, ascending flag).
+            block: Pair of left and right block IDs.
         
         Returns:
-            list: List of unprocessed row pairs from the left and right tables.
+            list: List of key pairs (one representative per key number).
         """
-        left_key_col = f'left_{self.pred.left_column}'
-        right_key_col = f'right_{self.pred.right_column}'
-        retrieval_sql = (
-            f'SELECT {left_key_col}, {right_key_col} '
-            f'FROM {self.tmp_table} '
-            f'WHERE result IS NULL '
-            f'LIMIT {self.batch_size}')
-        pairs = self.db.execute2list(retrieval_sql)
+        # Retrieve one representative key per number in both blocks
+        left_sql, right_sql = [(
+            f'SELECT key, key_id FROM {keys_table} '
+            f'WHERE block_id = {block_id} AND NOT rejected '
+            'QUALIFY row_number() OVER '
+            '(PARTITION BY key_id ORDER BY key) = 1') \
+            for keys_table, block_id in [
+                (self.left_keys_table, block[0]),
+                (self.right_keys_table, block[1])]]
+        
+        # Generate all (or all sufficiently similar) key pairs
+        candidates_sql = '' if not self.pruning else (
+            f'JOIN {self.similarities_table} s '
+            'ON s.left_key_id = l.key_id AND s.right_key_id = r.key_id ')
+        # Consider each unordered pair of distinct keys once
+        symmetric_sql = 'WHERE l.key_id < r.key_id ' \
+            if self.symmetric else ''
+        pairs_sql = (
+            'SELECT l.key, r.key '
+            f'FROM ({left_sql}) l CROSS JOIN ({right_sql}) r '
+            f'{candidates_sql}{symmetric_sql}'
+            'ORDER BY l.key_id, r.key_id;')
+        pairs = [
+            (row[0], row[1]) for row in self.db.execute2list(pairs_sql)]
         return pairs
+    
+    def _block_ids(self, key_tokens):
+        """ Assigns consecutive key numbers to blocks.
+        
+        Each block side contains at most batch_size key numbers
+        whose estimated input tokens, in total, fit into half of
+        the input token budget per call. Keys exceeding that budget
+        on their own form separate blocks.
+        
+        Args:
+            key_tokens: Estimated input tokens for each key number.
+        
+        Returns:
+            list: Block ID for each key number.
+        """
+        input_tokens, _ = self._block_tokens()
+        side_tokens = input_tokens // 2
+        block_ids = []
+        block_id, nr_keys, nr_tokens = 0, 0, 0
+        for tokens in key_tokens:
+            if nr_keys > 0 and (
+                    nr_keys == self.batch_size or 
+                    nr_tokens + tokens > side_tokens):
+                block_id += 1
+                nr_keys, nr_tokens = 0, 0
+            block_ids.append(block_id)
+            nr_keys += 1
+            nr_tokens += tokens
+        return block_ids
+    
+    def _block_tokens(self):
+        """ Retrieves token budgets for LLM calls evaluating blocks.
+        
+        Returns:
+            tuple: Maximal number of input and output tokens per call.
+        """
+        budgets = self.models.get('join_block_tokens', {})
+        return budgets.get('input', 8000), budgets.get('output', 1000)
+    
+    def _cache_contexts(self, left_modalities, right_modalities):
+        """ Computes contexts of cached verdicts for pairs of data types.
+        
+        Args:
+            left_modalities: Data types of items in the left table.
+            right_modalities: Data types of items in the right table.
+        
+        Returns:
+            Data frame associating pairs of data types with contexts.
+        """
+        modality_pairs = [
+            (left_modality, right_modality) \
+            for left_modality in sorted(set(left_modalities)) \
+            for right_modality in sorted(set(right_modalities))]
+        return pd.DataFrame({
+            'left_modality': [left for left, _ in modality_pairs],
+            'right_modality': [right for _, right in modality_pairs],
+            'context': [
+                self._cache_context(
+                    'join', modality_pair, self.pred.condition,
+                    self.prompt_format) \
+                for modality_pair in modality_pairs]})
+    
+    def _cache_items(self, keys):
+        """ Computes data types and fingerprints of given keys.
+        
+        Args:
+            keys: List of keys from one of the joined tables.
+        
+        Returns:
+            Data frame with key, modality, and item (fingerprint) columns.
+        """
+        return pd.DataFrame({
+            'key': keys,
+            'modality': [self._item_modality(k) for k in keys],
+            'item': [self._item_fingerprint(k) for k in keys]})
+    
+    def _cache_keys(self, left_keys, right_keys):
+        """ Computes keys of cached verdicts for all pairs of keys.
+        
+        Args:
+            left_keys: List of keys from the left table.
+            right_keys: List of keys from the right table.
+        
+        Returns:
+            Data frame associating key pairs with keys of cached verdicts.
+        """
+        left_df = self._cache_items(left_keys).add_prefix('left_')
+        right_df = self._cache_items(right_keys).add_prefix('right_')
+        contexts_df = self._cache_contexts(
+            left_df['left_modality'], right_df['right_modality'])
+        keys_df = left_df.merge(right_df, how='cross').merge(
+            contexts_df, on=['left_modality', 'right_modality'])
+        return keys_df[[
+            'left_key', 'right_key', 
+            'context', 'left_item', 'right_item']]
+    
+    def _expanded_pairs_sql(self, pairs_view):
+        """ Generates SQL selecting pairs of keys with their duplicates.
+        
+        Args:
+            pairs_view (str): Name of view with columns left_key, right_key.
+        
+        Returns:
+            str: SQL query selecting all pairs of keys referring to the
+                same files as the pairs in the view.
+        """
+        return (
+            'SELECT l2.key, r2.key '
+            f'FROM {pairs_view} m '
+            f'JOIN {self.left_keys_table} l1 ON l1.key = m.left_key '
+            f'JOIN {self.left_keys_table} l2 ON l2.key_id = l1.key_id '
+            f'JOIN {self.right_keys_table} r1 ON r1.key = m.right_key '
+            f'JOIN {self.right_keys_table} r2 ON r2.key_id = r1.key_id')
+    
+    def _get_join_candidates(self, order, nr_blocks=1, excluded_blocks=()):
+        """ Retrieves unprocessed key pairs for LLM-based evaluation.
+        
+        Currently, ordered retrieval is not supported. The
+        retrieval function claims up to a given number of
+        unprocessed pairs of left and right blocks and
+        returns all associated key pairs. If fewer pairs of
+        blocks remain, unresolved key pairs are claimed as
+        well (using a pseudo pair of blocks).
+        
+        Args:
+            order (str): None or tuple (table, column, ascending flag).
+            nr_blocks (int): Maximal number of block pairs to claim.
+            excluded_blocks: Block pairs claimed previously (in flight).
+        
+        Returns:
+            list: List of tuples (pair of block IDs, list of key pairs).
+        """
+        exclude_sql = '' if not excluded_blocks else (
+            'AND (block_left, block_right) NOT IN (' + ', '.join(
+                f'({block_left}, {block_right})' \
+                for block_left, block_right in excluded_blocks) + ') ')
+        if self.symmetric:
+            exclude_sql += 'AND block_left <= block_right '
+        find_blocks_sql = (
+            'SELECT block_left, block_right '
+            f'FROM {self.blocks_table} '
+            'WHERE NOT processed '
+            f'{exclude_sql}'
+            'ORDER BY priority DESC, block_left, block_right '
+            f'LIMIT {nr_blocks};')
+        blocks = self.db.execute2list(find_blocks_sql)
+        candidates = [
+            ((block_left, block_right),
+             self._block_pairs((block_left, block_right))) \
+            for block_left, block_right in blocks]
+        
+        # Evaluate unresolved pairs again once all blocks are claimed
+        if len(candidates) < nr_blocks \
+            and self.retry_block not in excluded_blocks:
+            retry_pairs = self._unresolved_pairs()
+            if retry_pairs:
+                candidates.append((self.retry_block, retry_pairs))
+        return candidates
 
     def _filter_join_inputs(self):
         """ Use pure SQL predicates to filter join inputs.
         
         This method creates two temporary tables, containing
-        the left and right join inputs after applying all
-        unary predicates expressed in pure SQL.
+        the distinct join keys of the left and right join inputs
+        after applying all unary predicates expressed in pure SQL.
+        Keys are numbered in sort order and assigned to blocks of
+        consecutive keys. Keys referring to duplicate files share
+        the same number.
         """
         left_alias = self.pred.left_alias
         left_table = self.pred.left_table
@@ -63,17 +359,68 @@ class SemanticJoin(SemanticOperator):
         right_alias = self.pred.right_alias
         right_table = self.pred.right_table
         right_column = self.pred.right_column
-        for alias, table, col, side in [
-            (left_alias, left_table, left_column, 'Left'),
-            (right_alias, right_table, right_column, 'Right')]:
+        for alias, table, col, keys_table in [
+            (left_alias, left_table, left_column, 
+             self.left_keys_table),
+            (right_alias, right_table, right_column, 
+             self.right_keys_table)]:
             pure_SQL_filters = self.query.alias2unary_sql[alias]
             filter_sql = (
                 'CREATE OR REPLACE TEMPORARY TABLE '
-                f'ThalamusDB_{side}JoinInputFiltered AS '
-                f'SELECT * FROM {table} AS {alias} '
-                f'WHERE {pure_SQL_filters.sql()} AND {col} IS NOT NULL;')
+                f'{keys_table} AS '
+                f'SELECT DISTINCT {alias}.{col} AS key '
+                f'FROM {table} AS {alias} '
+                f'WHERE {pure_SQL_filters.sql()} '
+                f'AND {alias}.{col} IS NOT NULL;')
             self.db.execute2list(filter_sql)
+            self._number_keys(keys_table)
+    
+    def _call_keys(self, pairs, nr_calls):
+        """ Divides the keys of a block among multiple LLM calls.
+        
+        Args:
+            pairs: List of key pairs to check for matches.
+            nr_calls (int): Number of LLM calls for the block.
+        
+        Returns:
+            list: Tuples of sorted left and right keys for each call.
+        """
+        raise NotImplementedError(
+            'Instantiate one of the sub-classes of SemanticJoin!')
+    
+    def _collect_matches(self, pairs, kwargs_list, responses):
+        """ Extracts matching pairs from LLM replies.
         
+        Calls whose replies cannot be parsed are retried (waiting
+        for the replies of retried calls).
+        
+        Args:
+            pairs: List of key pairs to check for matches.
+            kwargs_list: Keyword arguments of the LLM calls.
+            responses: LLM replies (same order as keyword arguments).
+        
+        Returns:
+            tuple: Lists of matching pairs and of unresolved pairs.
+        """
+        call_keys = self._call_keys(pairs, len(kwargs_list))
+        matches = []
+        unresolved = []
+        while call_keys:
+            new_matches, call_keys, new_unresolved = self._parse_replies(
+                pairs, call_keys, kwargs_list, responses)
+            matches += new_matches
+            unresolved += new_unresolved
+            
+            # Retry calls with incorrect replies using smaller blocks
+            kwargs_list = [
+                self._keys_kwargs(left_keys, right_keys) \
+                for left_keys, right_keys in call_keys]
+            if kwargs_list:
+                responses = self.dispatcher.complete_all(kwargs_list)
+                self.counters.join_calls += len(kwargs_list)
+        
+        return matches, unresolved
+    
     def _find_matches(self, pairs):
         """ Finds pairs satisfying the join condition.
         
@@ -81,112 +428,735 @@ class SemanticJoin(SemanticOperator):
             pairs: List of key pairs to check for matches.
         
         Returns:
-            list: List of key pairs that satisfy the join condition.
+            tuple: Lists of matching pairs and of unresolved pairs.
+        """
+        kwargs_list = self._match_kwargs(pairs)
+        responses = self.dispatcher.complete_all(kwargs_list)
+        return self._collect_matches(pairs, kwargs_list, responses)
+    
+    def _insert_matches(self, matches, table=None):
+        """ Adds new key pairs to the table of matching pairs.
+        
+        For symmetric self-joins, mirrored pairs are added as well.
+        
+        Args:
+            matches: List of key pairs satisfying the join condition.
+            table: Table to insert into (None for matching pairs).
+        """
+        table = self.tmp_table if table is None else table
+        matches_view = f'{self.tmp_table}_NewMatches'
+        self.db.register(matches_view, self._pairs_df(matches))
+        try:
+            # Matches apply to all keys referring to duplicate files
+            insert_sql = (
+                f'INSERT INTO {table} '
+                f'{self._expanded_pairs_sql(matches_view)} '
+                f'EXCEPT SELECT left_key, right_key FROM {table};')
+            self.db.execute2list(insert_sql)
+        finally:
+            self.db.unregister(matches_view)
+    
+    def _update_results(self, block, matches):
+        """ Marks a pair of blocks as processed and stores its matches.
+        
+        For symmetric self-joins, the mirrored pair of blocks is
+        marked as processed as well.
+        
+        Args:
+            block: Pair of left and right block IDs.
+            matches: List of key pairs satisfying the join condition.
+        """
+        if matches:
+            self._insert_matches(matches)
+        
+        block_left, block_right = block
+        update_sql = (
+            f'UPDATE {self.blocks_table} '
+            'SET processed = TRUE '
+            f'WHERE (block_left = {block_left} '
+            f'AND block_right = {block_right})')
+        if self.symmetric:
+            update_sql += (
+                f' OR (block_left = {block_right} '
+                f'AND block_right = {block_left})')
+        self.db.execute2list(update_sql + ';')
+    
+    def _is_symmetric(self):
+        """ Checks whether the join is a symmetric self-join.
+        
+        Returns:
+            bool: True iff the join is an equivalence join and both
+                sides refer to the same column with the same filters
+                (and without semantic filters).
+        """
+        # Compare filters on both sides after removing table aliases
+        left_sql, right_sql = [
+            self.query.alias2unary_sql[alias].transform(
+                lambda node: exp.column(node.name) \
+                if isinstance(node, exp.Column) else node).sql() \
+            for alias in [self.pred.left_alias, self.pred.right_alias]]
+        return self.equivalence and not self.sibling_filters \
+            and self.pred.left_table == self.pred.right_table \
+            and self.pred.left_column == self.pred.right_column \
+            and left_sql == right_sql
+    
+    def _keys_kwargs(self, left_keys, right_keys):
+        """ Prepares an LLM call checking all pairs of given keys.
+        
+        Args:
+            left_keys: List of keys from the left table.
+            right_keys: List of keys from the right table.
+        
+        Returns:
+            dict: Keyword arguments for the completion function.
+        """
+        raise NotImplementedError(
+            'Instantiate one of the sub-classes of SemanticJoin!')
+    
+    def _key_tokens(self, key):
+        """ Estimates the number of input tokens for a file key.
+        
+        Args:
+            key (str): Path of an image or audio file.
+        
+        Returns:
+            int: Estimated number of tokens to represent the file.
+        """
+        if self._item_modality(key) == 'image':
+            return RateLimiter.image_tokens
+        file_path = self._item_path(key)
+        if not file_path.exists():
+            return 1
+        audio_kb = file_path.stat().st_size / 1000
+        return int(audio_kb * RateLimiter.audio_tokens_per_kb) + 1
+    
+    def _match_kwargs(self, pairs):
+        """ Prepares LLM calls checking key pairs for matches.
+        
+        Args:
+            pairs: List of key pairs to check for matches.
+        
+        Returns:
+            list: Keyword arguments for the completion function.
+        """
+        raise NotImplementedError(
+            'Instantiate one of the sub-classes of SemanticJoin!')
+    
+    def _number_keys(self, keys_table):
+        """ Numbers join keys and assigns them to blocks.
+        
+        Keys referring to files with the same content (or similar
+        images, if perceptual deduplication is enabled) obtain the
+        same number. Hence, only one of them is evaluated and the
+        result applies to all duplicates.
+        
+        Blocks contain consecutive keys whose estimated number of
+        input tokens fits into the token budget per block side
+        (see _block_ids).
+        
+        Args:
+            keys_table (str): Name of table containing distinct keys.
+        """
+        file_keys = [row[0] for row in self.db.execute2list(
+            f'SELECT key FROM {keys_table} '
+            f'WHERE {self._is_file_sql("key")};')]
+        representative_sql = 'k.key'
+        tokens_sql = 'LENGTH(k.key::VARCHAR) // 4 + 1'
+        duplicates_sql = ''
+        duplicates_view = f'{keys_table}_Duplicates'
+        if file_keys:
+            duplicates_df = pd.DataFrame({
+                'key': file_keys,
+                'duplicate_key': [
+                    self._duplicate_key(k) for k in file_keys],
+                'nr_tokens': [self._key_tokens(k) for k in file_keys]})
+            self.db.register(duplicates_view, duplicates_df)
+            representative_sql = 'COALESCE(d.first_key, k.key)'
+            tokens_sql = f'COALESCE(d.nr_tokens, {tokens_sql})'
+            duplicates_sql = (
+                'LEFT JOIN (SELECT key, nr_tokens, MIN(key) OVER '
+                '(PARTITION BY duplicate_key) AS first_key '
+                f'FROM {duplicates_view}) d USING (key)')
+        
+        numbered_sql = (
+            'SELECT key, (DENSE_RANK() OVER '
+            f'(ORDER BY {representative_sql}) - 1)::INTEGER AS key_id, '
+            f'{tokens_sql} AS nr_tokens '
+            f'FROM {keys_table} k {duplicates_sql}')
+        blocks_view = f'{keys_table}_Blocks'
+        try:
+            # Pack key numbers into blocks fitting the token budget
+            key_tokens = [row[1] for row in self.db.execute2list(
+                f'SELECT key_id, MAX(nr_tokens) FROM ({numbered_sql}) '
+                'GROUP BY key_id ORDER BY key_id;')]
+            blocks_df = pd.DataFrame({
+                'key_id': range(len(key_tokens)),
+                'block_id': self._block_ids(key_tokens)}, dtype='int64')
+            self.db.register(blocks_view, blocks_df)
+            number_sql = (
+                'CREATE OR REPLACE TEMPORARY TABLE '
+                f'{keys_table} AS '
+                f'WITH numbered AS ({numbered_sql}) '
+                'SELECT key, key_id, block_id::INTEGER AS block_id, '
+                'FALSE AS rejected '
+                f'FROM numbered JOIN {blocks_view} USING (key_id);')
+            self.db.execute2list(number_sql)
+        finally:
+            self.db.unregister(blocks_view)
+            if file_keys:
+                self.db.unregister(duplicates_view)
+    
+    def _open_pairs(self, pairs):
+        """ Selects key pairs whose verdicts cannot be inferred.
+        
+        Args:
+            pairs: List of key pairs associated with a block.
+        
+        Returns:
+            list: List of key pairs that must be evaluated via LLMs.
+        """
+        if not self.equivalence:
+            return pairs
+        return [
+            pair for pair in pairs \
+            if self.clusters.verdict(*pair) is None]
+    
+    def _pairs_df(self, pairs):
+        """ Creates a data frame containing given key pairs.
+        
+        For symmetric self-joins, mirrored pairs are added as well.
+        
+        Args:
+            pairs: List of key pairs.
+        
+        Returns:
+            Data frame with columns left_key and right_key.
+        """
+        if self.symmetric:
+            pairs = pairs + [(right, left) for left, right in pairs]
+        return pd.DataFrame({
+            'left_key': [left_key for left_key, _ in pairs],
+            'right_key': [right_key for _, right_key in pairs]})
+    
+    def _parse_replies(self, pairs, call_keys, kwargs_list, responses):
+        """ Extracts matching pairs from one round of LLM replies.
+        
+        Args:
+            pairs: List of key pairs to check for matches.
+            call_keys: Tuples of left and right keys for each call.
+            kwargs_list: Keyword arguments of the LLM calls.
+            responses: LLM replies (same order as keyword arguments).
+        
+        Returns:
+            tuple: Lists of matching pairs, of keys (tuples of left
+                and right keys) to evaluate again, and of unresolved
+                pairs.
         """
         raise NotImplementedError(
             'Instantiate one of the sub-classes of SemanticJoin!')
     
+    def _prepare_symmetric(self):
+        """ Prepares tables for symmetric self-joins.
+        
+        Pairs of identical keys are matches. Pairs of blocks below
+        the diagonal are evaluated together with their mirrored
+        pairs of blocks. Task counts consider each unordered pair
+        of distinct keys (left key number below right key number)
+        once, as generated for evaluation.
+        """
+        self.db.execute2list(
+            f'INSERT INTO {self.tmp_table} '
+            'SELECT l.key, r.key '
+            f'FROM {self.left_keys_table} l '
+            f'JOIN {self.right_keys_table} r ON l.key_id = r.key_id;')
+        
+        # Count unordered pairs of distinct keys (with pruning applied)
+        key_ids_sql = (
+            'SELECT DISTINCT key_id, block_id '
+            f'FROM {self.left_keys_table}')
+        candidates_sql = '' if not self.pruning else (
+            f'JOIN {self.similarities_table} s '
+            'ON s.left_key_id = l.key_id AND s.right_key_id = r.key_id ')
+        pairs_sql = (
+            'SELECT l.block_id AS block_left, r.block_id AS block_right, '
+            'COUNT(*) AS nr_pairs '
+            f'FROM ({key_ids_sql}) l JOIN ({key_ids_sql}) r '
+            f'ON l.key_id < r.key_id {candidates_sql}'
+            'GROUP BY l.block_id, r.block_id')
+        self.db.execute2list(
+            f'UPDATE {self.blocks_table} SET nr_pairs = 0;')
+        self.db.execute2list(
+            f'UPDATE {self.blocks_table} b '
+            f'SET nr_pairs = p.nr_pairs FROM ({pairs_sql}) p '
+            'WHERE p.block_left = b.block_left '
+            'AND p.block_right = b.block_right;')
+        self.db.execute2list(
+            f'UPDATE {self.blocks_table} SET processed = TRUE '
+            'WHERE block_left <= block_right AND nr_pairs = 0;')
+        
+        # Pairs of distinct keys that are not counted were pruned
+        nr_keys = self.db.execute2list(
+            'SELECT COUNT(DISTINCT key_id) '
+            f'FROM {self.left_keys_table};')[0][0]
+        nr_candidates = self.db.execute2list(
+            f'SELECT SUM(nr_pairs) FROM {self.blocks_table};')[0][0]
+        self.counters.pruned_tasks = \
+            nr_keys * (nr_keys - 1) // 2 - int(nr_candidates or 0)
+    
+    def _reject_keys(self):
+        """ Excludes keys whose rows are rejected by sibling filters.
+        
+        A key is rejected if each row containing the key violates
+        pure SQL predicates or is known to violate one of the
+        sibling filters. Pairs of blocks are marked as processed
+        if all keys of one of the two blocks are rejected (unless
+        they are currently being evaluated).
+        """
+        for alias, table, column, keys_table in [
+            (self.pred.left_alias, self.pred.left_table,
+             self.pred.left_column, self.left_keys_table),
+            (self.pred.right_alias, self.pred.right_table,
+             self.pred.right_column, self.right_keys_table)]:
+            filter_sqls = [
+                f'{alias}.{f.filtered_column} IN ('
+                f'SELECT base_{f.filtered_column} FROM {f.tmp_table} '
+                'WHERE result IS NULL OR result)' \
+                for f in self.sibling_filters \
+                if f.filtered_alias == alias]
+            if filter_sqls:
+                pure_SQL_filters = self.query.alias2unary_sql[alias]
+                reject_sql = (
+                    f'UPDATE {keys_table} SET rejected = TRUE '
+                    'WHERE NOT rejected AND key NOT IN ('
+                    f'SELECT {alias}.{column} '
+                    f'FROM {table} AS {alias} '
+                    f'WHERE {pure_SQL_filters.sql()} '
+                    f'AND {alias}.{column} IS NOT NULL AND '
+                    + ' AND '.join(filter_sqls) + ');')
+                self.db.execute2list(reject_sql)
+        
+        # Skip pairs of blocks with only rejected keys on one side
+        rejected_sql = (
+            'SELECT block_id FROM {} '
+            'GROUP BY block_id HAVING BOOL_AND(rejected)')
+        in_flight_sql = '' if not self.in_flight else (
+            'AND (block_left, block_right) NOT IN (' + ', '.join(
+                f'({block_left}, {block_right})' \
+                for block_left, block_right in self.in_flight) + ') ')
+        skip_condition = (
+            'WHERE NOT processed '
+            f'{in_flight_sql}'
+            'AND (block_left IN '
+            f'({rejected_sql.format(self.left_keys_table)}) '
+            'OR block_right IN '
+            f'({rejected_sql.format(self.right_keys_table)}))')
+        nr_skipped = self.db.execute2list(
+            'SELECT COALESCE(SUM(nr_pairs), 0) '
+            f'FROM {self.blocks_table} {skip_condition};')[0][0]
+        self.db.execute2list(
+            f'UPDATE {self.blocks_table} SET processed = TRUE '
+            f'{skip_condition};')
+        self.counters.pruned_tasks += int(nr_skipped)
+        self.counters.unprocessed_tasks -= int(nr_skipped)
+    
+    def _resolve_pairs(self, pairs):
+        """ Removes key pairs from the table of unresolved pairs.
+        
+        Args:
+            pairs: List of key pairs with known verdicts.
+        """
+        pairs_view = f'{self.tmp_table}_Resolved'
+        self.db.register(pairs_view, self._pairs_df(pairs))
+        try:
+            self.db.execute2list(
+                f'DELETE FROM {self.unresolved_table} '
+                'WHERE (left_key, right_key) IN '
+                f'({self._expanded_pairs_sql(pairs_view)});')
+        finally:
+            self.db.unregister(pairs_view)
+    
+    def _score_pairs(self):
+        """ Computes the lexical similarity of key pairs.
+        
+        Keys are split into lower-case words and represented as
+        TF-IDF vectors. The resulting table contains the cosine
+        similarity for each pair of key numbers sharing at least
+        one word (other pairs have a similarity of zero).
+        """
+        words_sql = (
+            "SELECT '{}' AS side, key_id, unnest(regexp_split_to_array("
+            "lower(key::VARCHAR), '[^a-z0-9]+')) AS word FROM {}")
+        tokens_sql = (
+            'SELECT side, key_id, word, COUNT(*) AS tf FROM ('
+            f'{words_sql.format("L", self.left_keys_table)} UNION ALL '
+            f'{words_sql.format("R", self.right_keys_table)}) '
+            "WHERE word <> '' GROUP BY side, key_id, word")
+        weights_sql = (
+            'SELECT side, key_id, word, tf * LN(1 + '
+            '(SELECT COUNT(DISTINCT (side, key_id)) FROM tokens) / '
+            'COUNT(*) OVER (PARTITION BY word)) AS weight FROM tokens')
+        normalized_sql = (
+            'SELECT side, key_id, word, weight / SQRT(SUM(weight * weight) '
+            'OVER (PARTITION BY side, key_id)) AS weight FROM weights')
+        similarities_sql = (
+            'CREATE OR REPLACE TEMPORARY TABLE '
+            f'{self.similarities_table} AS '
+            f'WITH tokens AS ({tokens_sql}), '
+            f'weights AS ({weights_sql}), '
+            f'normalized AS ({normalized_sql}) '
+            'SELECT l.key_id AS left_key_id, r.key_id AS right_key_id, '
+            'SUM(l.weight * r.weight) AS similarity '
+            'FROM normalized l JOIN normalized r ON l.word = r.word '
+            "WHERE l.side = 'L' AND r.side = 'R' "
+            'GROUP BY l.key_id, r.key_id;')
+        self.db.execute2list(similarities_sql)
+    
+    def _store_verdicts(self, pairs, matches):
+        """ Stores verdicts for evaluated key pairs in the cache.
+        
+        Args:
+            pairs: List of evaluated key pairs.
+            matches: List of key pairs satisfying the join condition.
+        """
+        left_keys = sorted(set(left_key for left_key, _ in pairs))
+        right_keys = sorted(set(right_key for _, right_key in pairs))
+        keys_df = self._cache_keys(left_keys, right_keys)
+        evaluated = set(pairs)
+        is_evaluated = [
+            key_pair in evaluated for key_pair in zip(
+                keys_df['left_key'], keys_df['right_key'])]
+        verdicts_df = keys_df[is_evaluated].copy()
+        matching = set(matches)
+        verdicts_df['result'] = [
+            key_pair in matching for key_pair in zip(
+                verdicts_df['left_key'], verdicts_df['right_key'])]
+        self.cache.store(verdicts_df)
+    
+    def _unresolved_pairs(self):
+        """ Retrieves key pairs whose evaluation failed previously.
+        
+        Only one pair is retrieved for keys referring to duplicate
+        files (and for mirrored pairs in symmetric self-joins).
+        
+        Returns:
+            list: Up to batch_size unresolved key pairs.
+        """
+        symmetric_sql = 'WHERE l.key_id < r.key_id ' \
+            if self.symmetric else ''
+        rows = self.db.execute2list(
+            'SELECT u.left_key, u.right_key '
+            f'FROM {self.unresolved_table} u '
+            f'JOIN {self.left_keys_table} l ON l.key = u.left_key '
+            f'JOIN {self.right_keys_table} r ON r.key = u.right_key '
+            f'{symmetric_sql}'
+            'QUALIFY row_number() OVER (PARTITION BY l.key_id, r.key_id '
+            'ORDER BY u.left_key, u.right_key) = 1 '
+            'ORDER BY u.left_key, u.right_key '
+            f'LIMIT {self.batch_size};')
+        return [(left_key, right_key) for left_key, right_key in rows]
+    
+    def _use_cached_results(self):
+        """ Reuse cached verdicts for matches and fully cached blocks.
+        
+        Cached matches are added to the table of matching pairs.
+        Pairs of blocks are marked as processed if verdicts for
+        all of their key pairs are cached.
+        """
+        # Match key pairs against the cache without materializing them
+        views = []
+        side2items = {}
+        for side, keys_table in [
+            ('left', self.left_keys_table), 
+            ('right', self.right_keys_table)]:
+            keys = [row[0] for row in self.db.execute2list(
+                f'SELECT key FROM {keys_table};')]
+            side2items[side] = self._cache_items(keys)
+        contexts_df = self._cache_contexts(
+            side2items['left']['modality'], 
+            side2items['right']['modality'])
+        for name, df in [
+            ('LeftItems', side2items['left']),
+            ('RightItems', side2items['right']),
+            ('Contexts', contexts_df)]:
+            view_name = f'{self.tmp_table}_{name}'
+            self.db.register(view_name, df)
+            views.append(view_name)
+        try:
+            left_view, right_view, contexts_view = views
+            keys_sql = (
+                'SELECT l.key AS left_key, r.key AS right_key, '
+                'c.context, l.item AS left_item, r.item AS right_item '
+                f'FROM {left_view} l JOIN {contexts_view} c '
+                'ON c.left_modality = l.modality '
+                f'JOIN {right_view} r '
+                'ON c.right_modality = r.modality')
+            hits_df = self.cache.lookup_relation(keys_sql)
+        finally:
+            for view_name in views:
+                self.db.unregister(view_name)
+        
+        nr_pairs = len(side2items['left']) * len(side2items['right'])
+        self.counters.cache_hits += len(hits_df)
+        self.counters.cache_misses += nr_pairs - len(hits_df)
+        matches = list(hits_df.loc[
+            hits_df['result'], ['left_key', 'right_key']].itertuples(
+                index=False, name=None))
+        if matches:
+            self._insert_matches(matches)
+        
+        # Mark blocks as processed if all (unpruned) pairs are cached
+        candidates_sql = '' if not self.pruning else (
+            f'JOIN {self.similarities_table} s '
+            'ON s.left_key_id = l.key_id AND s.right_key_id = r.key_id ')
+        if self.symmetric:
+            candidates_sql += 'AND l.key_id < r.key_id '
+        hits_view = f'{self.tmp_table}_CacheHits'
+        self.db.register(hits_view, hits_df)
+        try:
+            update_sql = (
+                f'UPDATE {self.blocks_table} b SET processed = TRUE '
+                'FROM (SELECT l.block_id AS block_left, '
+                'r.block_id AS block_right, '
+                'COUNT(DISTINCT (l.key_id, r.key_id)) AS nr_hits '
+                f'FROM {hits_view} h '
+                f'JOIN {self.left_keys_table} l ON l.key = h.left_key '
+                f'JOIN {self.right_keys_table} r ON r.key = h.right_key '
+                f'{candidates_sql}'
+                'GROUP BY l.block_id, r.block_id) c '
+                'WHERE b.block_left = c.block_left '
+                'AND b.block_right = c.block_right '
+                'AND c.nr_hits = b.nr_pairs;')
+            self.db.execute2list(update_sql)
+        finally:
+            self.db.unregister(hits_view)
+    
+    def _write_results(
+            self, block, pairs, open_pairs, matches, unresolved, nr_calls):
+        """ Writes back results of an evaluated block and updates counters.
+        
+        For equivalence joins, verdicts of evaluated pairs are used
+        to update clusters of matching keys. Matches among pairs that
+        were not evaluated are inferred from those clusters. Pairs
+        without verdicts (since LLM replies could not be parsed) are
+        added to the table of unresolved pairs.
+        
+        Args:
+            block: Pair of left and right block IDs.
+            pairs: List of all key pairs associated with the block.
+            open_pairs: List of key pairs evaluated via LLMs.
+            matches: List of evaluated pairs satisfying the join condition.
+            unresolved: List of evaluated pairs without verdicts.
+            nr_calls (int): Number of LLM calls used to evaluate the block.
+        """
+        self.counters.join_pairs += len(open_pairs)
+        self.counters.join_calls += nr_calls
+        self.nr_matches += len(matches)
+        unresolved_set = set(unresolved)
+        resolved_pairs = [
+            pair for pair in pairs if pair not in unresolved_set]
+        
+        # Infer verdicts for pairs that were not evaluated
+        if self.equivalence:
+            matching = set(matches)
+            for left_key, right_key in open_pairs:
+                if (left_key, right_key) in unresolved_set:
+                    continue
+                elif (left_key, right_key) in matching:
+                    self.clusters.union(left_key, right_key)
+                else:
+                    self.clusters.separate(left_key, right_key)
+            evaluated = set(open_pairs)
+            matches = matches + [
+                pair for pair in pairs if pair not in evaluated \
+                and self.clusters.verdict(*pair)]
+            self.counters.inferred_tasks += len(pairs) - len(open_pairs)
+        
+        # Store matches and mark block as processed
+        self._update_results(block, matches)
+        if unresolved:
+            self._insert_matches(unresolved, self.unresolved_table)
+        if block == self.retry_block and resolved_pairs:
+            self._resolve_pairs(resolved_pairs)
+        
+        # Store new verdicts for future queries
+        if self.cache is not None and resolved_pairs:
+            self._store_verdicts(resolved_pairs, matches)
+        
+        # Update task counters incrementally
+        nr_rejected = 0
+        if self.sibling_filters and block != self.retry_block:
+            nr_pairs = self.db.execute2list(
+                f'SELECT nr_pairs FROM {self.blocks_table} '
+                f'WHERE block_left = {block[0]} '
+                f'AND block_right = {block[1]};')[0][0]
+            nr_rejected = nr_pairs - len(pairs)
+        self.counters.processed_tasks += len(resolved_pairs)
+        self.counters.unprocessed_tasks -= len(resolved_pairs) + nr_rejected
+        self.counters.pruned_tasks += nr_rejected
+    
     def execute(self, order):
         """ Executes the join on a given number of ordered rows.
         
+        Claims up to dop unprocessed pairs of blocks and
+        evaluates them concurrently. Keys rejected by sibling
+        filters so far are excluded.
+        
         Args:
             order (str): None or tuple (table, column, ascending flag).
         """
-        # Retrieve candidate pairs and set the result to NULL
-        pairs = self._get_join_candidates(order)
-        for left_key, right_key in pairs:
-            escaped_left_key = left_key.replace("'", "''")
-            escaped_right_key = right_key.replace("'", "''")
-            update_sql = (
-                f'UPDATE {self.tmp_table} '
-                f'SET result = False, simulated = False '
-                f"WHERE left_{self.pred.left_column} = '{escaped_left_key}' "
-                f"AND right_{self.pred.right_column} = '{escaped_right_key}' "
-                f'AND result IS NULL;')
-            self.db.execute2list(update_sql)
+        # Exploit current results of sibling filters to prune join inputs
+        if self.sibling_filters:
+            self._reject_keys()
         
-        # Find matching pairs of keys
-        matches = self._find_matches(pairs)
+        # Retrieve candidate pairs for multiple pairs of blocks
+        candidates = [
+            (block, pairs, self._open_pairs(pairs)) \
+            for block, pairs in self._get_join_candidates(order, self.dop)]
+        block2kwargs = {
+            block: self._match_kwargs(open_pairs) \
+            for block, _, open_pairs in candidates}
         
-        # Update the temporary table with the results
-        for left_key, right_key in matches:
-            escaped_left_key = left_key.replace("'", "''")
-            escaped_right_key = right_key.replace("'", "''")
-            update_sql = (
-                f'UPDATE {self.tmp_table} '
-                f'SET result = TRUE, simulated = TRUE '
-                f"WHERE left_{self.pred.left_column} = '{escaped_left_key}' "
-                f"AND right_{self.pred.right_column} = '{escaped_right_key}';")
-            self.db.execute2list(update_sql)
+        # Issue LLM calls for all blocks concurrently
+        kwargs_list = [
+            kwargs for block, _, _ in candidates \
+            for kwargs in block2kwargs[block]]
+        responses = self.dispatcher.complete_all(kwargs_list)
+        
+        # Find matching pairs of keys for each pair of blocks
+        offset = 0
+        for block, pairs, open_pairs in candidates:
+            block_kwargs = block2kwargs[block]
+            block_responses = responses[offset:offset + len(block_kwargs)]
+            offset += len(block_kwargs)
+            matches, unresolved = self._collect_matches(
+                open_pairs, block_kwargs, block_responses)
+            self._write_results(
+                block, pairs, open_pairs, matches, unresolved, 
+                len(block_kwargs))
+    
+    def execute_streaming(self, order):
+        """ Collects matches of finished blocks and submits new blocks.
+        
+        Up to dop pairs of blocks are in flight at any time. Blocks
+        in flight remain claimed until their results are written
+        and are not submitted again. Blocks are submitted without
+        waiting for LLM replies. Calls whose replies cannot be
+        parsed are submitted again, using smaller blocks, and the
+        associated pair of blocks remains in flight meanwhile.
         
-        # Count number of processed tasks
-        count_processed_sql = (
-            f'SELECT COUNT(*) FROM {self.tmp_table} '
-            f'WHERE result IS NOT NULL;')
-        count_processed = self.db.execute2list(count_processed_sql)
-        self.counters.processed_tasks = count_processed[0][0]
+        Args:
+            order (str): None or tuple (table, column, ascending flag).
+        """
+        # Collect matches once all LLM calls for a block finished
+        for block, (pairs, open_pairs, matches, unresolved, nr_calls, 
+                    call_keys, kwargs_list, futures) in list(
+                        self.in_flight.items()):
+            if all(future.done() for future in futures):
+                responses = [future.result() for future in futures]
+                new_matches, retry_keys, new_unresolved = \
+                    self._parse_replies(
+                        open_pairs, call_keys, kwargs_list, responses)
+                matches = matches + new_matches
+                unresolved = unresolved + new_unresolved
+                if retry_keys:
+                    retry_kwargs = [
+                        self._keys_kwargs(left_keys, right_keys) \
+                        for left_keys, right_keys in retry_keys]
+                    retry_futures = [
+                        self.dispatcher.submit(kwargs) \
+                        for kwargs in retry_kwargs]
+                    self.in_flight[block] = (
+                        pairs, open_pairs, matches, unresolved,
+                        nr_calls + len(retry_kwargs), retry_keys,
+                        retry_kwargs, retry_futures)
+                else:
+                    del self.in_flight[block]
+                    self._write_results(
+                        block, pairs, open_pairs, matches, unresolved, 
+                        nr_calls)
         
-        # Count number of unprocessed tasks
-        count_unprocessed_sql = (
-            f'SELECT COUNT(*) FROM {self.tmp_table} '
-            f'WHERE result IS NULL;')
-        count_unprocessed = self.db.execute2list(count_unprocessed_sql)
-        self.counters.unprocessed_tasks = count_unprocessed[0][0]
+        # Submit LLM calls for the next blocks
+        nr_blocks = self.dop - len(self.in_flight)
+        if nr_blocks > 0:
+            if self.sibling_filters:
+                self._reject_keys()
+            candidates = self._get_join_candidates(
+                order, nr_blocks, list(self.in_flight))
+            for block, pairs in candidates:
+                open_pairs = self._open_pairs(pairs)
+                kwargs_list = self._match_kwargs(open_pairs)
+                call_keys = self._call_keys(open_pairs, len(kwargs_list))
+                futures = [
+                    self.dispatcher.submit(kwargs) \
+                    for kwargs in kwargs_list]
+                self.in_flight[block] = (
+                    pairs, open_pairs, [], [], len(kwargs_list),
+                    call_keys, kwargs_list, futures)
     
     def prepare(self):
-        """ Prepare for execution by creating a temporary table. """
-        # Apply pure SQL filters to the left and right tables
+        """ Prepare for execution by creating temporary tables. """
+        # Collect and number join keys satisfying pure SQL filters
         self._filter_join_inputs()
         
-        left_columns = self.db.columns(self.pred.left_table)
-        right_columns = self.db.columns(self.pred.right_table)
-        temp_schema_parts = [
-            'result BOOLEAN', 'simulated BOOLEAN',
-            'batch_ID_left INT', 'batch_ID_right INT']
-        for col_name, col_type in left_columns:
-            tmp_col_name = f'left_{col_name}'
-            temp_schema_parts.append(f'{tmp_col_name} {col_type}')
-        for col_name, col_type in right_columns:
-            tmp_col_name = f'right_{col_name}'
-            temp_schema_parts.append(f'{tmp_col_name} {col_type}')
-        
-        create_table_sql = \
-            f'CREATE OR REPLACE TEMPORARY TABLE {self.tmp_table} (' +\
-            ', '.join(temp_schema_parts) + ');'
-        self.db.execute2list(create_table_sql)
-
-        left_alias = self.pred.left_alias
-        right_alias = self.pred.right_alias
-        left_filtered_table = 'ThalamusDB_LeftJoinInputFiltered'
-        right_filtered_table = 'ThalamusDB_RightJoinInputFiltered'
-        left_batch_ID_exp = (
-            f'floor({left_alias}.rowid / ' 
-            f'{self.batch_size})::INTEGER')
-        right_batch_ID_exp = (
-            f'floor({right_alias}.rowid / ' 
-            f'{self.batch_size})::INTEGER')
-        left_select_items = [
-            f'{left_alias}.{col[0]} AS left_{col[0]}' \
-            for col in left_columns]
-        right_select_items = [
-            f'{right_alias}.{col[0]} AS right_{col[0]}' \
-            for col in right_columns]
-        fill_table_sql = (
-            f'INSERT INTO {self.tmp_table} '
-            f'SELECT NULL AS result, NULL AS simulated, '
-            f'{left_batch_ID_exp} AS batch_ID_left, '
-            f'{right_batch_ID_exp} AS batch_ID_right, '
-            + ', '.join(left_select_items) + ', '
-            + ', '.join(right_select_items) + ' '
-            f'FROM {left_filtered_table} {left_alias}, '
-            f'{right_filtered_table} {right_alias};'
-        )
-        self.db.execute2list(fill_table_sql)
-        
-        # Initialize task counters        
+        # Create compact table tracking processed pairs of blocks
+        nr_keys_sql = (
+            'SELECT block_id, COUNT(DISTINCT key_id) AS nr_keys '
+            'FROM {} GROUP BY block_id')
+        create_blocks_sql = (
+            'CREATE OR REPLACE TEMPORARY TABLE '
+            f'{self.blocks_table} AS '
+            'SELECT l.block_id AS block_left, '
+            'r.block_id AS block_right, FALSE AS processed, '
+            '0.0::DOUBLE AS priority, '
+            'l.nr_keys * r.nr_keys AS nr_pairs '
+            f'FROM ({nr_keys_sql.format(self.left_keys_table)}) l, '
+            f'({nr_keys_sql.format(self.right_keys_table)}) r;')
+        self.db.execute2list(create_blocks_sql)
+        
+        # Prioritize and prune key pairs via lexical similarity
+        self.nr_matches = 0
+        self.pruning = False
+        self.counters.pruned_tasks = 0
+        if self.blocking is not None:
+            self._apply_blocking()
+        
+        # Create (initially empty) table of matching key pairs
+        create_matches_sql = (
+            'CREATE OR REPLACE TEMPORARY TABLE '
+            f'{self.tmp_table} AS '
+            'SELECT l.key AS left_key, r.key AS right_key '
+            f'FROM {self.left_keys_table} l, {self.right_keys_table} r '
+            'LIMIT 0;')
+        self.db.execute2list(create_matches_sql)
+        self.db.execute2list(
+            'CREATE OR REPLACE TEMPORARY TABLE '
+            f'{self.unresolved_table} AS '
+            f'SELECT * FROM {self.tmp_table} LIMIT 0;')
+        
+        # Consider unordered pairs once for symmetric self-joins
+        self.clusters = EquivalenceClusters()
+        self.symmetric = self._is_symmetric()
+        if self.symmetric:
+            self._prepare_symmetric()
+        
+        # Reuse verdicts from prior queries, if available
+        if self.cache is not None:
+            self._use_cached_results()
+            if self.symmetric:
+                self.db.execute2list(
+                    f'UPDATE {self.blocks_table} b SET processed = TRUE '
+                    f'FROM {self.blocks_table} m '
+                    'WHERE m.block_left = b.block_right '
+                    'AND m.block_right = b.block_left '
+                    'AND m.processed AND NOT b.processed;')
+        
+        # Initialize task counters
         task_count = self.db.execute2list(
-            f'SELECT COUNT(*) FROM {self.tmp_table};')
-        self.counters.nr_unprocessed = task_count[0][0]
+            'SELECT COALESCE(SUM(nr_pairs) FILTER (processed), 0), '
+            'COALESCE(SUM(nr_pairs) FILTER (NOT processed), 0) '
+            f'FROM {self.blocks_table};')
+        self.counters.processed_tasks = int(task_count[0][0])
+        self.counters.unprocessed_tasks = int(task_count[0][1])
 
 
 class NestedLoopJoin(SemanticJoin):
@@ -196,41 +1166,81 @@ class NestedLoopJoin(SemanticJoin):
     invoking the LLM for each pair of rows to check
     (i.e., a nested loops join).
     """
-    def _find_matches(self, pairs):
-        """ Finds pairs satisfying the join condition.
+    def _call_keys(self, pairs, nr_calls):
+        """ Assigns each key pair to one LLM call.
+        
+        Args:
+            pairs: List of key pairs to check for matches.
+            nr_calls (int): Number of LLM calls (one per pair).
+        
+        Returns:
+            list: Tuples of left and right keys for each call.
+        """
+        return [([left_key], [right_key]) for left_key, right_key in pairs]
+    
+    def _keys_kwargs(self, left_keys, right_keys):
+        """ Prepares an LLM call checking one pair of keys.
+        
+        Args:
+            left_keys: List containing one key from the left table.
+            right_keys: List containing one key from the right table.
+        
+        Returns:
+            dict: Keyword arguments for the completion function.
+        """
+        left_item = self._encode_item(left_keys[0])
+        right_item = self._encode_item(right_keys[0])
+        question = (
+            'Do the following items satisfy the join condition '
+            f'"{self.pred.condition}"? '
+            'Answer with 1 for yes, 0 for no.')
+        message = {
+            'role': 'user',
+            'content': [
+                {'type': 'text', 'text': question},
+                left_item,
+                right_item
+            ]
+        }
+        messages = [message]
+        base = self._best_model_args(messages)['join']
+        return {**base, 'messages': messages}
+    
+    def _match_kwargs(self, pairs):
+        """ Prepares one LLM call per key pair.
         
         Args:
             pairs: List of key pairs to check for matches.
         
         Returns:
-            list: List of key pairs that satisfy the join condition.
+            list: Keyword arguments for the completion function.
+        """
+        return [
+            self._keys_kwargs([left_key], [right_key]) \
+            for left_key, right_key in pairs]
+    
+    def _parse_replies(self, pairs, call_keys, kwargs_list, responses):
+        """ Extracts matching pairs from one round of LLM replies.
+        
+        Args:
+            pairs: List of key pairs to check for matches.
+            call_keys: Tuples of left and right keys for each call.
+            kwargs_list: Keyword arguments of the LLM calls.
+            responses: LLM replies (same order as keyword arguments).
+        
+        Returns:
+            tuple: Lists of matching pairs, of keys to evaluate again
+                (always empty), and of unresolved pairs (always empty).
         """
         matches = []
-        for left_key, right_key in pairs:
-            left_item = self._encode_item(left_key)
-            right_item = self._encode_item(right_key)
-            question = (
-                'Do the following items satisfy the join condition '
-                f'"{self.pred.condition}"? '
-                'Answer with 1 for yes, 0 for no.')
-            message = {
-                'role': 'user',
-                'content': [
-                    {'type': 'text', 'text': question},
-                    left_item,
-                    right_item
-                ]
-            }
-            messages = [message]
-            base = self._best_model_args(messages)
-            kwargs = {**base, 'messages': messages}
-            response = completion(**kwargs)
+        for (left_keys, right_keys), kwargs, response in zip(
+                call_keys, kwargs_list, responses):
             model = kwargs['model']
             self.update_cost_counters(model, response)
             result = str(response.choices[0].message.content)
             if result == '1':
-                matches.append((left_key, right_key))
-        return matches
+                matches.append((left_keys[0], right_keys[0]))
+        return matches, [], []
 
 
 class BatchJoin(SemanticJoin):
@@ -239,23 +1249,61 @@ class BatchJoin(SemanticJoin):
     Uses one LLM call to identify multiple matches,
     including in the prompt batches of data from both tables.
     """
-    def _create_prompt(self, left_items, right_items):
+    prompt_format = 'blocks'
+    """ Prompts evaluate all pairs of keys from two blocks. """
+    match_tokens = 6
+    """ Estimated number of output tokens per reported match. """
+    model2schema = {}
+    """ Maps models to flags indicating support for structured output. """
+    response_format = {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': 'join_matches',
+            'strict': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'matches': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'left': {'type': 'integer'},
+                                'right': {'type': 'integer'}},
+                            'required': ['left', 'right'],
+                            'additionalProperties': False}}},
+                'required': ['matches'],
+                'additionalProperties': False}}}
+    """ JSON schema for replies listing matching pairs. """
+    
+    def _create_prompt(self, left_items, right_items, structured=False):
         """ Creates a prompt for the LLM to find matches.
         
         Args:
             left_items: List of left table items.
             right_items: List of right table items.
+            structured (bool): Whether to request a reply in JSON format.
         
         Returns:
             dict: Prompt message for the LLM.
         """
-        task = (
-            'Identify pairs of items from the left and right tables '
-            f'that satisfy the join condition "{self.pred.condition}". '
-            'Write only the IDs of matching pairs (e.g., "L3-R5), '
-            'separated by commas. Write "." after the last pair. '
-            'Sample output: "L3-R5,L4-R2,L1-R1." The output may be empty.'
-            )
+        if structured:
+            task = (
+                'Identify pairs of items from the left and right tables '
+                f'that satisfy the join condition "{self.pred.condition}". '
+                'Return a JSON object listing the numbers of the left and '
+                'right item of each matching pair (e.g., for L3 and R5: '
+                '{"matches": [{"left": 3, "right": 5}]}). '
+                'The list of matches may be empty.'
+                )
+        else:
+            task = (
+                'Identify pairs of items from the left and right tables '
+                f'that satisfy the join condition "{self.pred.condition}". '
+                'Write only the IDs of matching pairs (e.g., "L3-R5), '
+                'separated by commas. Write "." after the last pair. '
+                'Sample output: "L3-R5,L4-R2,L1-R1." The output may be empty.'
+                )
         content = [{
             'type': 'text',
             'text': task
@@ -279,6 +1327,9 @@ class BatchJoin(SemanticJoin):
     def _extract_matches(self, left_keys, right_keys, llm_response):
         """ Extracts matching pairs from the LLM response.
         
+        Replies may either be JSON objects (if structured output
+        was requested) or comma-separated lists of pair IDs.
+        
         Args:
             left_keys: List of keys from the left table.
             right_keys: List of keys from the right table.
@@ -286,36 +1337,124 @@ class BatchJoin(SemanticJoin):
         
         Returns:
             list: List of matching keys (tuples).
+        
+        Raises:
+            ValueError: if the reply is malformed or refers to unknown IDs.
         """
-        content = llm_response.choices[0].message.content
-        # print(content)
+        content = str(llm_response.choices[0].message.content).strip()
+        if content.startswith('{'):
+            try:
+                index_pairs = [
+                    (match['left'], match['right']) \
+                    for match in json.loads(content)['matches']]
+            except (KeyError, TypeError) as e:
+                raise ValueError(f'Invalid JSON reply: {content}') from e
+        else:
+            index_pairs = []
+            content = content.rstrip('.').strip()
+            for pair_str in content.split(',') if content else []:
+                pair_match = re.fullmatch(r'L(\d+)-R(\d+)', pair_str.strip())
+                if pair_match is None:
+                    raise ValueError(f'Invalid pair ID: {pair_str}')
+                index_pairs.append(
+                    (int(pair_match.group(1)), int(pair_match.group(2))))
+        
         matching_keys = []
-        content = content.replace(".", "")
-        pairs_str = content.split(',')
-        for pair_str in pairs_str:
-            pair_str = pair_str.strip()
-            left_ref, right_ref = pair_str.split('-')
-            left_idx = int(left_ref[1:])
-            right_idx = int(right_ref[1:])
-            left_key = left_keys[left_idx]
-            right_key = right_keys[right_idx]
-            key_pair = (left_key, right_key)
-            matching_keys.append(key_pair)
-        
-        return matching_keys        
+        for left_idx, right_idx in index_pairs:
+            if not (type(left_idx) is int and type(right_idx) is int \
+                    and 0 <= left_idx < len(left_keys) \
+                    and 0 <= right_idx < len(right_keys)):
+                raise ValueError(
+                    f'Unknown pair ID: L{left_idx}-R{right_idx}')
+            matching_keys.append((left_keys[left_idx], right_keys[right_idx]))
+        
+        return matching_keys
 
-    def _find_matches(self, pairs):
-        """ Finds pairs satisfying the join condition.
+    def _call_keys(self, pairs, nr_calls):
+        """ Divides the keys of a block among multiple LLM calls.
+        
+        The left keys are split into the given number of consecutive
+        groups of (almost) equal size. Each call covers the pairs
+        associated with one group of left keys.
         
         Args:
             pairs: List of key pairs to check for matches.
+            nr_calls (int): Number of LLM calls for the block.
         
         Returns:
-            list: List of key pairs that satisfy the join condition.
+            list: Tuples of sorted left and right keys for each call.
+        """
+        left_keys, _ = self._sorted_keys(pairs)
+        call_keys = []
+        for call_idx in range(nr_calls):
+            group = set(left_keys[
+                call_idx * len(left_keys) // nr_calls:
+                (call_idx + 1) * len(left_keys) // nr_calls])
+            call_pairs = [pair for pair in pairs if pair[0] in group]
+            call_keys.append(self._sorted_keys(call_pairs))
+        return call_keys
+
+    def _parse_replies(self, pairs, call_keys, kwargs_list, responses):
+        """ Extracts matching pairs from one round of LLM replies.
+        
+        If the reply for a call cannot be parsed, the associated
+        keys are divided into two smaller blocks to evaluate again.
+        Pairs of single keys whose replies cannot be parsed remain
+        unresolved. As prompts cover all combinations of left and
+        right keys, reported matches are only used if they are
+        among the given pairs (e.g., pairs whose verdicts are
+        inferred or pruned are ignored).
+        
+        Args:
+            pairs: List of key pairs to check for matches.
+            call_keys: Tuples of left and right keys for each call.
+            kwargs_list: Keyword arguments of the LLM calls.
+            responses: LLM replies (same order as keyword arguments).
+        
+        Returns:
+            tuple: Lists of matching pairs, of keys (tuples of left
+                and right keys) to evaluate again, and of unresolved
+                pairs.
+        """
+        pair_set = set(pairs)
+        matching_keys = []
+        retry_keys = []
+        unresolved = []
+        for (left_keys, right_keys), kwargs, response in zip(
+                call_keys, kwargs_list, responses):
+            model = kwargs['model']
+            self.update_cost_counters(model, response)
+            try:
+                matching_keys += [
+                    pair for pair in self._extract_matches(
+                        left_keys, right_keys, response) \
+                    if pair in pair_set]
+            except ValueError:
+                self.counters.parse_failures += 1
+                if len(left_keys) == 1 and len(right_keys) == 1:
+                    unresolved.append((left_keys[0], right_keys[0]))
+                else:
+                    retry_keys += [
+                        (sub_left, sub_right) for sub_left, sub_right \
+                        in self._split_keys(left_keys, right_keys) \
+                        if any((l, r) in pair_set \
+                               for l in sub_left for r in sub_right)]
+        
+        return list(dict.fromkeys(matching_keys)), retry_keys, unresolved
+    
+    def _keys_kwargs(self, left_keys, right_keys):
+        """ Prepares an LLM call checking all pairs of given keys.
+        
+        Structured output (in JSON format) is requested if the
+        selected model supports it.
+        
+        Args:
+            left_keys: List of keys from the left table.
+            right_keys: List of keys from the right table.
+        
+        Returns:
+            dict: Keyword arguments for the completion function.
         """
-        # Get list of unique keys from both tables
-        left_keys = sorted(set(left_key for left_key, _ in pairs))
-        right_keys = sorted(set(right_key for _, right_key in pairs))
         # Prepare the items for the LLM prompt
         left_items = [
             self._encode_item(left_key) \
@@ -323,68 +1462,112 @@ class BatchJoin(SemanticJoin):
         right_items = [
             self._encode_item(right_key) \
             for right_key in right_keys]
-        # If there are no keys, return empty list
-        nr_left_items = len(left_items)
-        nr_right_items = len(right_items)
-        if nr_left_items == 0 or nr_right_items == 0:
-            return []
-        # print(f'Nr of left items: {nr_left_items}, ')
-        # print(f'Nr of right items: {nr_right_items}')
         # Construct prompt for LLM
         prompt = self._create_prompt(left_items, right_items)
-        messages = [prompt]
-        base = self._best_model_args(messages)['join']
-        kwargs = {**base, 'messages': messages}
-        response = completion(**kwargs)
-        model = kwargs['model']
-        self.update_cost_counters(model, response)
-        matching_keys = []
-        try:
-            matching_keys = self._extract_matches(
-                left_keys, right_keys, response)
-        except:
-            print('Incorrect output format in LLM reply - continuing join.')
-            # traceback.print_exc()
-            
-        return matching_keys
-
-    def _get_join_candidates(self, order):
-        """ Retrieves unprocessed join pairs for LLM-based evaluation.
+        base = self._best_model_args([prompt])['join']
+        if self._supports_schema(base['model']):
+            prompt = self._create_prompt(left_items, right_items, True)
+            base = {
+                k: v for k, v in base.items() \
+                if k not in ['stop', 'logit_bias']}
+            base['response_format'] = self.response_format
+        return {**base, 'messages': [prompt]}
+    
+    def _match_kwargs(self, pairs):
+        """ Prepares LLM calls covering all key pairs.
         
-        Currently, ordered retrieval is not supported. The
-        retrieval function retrieves all join pairs that are
-        associated with a specific combination of left and
-        right batch IDs.
+        Uses one LLM call per block, unless the expected number
+        of output tokens exceeds the budget per call. The number
+        of output tokens is estimated based on the density of
+        matches among previously evaluated pairs.
         
         Args:
-            order (str): None or tuple (table, column, ascending flag).
+            pairs: List of key pairs to check for matches.
         
         Returns:
-            list: List of key pairs from the left and right table.
+            list: Keyword arguments for the completion function.
         """
-        # Get unprocessed batch IDs for left and right tables
-        find_batch_ids_sql = (
-            'SELECT batch_ID_left, batch_ID_right '
-            f'FROM {self.tmp_table} '
-            'WHERE result IS NULL '
-            'LIMIT 1;')
-        batch_ids = self.db.execute2list(find_batch_ids_sql)
-        if len(batch_ids) == 0:
+        # Get list of unique keys from both tables
+        left_keys, right_keys = self._sorted_keys(pairs)
+        # If there are no keys, no LLM call is needed
+        if not left_keys or not right_keys:
             return []
-        batch_ID_left, batch_ID_right = batch_ids[0]
+        # Split blocks if replies would exceed output token budget
+        nr_calls = min(len(left_keys), self._nr_calls(pairs))
+        return [
+            self._keys_kwargs(left_keys, right_keys) \
+            for left_keys, right_keys in self._call_keys(pairs, nr_calls)]
+    
+    def _nr_calls(self, pairs):
+        """ Determines the number of LLM calls needed for given pairs.
         
-        # Get all key pairs associated with the batch IDs
-        left_key_col = f'left_{self.pred.left_column}'
-        right_key_col = f'right_{self.pred.right_column}'
-        pairs_sql = (
-            f'SELECT {left_key_col}, {right_key_col} '
-            f'FROM {self.tmp_table} '
-            f'WHERE batch_ID_left = {batch_ID_left} '
-            f'AND batch_ID_right = {batch_ID_right} '
-            f'AND result IS NULL;')
-        pairs = self.db.execute2list(pairs_sql)
-        return pairs
+        Args:
+            pairs: List of key pairs to check for matches.
+        
+        Returns:
+            int: Number of calls needed to stay within the output budget.
+        """
+        join_pairs = self.counters.join_pairs
+        if join_pairs == 0:
+            return 1
+        _, output_tokens = self._block_tokens()
+        match_density = self.nr_matches / join_pairs
+        expected_tokens = len(pairs) * match_density * self.match_tokens
+        return max(1, math.ceil(expected_tokens / output_tokens))
+    
+    def _split_keys(self, left_keys, right_keys):
+        """ Divides a block of keys into two smaller blocks.
+        
+        The block must contain more than one pair of keys.
+        
+        Args:
+            left_keys: List of keys from the left table.
+            right_keys: List of keys from the right table.
+        
+        Returns:
+            list: Two tuples of left and right keys.
+        """
+        if len(left_keys) >= len(right_keys):
+            middle = len(left_keys) // 2
+            return [
+                (left_keys[:middle], right_keys),
+                (left_keys[middle:], right_keys)]
+        else:
+            middle = len(right_keys) // 2
+            return [
+                (left_keys, right_keys[:middle]),
+                (left_keys, right_keys[middle:])]
+    
+    def _supports_schema(self, model):
+        """ Checks whether a model supports structured output.
+        
+        Args:
+            model (str): Name of the model.
+        
+        Returns:
+            bool: True iff replies can be constrained by a JSON schema.
+        """
+        if model not in self.model2schema:
+            try:
+                supported = litellm.supports_response_schema(model=model)
+            except Exception:
+                supported = False
+            self.model2schema[model] = supported
+        return self.model2schema[model]
     
+    def _sorted_keys(self, pairs):
+        """ Collects the sorted, unique keys of both tables.
+        
+        Args:
+            pairs: List of key pairs.
+        
+        Returns:
+            tuple: Sorted lists of left and right keys.
+        """
+        left_keys = sorted(set(left_key for left_key, _ in pairs))
+        right_keys = sorted(set(right_key for _, right_key in pairs))
+        return left_keys, right_keys
+
     def _gpt_join_bias(self, model):
         """ Add logit bias on output tokens for GPT models.
         
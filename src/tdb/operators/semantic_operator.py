@@ -4,16 +4,30 @@ Created on Jul 16, 2025
 @author: immanueltrummer
 '''
 import base64
+import hashlib
 import json
 
+from tdb.data.fingerprints import ContentHasher
+from tdb.data.preprocessing import AudioPreprocessor, ImagePreprocessor
+from tdb.execution.cache import PayloadCache
 from tdb.execution.counters import LLMCounters, TdbCounters
+from tdb.execution.dispatcher import LLMDispatcher
 from pathlib import Path
 
 
 class SemanticOperator:
     """ Base class for semantic operators. """
     
-    def __init__(self, db, operator_ID, batch_size, config_path):
+    payload_cache = PayloadCache(256 * 1024 * 1024)
+    """ Encoded files, shared by all semantic operators. """
+    modality2extensions = {
+        'image': ['.png', '.jpg', '.jpeg'],
+        'audio': ['.wav', '.mp3']}
+    """ Maps data types of files to the associated file extensions. """
+    
+    def __init__(
+            self, db, operator_ID, batch_size, config_path, 
+            cache=None, dispatcher=None):
         """
         Initializes the semantic operator with a unique identifier.
         
@@ -25,10 +39,14 @@ class SemanticOperator:
             operator_ID (str): Unique identifier for the operator.
             batch_size (int): Determines number of items to process per call.
             config_path (str): Path to the configuration file for models.
+            cache: None or cache for verdicts across queries.
+            dispatcher: Dispatches LLM calls (None to create a new one).
         """
         self.db = db
         self.operator_ID = operator_ID
         self.batch_size = batch_size
+        self.cache = cache
+        self.in_flight = {}
         self.counters = TdbCounters()
         model_path = Path(config_path)
         if not model_path.exists():
@@ -37,7 +55,162 @@ class SemanticOperator:
         else:
             with open(model_path) as file:
                 self.models = json.load(file)
+        if dispatcher is None:
+            dispatcher = LLMDispatcher(batch_size, self.models)
+        self.dispatcher = dispatcher
+        self.image_preprocessor = ImagePreprocessor(
+            db.db_path, self.models.get('image_preprocessing'))
+        self.audio_preprocessor = AudioPreprocessor(
+            db.db_path, self.models.get('audio_preprocessing'))
+        deduplication = self.models.get('deduplication', {})
+        self.content_hasher = ContentHasher(
+            deduplication.get('perceptual', False))
 
+    def _cache_context(self, kind, modalities, condition, prompt=None):
+        """ Computes the context of cached verdicts for given modalities.
+        
+        Args:
+            kind (str): Type of semantic operator ('filter' or 'join').
+            modalities: Data types of the items to evaluate.
+            condition (str): Condition in natural language.
+            prompt: None (single item and condition) or prompt format.
+        
+        Returns:
+            str: Context under which verdicts are cached.
+        """
+        data_types = {'text', *modalities}
+        model_args = self._modality_model_args(data_types)[kind]
+        return self.cache.context(kind, model_args, condition, prompt)
+    
+    def _duplicate_key(self, item_text):
+        """ Computes a key that is shared by duplicate items.
+        
+        Files with the same content (or, if perceptual deduplication
+        is enabled, similar images) share the same key, even if they
+        are stored under different paths. Text items are identified
+        by their text, files that cannot be read by their path.
+        
+        Args:
+            item_text (str): Text of the item, can be a path.
+        
+        Returns:
+            str: Key shared by duplicate items.
+        """
+        modality = self._item_modality(item_text)
+        if modality == 'text':
+            return f'text:{item_text}'
+        else:
+            file_path = self._item_path(item_text)
+            try:
+                return self.content_hasher.duplicate_key(
+                    file_path, self._file_identity(file_path), modality)
+            except OSError:
+                return f'path:{file_path}'
+    
+    def _item_fingerprint(self, item_text):
+        """ Computes a fingerprint identifying an item across queries.
+        
+        For files, the fingerprint is derived from the file content,
+        regardless of the file path. For text items, the fingerprint
+        is derived from the text itself and for files that cannot be
+        read from their path.
+        
+        Args:
+            item_text (str): Text of the item, can be a path.
+        
+        Returns:
+            str: Fingerprint of the item.
+        """
+        if self._item_modality(item_text) == 'text':
+            identity = f'text:{item_text}'
+        else:
+            file_path = self._item_path(item_text)
+            try:
+                content_hash = self.content_hasher.content_hash(
+                    file_path, self._file_identity(file_path))
+                identity = f'content:{content_hash}'
+            except OSError:
+                identity = f'path:{file_path}'
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+    
+    def _file_identity(self, file_path):
+        """ Identifies a file version via its path, size, and modification time.
+        
+        Args:
+            file_path (Path): Path of the file.
+        
+        Returns:
+            str: Identity that changes whenever the file is modified.
+        """
+        stats = file_path.stat()
+        return (
+            f'file:{file_path.resolve()}:'
+            f'{stats.st_size}:{stats.st_mtime_ns}')
+    
+    def _file_payload(self, file_path):
+        """ Encodes file content in base64, using cached encodings.
+        
+        Args:
+            file_path (Path): Path of the file to encode.
+        
+        Returns:
+            str: File content encoded in base64.
+        """
+        key = self._file_identity(file_path)
+        payload = self.payload_cache.get(key)
+        if payload is None:
+            self.counters.payload_misses += 1
+            with file_path.open('rb') as file:
+                payload = base64.b64encode(file.read()).decode('utf-8')
+            self.payload_cache.put(key, payload)
+        else:
+            self.counters.payload_hits += 1
+        return payload
+    
+    def _item_modality(self, item_text):
+        """ Determines the data type of an item based on its extension.
+        
+        Args:
+            item_text (str): Text of the item, can be a path.
+        
+        Returns:
+            str: Data type of the item ('image', 'audio', or 'text').
+        """
+        for modality, extensions in self.modality2extensions.items():
+            if any(item_text.endswith(e) for e in extensions):
+                return modality
+        return 'text'
+    
+    def _is_file_sql(self, column):
+        """ Generates SQL checking whether column values are file paths.
+        
+        Args:
+            column (str): SQL reference to a column.
+        
+        Returns:
+            str: SQL predicate, true for paths of images or audio files.
+        """
+        extensions = [
+            extension for extensions in self.modality2extensions.values() \
+            for extension in extensions]
+        return '(' + ' OR '.join(
+            f"ends_with({column}::VARCHAR, '{e}')" \
+            for e in extensions) + ')'
+    
+    def _item_path(self, item_text):
+        """ Resolves the path of an item referring to a file.
+        
+        Args:
+            item_text (str): Path of the item, possibly relative.
+        
+        Returns:
+            Path: File path, relative paths refer to database directory.
+        """
+        file_path = Path(item_text)
+        if not file_path.is_absolute():
+            file_path = Path(self.db.db_path).parent / file_path
+        return file_path
+    
     def _encode_item(self, item_text):
         """ Encodes an item as message for LLM processing.
         
@@ -47,31 +220,36 @@ class SemanticOperator:
         Returns:
             dict: Encoded item as a dictionary with 'role' and 'content'.
         """
-        file_path = Path(item_text)
-        if not file_path.is_absolute():
-            file_path = Path(self.db.db_path).parent / file_path
-        if any(
-            item_text.endswith(extension) \
-            for extension in ['.png', '.jpg', '.jpeg']):
-            with file_path.open('rb') as image_file:
-                image = base64.b64encode(
-                    image_file.read()).decode('utf-8')
-                
+        file_path = self._item_path(item_text)
+        modality = self._item_modality(item_text)
+        if modality == 'image':
+            reduced_path = self.image_preprocessor.preprocess(
+                file_path, self._file_identity(file_path))
+            if reduced_path != file_path:
+                self.counters.image_bytes_saved += \
+                    file_path.stat().st_size - reduced_path.stat().st_size
+            image = self._file_payload(reduced_path)
+            image_format = reduced_path.suffix.lower().lstrip('.')
+            if image_format == 'jpg':
+                image_format = 'jpeg'
             return {
                 'type': 'image_url',
                 'image_url': {
-                    'url': f'data:image/jpeg;base64,{image}',
-                    'detail': 'low'
+                    'url': f'data:image/{image_format};base64,{image}',
+                    'detail': self.image_preprocessor.detail
                     }
                 }
-        elif any(
-            item_text.endswith(extension) \
-            for extension in ['.wav', '.mp3']):
-            with file_path.open('rb') as audio_file:
-                audio = base64.b64encode(
-                    audio_file.read()).decode('utf-8')
-            
-            audio_format = item_text.split('.')[-1]
+        elif modality == 'audio':
+            file_identity = self._file_identity(file_path)
+            reduced_path = self.audio_preprocessor.preprocess(
+                file_path, file_identity)
+            if reduced_path != file_path:
+                metadata = self.audio_preprocessor.metadata(
+                    file_path, file_identity)
+                self.counters.audio_seconds_saved += \
+                    metadata['original_seconds'] - metadata['seconds']
+            audio = self._file_payload(reduced_path)
+            audio_format = reduced_path.suffix.lower().lstrip('.')
             return {
                 'type': 'input_audio',
                 'input_audio' : {
@@ -108,7 +286,18 @@ class SemanticOperator:
                         raise ValueError(
                             'Unknown message type: ' 
                             f'{message["type"]}!')
-                    
+        
+        return self._modality_model_args(data_types)
+    
+    def _modality_model_args(self, data_types):
+        """ Selects the LLM model based on data types to process.
+        
+        Args:
+            data_types: Set of data types (audio, text, image).
+        
+        Returns:
+            dict: Keyword parameters selecting and configuring the model.
+        """
         # Select model based on data types
         eligible_models = []
         for model in self.models['models']:
@@ -135,6 +324,12 @@ class SemanticOperator:
         """
         return 'gpt-4' in model or 'gpt-3.5' in model
     
+    def cancel_pending(self):
+        """ Cancels LLM calls that are still in flight. """
+        for future in self.pending_calls():
+            future.cancel()
+        self.in_flight = {}
+    
     def execute(self, order):
         """ Execute operator on a data batch.
         
@@ -143,6 +338,31 @@ class SemanticOperator:
         """
         raise NotImplementedError()
     
+    def execute_streaming(self, order):
+        """ Collects finished LLM calls and submits new ones.
+        
+        Unlike the execute method, this method does not wait for
+        LLM replies. Results of finished calls are written back
+        and new tasks are submitted for each free slot.
+        
+        Args:
+            order (tuple): None or tuple with column name and "ascending" flag.
+        """
+        raise NotImplementedError()
+    
+    def pending_calls(self):
+        """ Returns futures of LLM calls that are still in flight.
+        
+        In-flight tasks map to tuples whose last element is the
+        list of futures of the LLM calls issued for the task.
+        
+        Returns:
+            list: Futures of pending LLM calls.
+        """
+        return [
+            future for *_, futures in self.in_flight.values() \
+            for future in futures]
+    
     def prepare(self):
         """ Prepare for execution by creating the temporary table. """
         raise NotImplementedError()
@@ -12,7 +12,7 @@ import sqlglot
 from dataclasses import dataclass
 from sqlglot import exp
 from sqlglot.optimizer.qualify import qualify
-from sqlglot.optimizer.scope import Scope, traverse_scope
+from sqlglot.optimizer.scope import Scope, build_scope, traverse_scope
 
 
 @dataclass
@@ -28,6 +28,8 @@ class UnaryPredicate():
     """ Natural language condition for the predicate. """
     sql: str
     """ SQL representation of the predicate. """
+    conjunctive: bool = False
+    """ Whether the predicate is a conjunct of the main WHERE clause. """
 
 
 @dataclass
@@ -49,11 +51,22 @@ class JoinPredicate():
     """ Natural language condition for the join predicate. """
     sql: str
     """ SQL representation of the join predicate. """
+    equivalence: bool = False
+    """ Whether the join condition is an equivalence relation. """
 
 
 class Query():
     """ Represents an SQL query with semantic operators. """
     
+    volatile_functions = (
+        exp.CurrentDate, exp.CurrentTime, exp.CurrentTimestamp,
+        exp.Rand, exp.Randn, exp.Uuid)
+    """ Functions whose results may change between invocations. """
+    excluded_functions = [
+        'nlfilter', 'nljoin', 'random', 'setseed',
+        'nextval', 'currval', 'gen_random_uuid']
+    """ Semantic or volatile functions not parsed by sqlglot. """
+    
     def __init__(self, db, sql):
         """ Preprocessing for given SQL query.
         
@@ -70,6 +83,7 @@ class Query():
         semantic_predicates = \
             self._collect_semantic_predicates(
             qualified_exp, alias2table)
+        self._mark_conjunctive(qualified_exp, semantic_predicates)
         
         self.limit = limit
         self.qualified_exp = qualified_exp
@@ -77,9 +91,16 @@ class Query():
         self.scope = scope
         self.alias2table = alias2table
         aliases = alias2table.keys()
-        self.alias2unary_sql = self._collect_unary_sql_predicates(
+        alias2unary_sql = self._collect_unary_sql_predicates(
             qualified_exp, aliases)
+        self.alias2reducers = self._collect_semi_join_reducers(
+            qualified_exp, alias2unary_sql)
+        self.alias2unary_sql = {
+            alias: exp.and_(unary_sql, *self.alias2reducers[alias]) \
+            for alias, unary_sql in alias2unary_sql.items()}
         self.semantic_predicates = semantic_predicates
+        self.monotone = self._is_monotone(qualified_exp)
+        self.single_row = self._is_single_row(qualified_exp)
     
     def _alias2table(self, qualified_exp):
         """ Maps table aliases to table names.
@@ -156,19 +177,89 @@ class Query():
                 left_table = alias2table[left_alias]
                 right_table = alias2table[right_alias]
                 condition = expressions[2].this
+                mode = expressions[3].this.lower() \
+                    if len(expressions) > 3 else None
+                if mode not in [None, 'equivalence']:
+                    raise ValueError(f'Unknown join mode: {mode}')
                 sql = expr.sql()
                 predicate = JoinPredicate(
                     left_table=left_table, left_alias=left_alias, 
                     right_table=right_table, right_alias=right_alias, 
                     left_column=left_column, right_column=right_column, 
-                    condition=condition, sql=sql)
+                    condition=condition, sql=sql, 
+                    equivalence=(mode == 'equivalence'))
                 predicates.append(predicate)
         
         return predicates
     
+    def _collect_semi_join_reducers(self, qualified_exp, alias2unary_sql):
+        """ Derives semi-join reducers from equality join predicates.
+        
+        For each equality predicate between columns of two tables
+        in the main query (a conjunct of the WHERE clause), rows
+        of one table can only appear in the query result if they
+        have a join partner in the other table that satisfies the
+        pure SQL predicates on that table. Semi-join reducers are
+        predicates that express this condition on a single table.
+        
+        Args:
+            qualified_exp (exp.Expression): Fully qualified SQL query.
+            alias2unary_sql (dict): Maps aliases to unary SQL predicates.
+        
+        Returns:
+            Dictionary mapping table aliases to lists of reducers.
+        """
+        alias2reducers = {alias: [] for alias in alias2unary_sql}
+        where_clause = qualified_exp.args.get('where')
+        if not isinstance(qualified_exp, exp.Select) or where_clause is None:
+            return alias2reducers
+        
+        # Only consider base tables in the FROM clause of the main query
+        root_scope = build_scope(qualified_exp)
+        alias2table = {
+            alias: source for alias, source in root_scope.sources.items() \
+            if isinstance(source, exp.Table) and alias in alias2reducers}
+        for conjunct in self._collect_conjuncts_rec(where_clause.this):
+            conjunct = conjunct.unnest()
+            if not isinstance(conjunct, exp.EQ):
+                continue
+            left_col, right_col = conjunct.this, conjunct.expression
+            if not isinstance(left_col, exp.Column) or \
+                not isinstance(right_col, exp.Column):
+                continue
+            left_alias, right_alias = left_col.table, right_col.table
+            if left_alias == right_alias or \
+                left_alias not in alias2table or \
+                right_alias not in alias2table:
+                continue
+            
+            # Each side must have a join partner on the other side
+            for alias, column, other_alias, other_column in [
+                (left_alias, left_col, right_alias, right_col),
+                (right_alias, right_col, left_alias, left_col)]:
+                other_table = alias2table[other_alias].name
+                other_filters = alias2unary_sql[other_alias]
+                reducer = sqlglot.parse_one(
+                    f'{column.sql()} IN ('
+                    f'SELECT {other_column.sql()} '
+                    f'FROM {other_table} AS {other_alias} '
+                    f'WHERE {other_filters.sql()} '
+                    f'AND {other_column.sql()} IS NOT NULL)')
+                alias2reducers[alias].append(reducer)
+        
+        return alias2reducers
+    
     def _collect_unary_sql_predicates(self, qualified_sql, aliases):
         """ Collects unary predicates (pure SQL) from the query.
         
+        Considers conjuncts of WHERE clauses and of join conditions
+        in all query scopes (including sub-queries and CTEs). Join
+        conditions of outer joins are only used for the tables whose
+        rows may be dropped by the join condition. Join conditions of
+        anti joins (and of unknown join types) are only used for the
+        joined table. Predicates are only associated with tables in
+        the same scope.
+        
         Args:
             qualified_sql (exp.Expression): fully qualified SQL query.
             aliases: List of table aliases in root query scope.
@@ -180,24 +271,48 @@ class Query():
             alias : exp.Boolean(this=True) \
             for alias in aliases
             }
-        # Collect all queries to analyze (including sub-queries)
-        queries2analyze = [qualified_sql]
-        scope = Scope(qualified_sql)
-        queries2analyze.extend(scope.subqueries)
-        # Iterate over queries and analyze SELECT clauses
-        for query in queries2analyze:
+        # Iterate over all scopes (including sub-queries and CTEs)
+        for scope in traverse_scope(qualified_sql):
+            query = scope.expression
+            if not isinstance(query, exp.Select):
+                continue
+            scope_aliases = [
+                alias for alias, source in scope.sources.items() \
+                if isinstance(source, exp.Table) and alias in aliases]
+            # Collect conjuncts with tables they may filter
+            conjuncts2aliases = []
             where_clause = query.args.get('where')
             if where_clause is not None:
-                where_content = where_clause.this
-                conjuncts = self._collect_conjuncts_rec(
-                    where_content)
+                conjuncts2aliases.append(
+                    (where_clause.this, scope_aliases))
+            for join in query.args.get('joins', []):
+                join_condition = join.args.get('on')
+                if join_condition is None:
+                    continue
+                join_alias = join.this.alias_or_name
+                side = join.side.upper()
+                kind = join.kind.upper()
+                if side == 'FULL':
+                    join_aliases = []
+                elif side == 'LEFT' and kind in ('', 'OUTER'):
+                    join_aliases = [join_alias]
+                elif side == 'RIGHT' and kind in ('', 'OUTER'):
+                    join_aliases = [
+                        a for a in scope_aliases if a != join_alias]
+                elif not side and kind in ('', 'INNER', 'CROSS', 'SEMI'):
+                    join_aliases = scope_aliases
+                else:
+                    # Anti joins keep rows without matches
+                    join_aliases = [join_alias]
+                conjuncts2aliases.append((join_condition, join_aliases))
+            
+            for conjunction, filtered_aliases in conjuncts2aliases:
+                conjuncts = self._collect_conjuncts_rec(conjunction)
                 for conjunct in conjuncts:
                     alias = self._get_unary_alias(conjunct)
-                    if alias is not None and alias in aliases:
+                    if alias is not None and alias in filtered_aliases:
                         prior_pred = alias2preds[alias]
-                        new_pred = exp.And(
-                            this=prior_pred, 
-                            expression=conjunct)
+                        new_pred = exp.and_(prior_pred, conjunct)
                         alias2preds[alias] = new_pred
         
         return alias2preds
@@ -226,36 +341,129 @@ class Query():
     def _get_unary_alias(self, expression):
         """ Return associated alias if this is a unary predicate.
         
+        Unary predicates are deterministic predicates, expressed
+        in pure SQL, that reference columns of exactly one table.
+        Predicates with sub-queries are not considered.
+        
         Args:
             expression (exp.Expression): SQL expression to check.
         
         Returns:
             Table alias or None.
         """
-        if isinstance(expression, exp.Binary):
-            left_input = expression.this
-            right_input = expression.expression
-            if isinstance(left_input, exp.Column) and \
-                  isinstance(right_input, exp.Literal):
-                return left_input.table
-            elif isinstance(left_input, exp.Literal) and \
-                  isinstance(right_input, exp.Column):
-                return right_input.table
-            elif isinstance(left_input, exp.Column) and \
-                isinstance(right_input, exp.Column):
-                left_table = left_input.table
-                right_table = right_input.table
-                if (left_table == right_table):
-                    return left_table
-                
-        elif isinstance(expression, exp.Unary):
-            referenced_cols = list(expression.find_all(exp.Column))
-            if len(referenced_cols) == 1:
-                referenced_col = referenced_cols[0]
-                alias = referenced_col.table
+        if expression.find(exp.Select):
+            return None
+        for function in expression.find_all(exp.Func):
+            if isinstance(function, self.volatile_functions):
+                return None
+            if isinstance(function, exp.Anonymous) and \
+                function.name.lower() in self.excluded_functions:
+                return None
+        
+        referenced_aliases = set(
+            column.table for column in expression.find_all(exp.Column))
+        if len(referenced_aliases) == 1:
+            alias = referenced_aliases.pop()
+            if alias:
                 return alias
         
         return None
+    
+    def _is_monotone(self, qualified_exp):
+        """ Checks if query results are monotone in semantic predicates.
+        
+        This is the case if all semantic predicates are conjuncts
+        in the WHERE clause of the main query (i.e., they are not
+        negated or nested in sub-queries) and if the query result
+        grows or shrinks with the set of qualifying rows. The latter
+        holds for queries without aggregates, as well as for queries
+        whose output consists of COUNT, MIN, and MAX aggregates (no
+        grouping). For monotone queries, the results obtained when
+        treating all un-evaluated rows as satisfying or all rows as
+        not satisfying the semantic predicates bound all others.
+        
+        Args:
+            qualified_exp (exp.Expression): Fully qualified SQL query.
+        
+        Returns:
+            True if the query is provably monotone, False otherwise.
+        """
+        if not isinstance(qualified_exp, exp.Select):
+            return False
+        
+        # Semantic predicates must be conjuncts of the WHERE clause
+        semantic_exps = [
+            expr for expr in qualified_exp.find_all(exp.Anonymous) \
+            if expr.name.lower() in ['nlfilter', 'nljoin']]
+        where_clause = qualified_exp.args.get('where')
+        conjuncts = [] if where_clause is None \
+            else self._collect_conjuncts_rec(where_clause.this)
+        conjuncts = [conjunct.unnest() for conjunct in conjuncts]
+        for semantic_exp in semantic_exps:
+            if not any(semantic_exp is conjunct for conjunct in conjuncts):
+                return False
+        
+        # Limits and offsets select rows based on the result size
+        for clause in ['limit', 'offset', 'having']:
+            if qualified_exp.args.get(clause) is not None:
+                return False
+        
+        # Window functions depend on other rows in the result
+        projections = qualified_exp.expressions
+        if any(projection.find(exp.Window) for projection in projections):
+            return False
+        
+        # Aggregates must be monotone in the set of aggregated rows
+        if any(projection.find(exp.AggFunc) for projection in projections):
+            if qualified_exp.args.get('group') is not None:
+                return False
+            for projection in projections:
+                if not isinstance(
+                    projection.unalias(), (exp.Count, exp.Max, exp.Min)):
+                    return False
+        
+        return True
+    
+    def _is_single_row(self, qualified_exp):
+        """ Checks if the query always produces exactly one row.
+        
+        This is the case for queries with aggregates in the SELECT
+        clause that neither group rows nor filter groups.
+        
+        Args:
+            qualified_exp (exp.Expression): Fully qualified SQL query.
+        
+        Returns:
+            True if the query always produces a single result row.
+        """
+        if not isinstance(qualified_exp, exp.Select):
+            return False
+        for clause in ['group', 'having', 'limit', 'offset']:
+            if qualified_exp.args.get(clause) is not None:
+                return False
+        return any(
+            projection.find(exp.AggFunc) \
+            for projection in qualified_exp.expressions)
+    
+    def _mark_conjunctive(self, qualified_exp, semantic_predicates):
+        """ Marks unary predicates that are conjuncts of the WHERE clause.
+        
+        Rows that do not satisfy such predicates cannot appear
+        in the query result.
+        
+        Args:
+            qualified_exp (exp.Expression): Fully qualified SQL expression.
+            semantic_predicates: List of semantic predicates in the query.
+        """
+        where_clause = qualified_exp.args.get('where')
+        if where_clause is None:
+            return
+        conjuncts = self._collect_conjuncts_rec(where_clause.this)
+        conjunct_sqls = set(conjunct.sql() for conjunct in conjuncts)
+        for predicate in semantic_predicates:
+            if isinstance(predicate, UnaryPredicate):
+                predicate.conjunctive = predicate.sql in conjunct_sqls
+
 
 if __name__ == "__main__":
     from tdb.data.relational import Database
@@ -40,13 +40,17 @@ class QueryRewriter():
             f'where result = true'
         if null_as == True:
             true_items_sql += ' or result is NULL'
-        return f'{filter_op.filtered_column} IN ({true_items_sql})'
+        column_ref = \
+            f'{filter_op.filtered_alias}.{filter_op.filtered_column}'
+        return f'{column_ref} IN ({true_items_sql})'
     
     def join2sql(self, join_op, null_as):
         """ Transforms NL join predicate into pure SQL.
         
         The SQL predicate refers to the temporary table
-        containing results for a subset of rows.
+        containing matching key pairs and, if un-evaluated
+        pairs are treated as matches, to the tables tracking
+        unprocessed pairs of key blocks and unresolved pairs.
         
         Args:
             join_op: semantic join operator.
@@ -56,17 +60,31 @@ class QueryRewriter():
             str: SQL predicate for the temporary table.
         """
         join_pred = join_op.pred
+        left_ref = f'{join_pred.left_alias}.{join_pred.left_column}'
+        right_ref = f'{join_pred.right_alias}.{join_pred.right_column}'
         true_items_sql = (
-            f'select left_{join_pred.left_column}, '
-            f'right_{join_pred.right_column} '
-            f'from {join_op.tmp_table} '
-            f'where result = true')
+            f'select left_key, right_key '
+            f'from {join_op.tmp_table}')
+        join_sql = f'({left_ref}, {right_ref}) IN ({true_items_sql})'
         if null_as == True:
-            true_items_sql += ' or result is NULL'
-        return (
-            f' ({join_pred.left_alias}.{join_pred.left_column}, ' 
-            f'{join_pred.right_alias}.{join_pred.right_column}) '
-            f' IN ({true_items_sql}) ')
+            unprocessed_blocks_sql = (
+                f'select block_left, block_right '
+                f'from {join_op.blocks_table} '
+                f'where not processed')
+            key_blocks_sql = (
+                f'(select block_id from {join_op.left_keys_table} '
+                f'where key = {left_ref}), '
+                f'(select block_id from {join_op.right_keys_table} '
+                f'where key = {right_ref})')
+            unresolved_pairs_sql = (
+                f'select left_key, right_key '
+                f'from {join_op.unresolved_table}')
+            join_sql += (
+                f' OR ({key_blocks_sql}) '
+                f'IN ({unprocessed_blocks_sql})'
+                f' OR ({left_ref}, {right_ref}) '
+                f'IN ({unresolved_pairs_sql})')
+        return f' ({join_sql}) '
     
     def pure_sql(self, op2default):
         """ Transforms the query with semantic operators into pure SQL.
@@ -0,0 +1,67 @@
+'''
+Tests for the preprocessing of media files.
+'''
+import numpy as np
+import pytest
+import wave
+
+from pathlib import Path
+from tdb.data.preprocessing import AudioPreprocessor, ImagePreprocessor
+from test.test_util import root_dir
+
+
+image_path = Path(root_dir, 'data', 'cars', 'images', 'black_audi.jpg')
+
+
+def test_disabled():
+    """ Tests that images remain unchanged without preprocessing. """
+    preprocessor = ImagePreprocessor(':memory:')
+    assert preprocessor.preprocess(image_path, 'identity') == image_path
+    assert preprocessor.detail == 'low'
+
+
+def test_downscaling(tmp_path):
+    """ Tests downscaling of images (requires Pillow).
+
+    Args:
+        tmp_path: temporary directory for the database.
+    """
+    Image = pytest.importorskip('PIL.Image')
+    config = {'max_edge': 64, 'format': 'jpeg', 'quality': 50}
+    db_path = str(tmp_path / 'test.db')
+    preprocessor = ImagePreprocessor(db_path, config)
+    reduced_path = preprocessor.preprocess(image_path, 'identity')
+    assert reduced_path.parent == tmp_path / 'thalamusdb_images'
+    with Image.open(reduced_path) as image:
+        assert max(image.size) <= 64
+    assert reduced_path.stat().st_size < image_path.stat().st_size
+
+
+def test_audio(tmp_path):
+    """ Tests downmixing, resampling, and trimming of audio files.
+
+    Args:
+        tmp_path: temporary directory for the database and audio files.
+    """
+    # Ten seconds of stereo audio at 44.1 kHz
+    audio_path = tmp_path / 'test.wav'
+    samples = np.zeros((441000, 2), '<i2')
+    samples[:, 0] = 1000
+    with wave.open(str(audio_path), 'wb') as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(44100)
+        wav_file.writeframes(samples.tobytes())
+
+    config = {'sample_rate': 8000, 'max_seconds': 3, 'segments': 3}
+    preprocessor = AudioPreprocessor(str(tmp_path / 'test.db'), config)
+    reduced_path = preprocessor.preprocess(audio_path, 'identity')
+    metadata = preprocessor.metadata(audio_path, 'identity')
+    assert reduced_path.suffix == '.wav'
+    assert metadata == {'original_seconds': 10, 'seconds': 3}
+    with wave.open(str(reduced_path), 'rb') as wav_file:
+        assert wav_file.getnchannels() == 1
+        assert wav_file.getframerate() == 8000
+        assert wav_file.getnframes() == 24000
+        reduced = np.frombuffer(wav_file.readframes(10), '<i2')
+        assert all(abs(reduced - 500) <= 1)
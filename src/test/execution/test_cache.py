@@ -0,0 +1,77 @@
+'''
+Tests for caches of verdicts and encoded items.
+'''
+import pandas as pd
+
+from tdb.data.relational import Database
+from tdb.execution.cache import PayloadCache, VerdictCache
+
+
+def _keys(items):
+    """ Creates cache keys for unary filter verdicts on given items.
+    
+    Args:
+        items: List of item fingerprints.
+    
+    Returns:
+        Data frame containing cache keys.
+    """
+    return pd.DataFrame({
+        'context': 'test',
+        'left_item': items,
+        'right_item': ''})
+
+
+def test_lookup():
+    """ Tests storing and retrieving cached verdicts. """
+    cache = VerdictCache(Database(':memory:'))
+    verdicts = _keys(['a', 'b'])
+    verdicts['result'] = [True, False]
+    cache.store(verdicts)
+    hits = cache.lookup(_keys(['a', 'b', 'c']))
+    item2result = dict(zip(hits['left_item'], hits['result']))
+    assert item2result == {'a': True, 'b': False}
+
+
+def test_eviction():
+    """ Tests that the cache size remains bounded. """
+    cache = VerdictCache(Database(':memory:'), max_entries=2)
+    for item in ['a', 'b', 'c']:
+        verdicts = _keys([item])
+        verdicts['result'] = True
+        cache.store(verdicts)
+    hits = cache.lookup(_keys(['a', 'b', 'c']))
+    assert sorted(hits['left_item']) == ['b', 'c']
+
+
+def test_cache_size():
+    """ Tests that the number of cached verdicts is tracked. """
+    cache = VerdictCache(Database(':memory:'))
+    verdicts = _keys(['a', 'b'])
+    verdicts['result'] = True
+    cache.store(verdicts)
+    cache.store(verdicts)
+    assert cache.nr_entries == 2
+
+
+def test_prompt_contexts():
+    """ Tests that prompt formats lead to different contexts. """
+    single = VerdictCache.context('filter', {}, 'is red')
+    batched = VerdictCache.context(
+        'filter', {}, 'is red', {'batch_size': 5, 'conditions': ['is red']})
+    assert single != batched
+
+
+def test_payload_cache():
+    """ Tests LRU eviction of payloads based on their total size. """
+    cache = PayloadCache(max_bytes=10)
+    cache.put('a', 'x' * 4)
+    cache.put('b', 'x' * 4)
+    assert cache.get('a') is not None
+    cache.put('c', 'x' * 4)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.nr_bytes == 8
+    cache.put('d', 'x' * 11)
+    assert cache.get('d') is None
@@ -0,0 +1,22 @@
+'''
+Tests for clusters of equivalent items.
+'''
+from tdb.execution.clusters import EquivalenceClusters
+
+
+def test_inference():
+    """ Tests inference of verdicts from matches and non-matches. """
+    clusters = EquivalenceClusters()
+    assert clusters.verdict('a', 'b') is None
+    clusters.union('a', 'b')
+    clusters.union('b', 'c')
+    assert clusters.verdict('a', 'c') is True
+    clusters.separate('c', 'd')
+    assert clusters.verdict('a', 'd') is False
+    clusters.union('d', 'e')
+    assert clusters.verdict('b', 'e') is False
+    assert clusters.verdict('e', 'f') is None
+    
+    # Inconsistent matches do not merge separated clusters
+    clusters.union('a', 'e')
+    assert clusters.verdict('a', 'e') is False
@@ -0,0 +1,32 @@
+'''
+Tests for the dispatcher of LLM calls.
+'''
+import asyncio
+
+from test.test_util import create_response
+from tdb.execution.dispatcher import LLMDispatcher
+
+
+def test_concurrency_limit(mocker):
+    """ Tests that the dispatcher bounds concurrent LLM calls. """
+    in_flight = 0
+    max_in_flight = 0
+
+    async def mock_acompletion(**kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return create_response(kwargs['messages'][0]['content'])
+
+    mocker.patch('tdb.execution.dispatcher.acompletion', mock_acompletion)
+    dispatcher = LLMDispatcher(3)
+    kwargs_list = [
+        {'model': 'test', 'messages': [{'role': 'user', 'content': str(i)}]}
+        for i in range(10)]
+    responses = dispatcher.complete_all(kwargs_list)
+    dispatcher.close()
+    contents = [r.choices[0].message.content for r in responses]
+    assert contents == [str(i) for i in range(10)]
+    assert max_in_flight == 3
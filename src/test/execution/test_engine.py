@@ -5,11 +5,19 @@ Created on Aug 6, 2025
 
 End-to-end tests for the query execution engine.
 '''
+import shutil
+
+from tdb.data.relational import Database
+from tdb.execution.cache import VerdictCache
 from tdb.execution.engine import ExecutionEngine
+from tdb.data.fingerprints import ContentHasher
+from tdb.operators.fused_filter import FusedFilter
+from tdb.operators.semantic_operator import SemanticOperator
 from tdb.execution.constraints import Constraints
 from tdb.queries.query import Query
-from test.test_util import set_mock_filter
-from test.test_util import cars_db, model_config_path
+from test.test_util import set_mock_completion, set_mock_filter, set_mock_join
+from test.test_util import cars_db, cars_db_path, model_config_path
+from test.test_util import config_with
 
 
 def test_retrieval(mocker):
@@ -38,6 +46,24 @@ def test_retrieval(mocker):
     assert counters.unprocessed_tasks == 0
 
 
+def test_mixed_case_column(mocker, tmp_path):
+    """ Tests filters on columns whose names contain upper-case letters.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database.
+    """
+    db = Database(str(tmp_path / 'items.db'))
+    db.execute2list(
+        'CREATE TABLE items AS SELECT * FROM '
+        "(VALUES ('a'), ('b')) t(\"Pic\");")
+    query = Query(db, "SELECT * FROM items WHERE NLfilter(pic, 'a car');")
+    set_mock_filter(mocker, True)
+    engine = ExecutionEngine(db, 1, model_config_path)
+    result, _ = engine.run(query, Constraints())
+    assert len(result) == 2
+
+
 def test_limit(mocker):
     """ Test retrieval queries with LIMIT clauses.
     
@@ -83,4 +109,789 @@ def test_aggregation(mocker):
     result, counters = engine.run(query, constraints)
     assert result.iloc[0, 0] == 0
     assert counters.processed_tasks == 5
-    assert counters.unprocessed_tasks == 0
\ No newline at end of file
+    assert counters.unprocessed_tasks == 0
+
+
+def test_ordered_retrieval():
+    """ Tests that filters retrieve items in the requested order. """
+    query_str = "SELECT * FROM cars WHERE NLfilter(description, 'a car');"
+    query = Query(cars_db, query_str)
+    engine = ExecutionEngine(cars_db, 1, model_config_path)
+    semantic_filter = engine._create_operators(query)[0]
+    semantic_filter.prepare()
+    descriptions = sorted(
+        row[0] for row in cars_db.execute2list(
+            'SELECT DISTINCT description FROM cars'))
+    items = semantic_filter._retrieve_items(None, ('description', False))
+    assert [item_text for _, item_text in items] == descriptions[::-1]
+
+
+def test_cache(mocker):
+    """ Tests reuse of cached verdicts across queries.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+    """
+    query_str = "SELECT * FROM cars WHERE NLfilter(pic, 'a cached car');"
+    query = Query(cars_db, query_str)
+    cache = VerdictCache(cars_db)
+    constraints = Constraints()
+    engine = ExecutionEngine(cars_db, 1, model_config_path, cache)
+    
+    # First run stores verdicts in the cache
+    set_mock_filter(mocker, True)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 5
+    assert counters.cache_misses == 5
+    
+    # Second run uses cached verdicts instead of (changed) LLM output
+    set_mock_filter(mocker, False)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 5
+    assert counters.cache_hits == 5
+
+
+def test_cache_prompt_format(mocker, tmp_path):
+    """ Tests that verdicts are only reused for the same prompt format.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    db = Database(str(tmp_path / 'items.db'))
+    db.execute2list(
+        "CREATE TABLE items AS SELECT * FROM "
+        "(VALUES ('red car'), ('blue car')) t(name);")
+    query = Query(db, "SELECT * FROM items WHERE NLfilter(name, 'is red');")
+    cache = VerdictCache(db)
+    constraints = Constraints()
+    set_mock_completion(mocker, lambda kwargs: \
+        'I0.' if len(kwargs['messages'][0]['content']) > 2 else '1')
+    engine = ExecutionEngine(db, 1, model_config_path, cache)
+    _, counters = engine.run(query, constraints)
+    assert counters.cache_misses == 2
+    
+    # Verdicts of single-item prompts are not used for batches
+    config_path = config_with(tmp_path, filter_batch_sizes={'text': 2})
+    engine = ExecutionEngine(db, 1, config_path, cache)
+    _, counters = engine.run(query, constraints)
+    assert counters.cache_hits == 0
+    _, counters = engine.run(query, constraints)
+    assert counters.cache_hits == 2
+
+
+def test_join(mocker):
+    """ Tests query execution engine for semantic joins.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+    """
+    query_str = (
+        "SELECT C1.description, C2.description FROM cars C1, cars C2 "
+        "WHERE NLjoin(C1.description, C2.description, 'same car');")
+    query = Query(cars_db, query_str)
+    
+    # Keys are sorted within blocks, so the reply matches identical cars
+    set_mock_join(mocker, 'L0-R0,L1-R1,L2-R2,L3-R3,L4-R4.')
+    constraints = Constraints()
+    engine = ExecutionEngine(cars_db, 1, model_config_path)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 5
+    assert all(result.iloc[:, 0] == result.iloc[:, 1])
+    assert counters.processed_tasks == 25
+    assert counters.unprocessed_tasks == 0
+
+
+def test_join_retry(mocker):
+    """ Tests that joins retry blocks with malformed replies.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+    """
+    query_str = (
+        "SELECT C1.description, C2.description FROM cars C1, cars C2 "
+        "WHERE NLjoin(C1.description, C2.description, 'same car');")
+    query = Query(cars_db, query_str)
+    
+    # Unknown IDs in the first reply lead to two smaller blocks
+    calls = []
+    def reply_content(kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            return 'L0-R0,L7-R1.'
+        return '{"matches": [{"left": 0, "right": 0}]}'
+    set_mock_completion(mocker, reply_content)
+    constraints = Constraints()
+    engine = ExecutionEngine(cars_db, 1, model_config_path)
+    result, counters = engine.run(query, constraints)
+    assert all('response_format' in kwargs for kwargs in calls)
+    assert len(calls) == 3
+    assert len(result) == 2
+    assert counters.parse_failures == 1
+    assert counters.join_calls == 3
+
+
+def test_streaming_retry(mocker):
+    """ Tests that streaming joins submit retries without waiting.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+    """
+    query_str = (
+        "SELECT C1.description, C2.description FROM cars C1, cars C2 "
+        "WHERE NLjoin(C1.description, C2.description, 'same car');")
+    query = Query(cars_db, query_str)
+    
+    calls = []
+    def reply_content(kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            return 'L0-R0,L7-R1.'
+        return '{"matches": [{"left": 0, "right": 0}]}'
+    set_mock_completion(mocker, reply_content)
+    constraints = Constraints()
+    engine = ExecutionEngine(
+        cars_db, 1, model_config_path, streaming=True)
+    complete_all = mocker.spy(engine.dispatcher, 'complete_all')
+    result, counters = engine.run(query, constraints)
+    assert complete_all.call_count == 0
+    assert len(calls) == 3
+    assert len(result) == 2
+    assert counters.parse_failures == 1
+    assert counters.join_calls == 3
+
+
+def test_unresolved_pairs(mocker, tmp_path):
+    """ Tests that pairs with malformed replies remain unresolved.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database.
+    """
+    db = Database(str(tmp_path / 'items.db'))
+    db.execute2list(
+        "CREATE TABLE lefts AS SELECT * FROM "
+        "(VALUES ('A'), ('B')) t(name);")
+    db.execute2list(
+        "CREATE TABLE rights AS SELECT * FROM (VALUES ('X')) t(name);")
+    query = Query(db, (
+        "SELECT * FROM lefts l, rights r "
+        "WHERE NLjoin(l.name, r.name, 'related');"))
+    cache = VerdictCache(db)
+    
+    # Replies for pair B-X cannot be parsed
+    calls = []
+    def reply_content(kwargs):
+        content = kwargs['messages'][0]['content']
+        left_keys = [entry['text'] for entry in content[2::2][:-1]]
+        calls.append(left_keys)
+        if left_keys == ['A']:
+            return '{"matches": [{"left": 0, "right": 0}]}'
+        return 'L9-R9.'
+    set_mock_completion(mocker, reply_content)
+    constraints = Constraints(max_calls=5)
+    engine = ExecutionEngine(db, 1, model_config_path, cache)
+    result, counters = engine.run(query, constraints)
+    assert calls[:3] == [['A', 'B'], ['A'], ['B']]
+    assert all(left_keys == ['B'] for left_keys in calls[3:])
+    assert counters.processed_tasks == 1
+    assert counters.unprocessed_tasks == 1
+    
+    # Unresolved pairs are evaluated again instead of using the cache
+    calls.clear()
+    set_mock_completion(mocker, lambda kwargs: (
+        calls.append(kwargs), '{"matches": []}')[1])
+    result, counters = engine.run(query, Constraints())
+    assert len(calls) == 1
+    assert len(result) == 1
+    assert counters.cache_hits == 1
+
+
+def test_streaming(mocker, tmp_path):
+    """ Tests pipelined execution of filters and joins.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for configuration.
+    """
+    config_path = config_with(tmp_path, filter_batch_sizes={'image': 5})
+    query_str = (
+        "SELECT C1.description, C2.description FROM cars C1, cars C2 "
+        "WHERE NLfilter(C1.pic, 'a car') "
+        "AND NLjoin(C1.description, C2.description, 'same car');")
+    query = Query(cars_db, query_str)
+    
+    # The filter accepts all cars and the join matches identical cars
+    set_mock_completion(mocker, lambda kwargs: \
+        'L0-R0,L1-R1,L2-R2,L3-R3,L4-R4.' \
+        if 'join condition' in str(kwargs['messages']) \
+        else 'I0,I1,I2,I3,I4.')
+    constraints = Constraints()
+    engine = ExecutionEngine(
+        cars_db, 2, config_path, streaming=True)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 5
+    assert counters.processed_tasks == 30
+    assert counters.unprocessed_tasks == 0
+
+
+def test_batched_filter(mocker, tmp_path):
+    """ Tests filters evaluating multiple items per LLM call.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for configuration.
+    """
+    config_path = config_with(tmp_path, filter_batch_sizes={'image': 5})
+    query_str = "SELECT * FROM cars WHERE NLfilter(pic, 'a red car');"
+    query = Query(cars_db, query_str)
+    constraints = Constraints()
+    engine = ExecutionEngine(cars_db, 1, config_path)
+    
+    # All five images are evaluated via one call
+    set_mock_completion(mocker, lambda kwargs: 'I1,I3.')
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 2
+    assert counters.processed_tasks == 5
+    assert sum(c.LLM_calls for c in counters.model2counters.values()) == 1
+    
+    # Unparsable replies lead to one call per item
+    set_mock_completion(mocker, lambda kwargs: \
+        '1' if len(kwargs['messages'][0]['content']) == 2 else 'red')
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 5
+    assert sum(c.LLM_calls for c in counters.model2counters.values()) == 6
+    
+    # Encoded images are reused from the payload cache
+    assert counters.payload_misses == 0
+    assert counters.payload_hits == 10
+
+
+def test_duplicates(mocker, tmp_path):
+    """ Tests that duplicate files are evaluated only once.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database, images, and configuration.
+    """
+    images_dir = cars_db_path.parent / 'images'
+    shutil.copy(images_dir / 'black_audi.jpg', tmp_path / 'a.jpg')
+    shutil.copy(images_dir / 'black_audi.jpg', tmp_path / 'b.jpg')
+    shutil.copy(images_dir / 'red_mercedes.jpg', tmp_path / 'c.jpg')
+    db = Database(str(tmp_path / 'pics.db'))
+    db.execute2list(
+        "CREATE TABLE pics AS SELECT * FROM "
+        "(VALUES ('a.jpg'), ('b.jpg'), ('c.jpg')) t(pic);")
+    constraints = Constraints()
+    config_path = config_with(tmp_path, filter_batch_sizes={'image': 5})
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # Filter evaluates two distinct images, verdicts apply to all copies
+    query = Query(db, "SELECT * FROM pics WHERE NLfilter(pic, 'a car');")
+    nr_items = []
+    def reply_content(kwargs):
+        nr_items.append((len(kwargs['messages'][0]['content']) - 1) // 2)
+        return 'I0,I1.'
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 3
+    assert nr_items == [2]
+    assert counters.processed_tasks == 2
+    
+    # Join evaluates pairs of distinct images, matches apply to copies
+    query = Query(db, (
+        "SELECT * FROM pics p1, pics p2 "
+        "WHERE NLjoin(p1.pic, p2.pic, 'same car');"))
+    set_mock_join(mocker, 'L0-R0,L1-R1.')
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 5
+    assert counters.processed_tasks == 4
+
+
+def test_missing_file(mocker, tmp_path):
+    """ Tests that files are hashed lazily and may be missing.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and images.
+    """
+    images_dir = cars_db_path.parent / 'images'
+    shutil.copy(images_dir / 'black_audi.jpg', tmp_path / 'a.jpg')
+    shutil.copy(images_dir / 'black_audi.jpg', tmp_path / 'b.jpg')
+    db = Database(str(tmp_path / 'pics.db'))
+    db.execute2list(
+        "CREATE TABLE pics AS SELECT * FROM "
+        "(VALUES ('a.jpg'), ('b.jpg'), ('missing.jpg')) t(pic);")
+    hash_spy = mocker.spy(ContentHasher, 'duplicate_key')
+    
+    # Query completes before the missing file is retrieved
+    query = Query(db, (
+        "SELECT * FROM pics WHERE NLfilter(pic, 'a car') LIMIT 1;"))
+    set_mock_filter(mocker, True)
+    engine = ExecutionEngine(db, 1, model_config_path)
+    result, _ = engine.run(query, Constraints())
+    assert len(result) >= 1
+    assert hash_spy.call_count == 1
+    
+    # Missing files are not merged with other files
+    operator = SemanticOperator(db, 'test', 1, model_config_path)
+    assert operator._duplicate_key('missing.jpg') != \
+        operator._duplicate_key('a.jpg')
+
+
+def test_repeated_values(mocker, tmp_path):
+    """ Tests that filters evaluate each distinct value only once.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for the database.
+    """
+    db = Database(str(tmp_path / 'reviews.db'))
+    db.execute2list(
+        "CREATE TABLE reviews AS SELECT * FROM (VALUES "
+        "(1, 'great'), (2, 'great'), (3, 'bad'), (4, NULL)) t(id, review);")
+    constraints = Constraints()
+    engine = ExecutionEngine(db, 1, model_config_path)
+    
+    # Task table holds one row per distinct value, with multiplicity
+    query = Query(db, (
+        "SELECT id FROM reviews "
+        "WHERE NLfilter(review, 'a positive review');"))
+    set_mock_filter(mocker, True)
+    result, counters = engine.run(query, constraints)
+    assert sorted(result['id']) == [1, 2, 3]
+    assert counters.processed_tasks == 2
+    task_rows = db.execute2list(
+        "SELECT table_name FROM duckdb_tables() "
+        "WHERE table_name LIKE 'ThalamusDB_%';")
+    task_table = task_rows[0][0]
+    multiplicities = db.execute2list(
+        f"SELECT base_review, multiplicity FROM {task_table} "
+        "ORDER BY base_review;")
+    assert multiplicities == [('bad', 1), ('great', 2)]
+
+
+def test_blocking(mocker, tmp_path):
+    """ Tests that lexical blocking prunes dissimilar key pairs.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    config_path = config_with(tmp_path, join_blocking={'threshold': 0.1})
+    
+    db = Database(str(tmp_path / 'companies.db'))
+    names = [f'Company {chr(65 + i)}' for i in range(12)] + ['Acme Corp']
+    values_sql = ', '.join(f"('{name}')" for name in names)
+    db.execute2list(
+        f'CREATE TABLE customers AS SELECT * FROM '
+        f'(VALUES {values_sql}) t(name);')
+    db.execute2list(
+        "CREATE TABLE suppliers AS SELECT * FROM "
+        "(VALUES ('Acme Corporation'), ('Zeta Industries')) t(name);")
+    query = Query(db, (
+        "SELECT * FROM customers c, suppliers s "
+        "WHERE NLjoin(c.name, s.name, 'same company');"))
+    constraints = Constraints()
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # Only the pair sharing the word "acme" is evaluated
+    prompts = []
+    def reply_content(kwargs):
+        prompts.append(kwargs['messages'][0]['content'])
+        return 'L0-R0.'
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 1
+    assert len(prompts) == 1
+    assert prompts[0][2]['text'] == 'Acme Corp'
+    assert counters.processed_tasks == 1
+    assert counters.pruned_tasks == 25
+
+
+
+def test_open_pair_matches(mocker, tmp_path):
+    """ Tests that joins ignore reported matches among pruned pairs.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    config_path = config_with(tmp_path, join_blocking={'threshold': 0.1})
+    db = Database(str(tmp_path / 'companies.db'))
+    db.execute2list(
+        "CREATE TABLE customers AS SELECT * FROM "
+        "(VALUES ('Acme Corp'), ('Zeta Inc')) t(name);")
+    db.execute2list(
+        "CREATE TABLE suppliers AS SELECT * FROM "
+        "(VALUES ('Acme Corporation'), ('Zeta Industries')) t(name);")
+    query = Query(db, (
+        "SELECT * FROM customers c, suppliers s "
+        "WHERE NLjoin(c.name, s.name, 'same company');"))
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # The prompt covers pruned pairs that are reported as matches
+    set_mock_join(mocker, 'L0-R0,L0-R1,L1-R0,L1-R1.')
+    result, counters = engine.run(query, Constraints())
+    assert sorted(zip(result['name'], result['name_1'])) == [
+        ('Acme Corp', 'Acme Corporation'), ('Zeta Inc', 'Zeta Industries')]
+    assert counters.pruned_tasks == 2
+
+
+def test_parallel_blocks(mocker, tmp_path):
+    """ Tests that joins evaluate multiple pairs of blocks in parallel.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for the database.
+    """
+    db = Database(str(tmp_path / 'numbers.db'))
+    db.execute2list(
+        'CREATE TABLE numbers AS SELECT range::VARCHAR AS nr '
+        'FROM range(20);')
+    query = Query(db, (
+        "SELECT * FROM numbers n1, numbers n2 "
+        "WHERE NLjoin(n1.nr, n2.nr, 'same number');"))
+    constraints = Constraints()
+    
+    # Each of the four pairs of blocks is evaluated exactly once
+    for streaming in [False, True]:
+        prompts = []
+        def reply_content(kwargs):
+            prompts.append(str(kwargs['messages'][0]['content']))
+            return 'L0-R0.'
+        set_mock_completion(mocker, reply_content)
+        engine = ExecutionEngine(db, 4, model_config_path, streaming=streaming)
+        result, counters = engine.run(query, constraints)
+        assert len(prompts) == 4
+        assert len(set(prompts)) == 4
+        assert len(result) == 4
+        assert counters.processed_tasks == 400
+
+
+def test_adaptive_blocks(mocker, tmp_path):
+    """ Tests block sizes adapting to item size and match density.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    config_path = config_with(
+        tmp_path, join_block_tokens={'input': 2200, 'output': 3})
+    
+    # Long texts (about 500 tokens each) lead to two keys per block
+    db = Database(str(tmp_path / 'texts.db'))
+    db.execute2list(
+        "CREATE TABLE texts AS SELECT repeat('x', 2000) || range AS text "
+        "FROM range(4);")
+    query = Query(db, (
+        "SELECT * FROM texts t1, texts t2 "
+        "WHERE NLjoin(t1.text, t2.text, 'same text');"))
+    constraints = Constraints()
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # Blocks are split across calls once matches are frequent
+    nr_items = []
+    def reply_content(kwargs):
+        nr_items.append((len(kwargs['messages'][0]['content']) - 1) // 2)
+        return 'L0-R0.'
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, constraints)
+    assert nr_items == [4, 3, 3, 3, 3, 3, 3]
+    assert counters.join_pairs == 16
+    assert counters.join_calls == 7
+    assert counters.pairs_per_call() == 16 / 7
+
+
+def test_block_budget(tmp_path):
+    """ Tests that blocks fit into the input token budget.
+    
+    Args:
+        tmp_path: temporary directory for database and configuration.
+    """
+    config_path = config_with(tmp_path, join_block_tokens={'input': 2000})
+    
+    # Texts of about 400, 600, and 100 tokens
+    db = Database(str(tmp_path / 'texts.db'))
+    db.execute2list(
+        "CREATE TABLE texts AS SELECT * FROM (VALUES "
+        "(repeat('a', 1600)), (repeat('b', 2400)), (repeat('c', 400))) "
+        "t(text);")
+    query = Query(db, (
+        "SELECT * FROM texts t1, texts t2 "
+        "WHERE NLjoin(t1.text, t2.text, 'same text');"))
+    engine = ExecutionEngine(db, 1, config_path)
+    semantic_join = engine._create_operators(query)[0]
+    semantic_join.prepare()
+    blocks = semantic_join.db.execute2list(
+        'SELECT block_id, SUM(LENGTH(key) // 4 + 1) '
+        f'FROM {semantic_join.left_keys_table} '
+        'GROUP BY block_id ORDER BY block_id')
+    assert blocks == [(0, 401), (1, 702)]
+
+
+def test_equivalence_join(mocker, tmp_path):
+    """ Tests inference of verdicts for equivalence self-joins.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    config_path = config_with(tmp_path, join_block_tokens={'input': 20})
+    
+    # Long texts lead to one key per block
+    db = Database(str(tmp_path / 'groups.db'))
+    db.execute2list(
+        "CREATE TABLE items AS SELECT name || repeat('x', 40) AS name "
+        "FROM (VALUES ('A1'), ('A2'), ('B1'), ('B2')) t(name);")
+    query = Query(db, (
+        "SELECT * FROM items i1, items i2 "
+        "WHERE NLjoin(i1.name, i2.name, 'same group', 'equivalence');"))
+    constraints = Constraints()
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # Items match if their names start with the same letter
+    evaluated = []
+    def reply_content(kwargs):
+        content = kwargs['messages'][0]['content']
+        left_key, right_key = content[2]['text'], content[4]['text']
+        evaluated.append((left_key[:2], right_key[:2]))
+        return 'L0-R0.' if left_key[0] == right_key[0] else '.'
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, constraints)
+    assert evaluated == [('A1', 'A2'), ('A1', 'B1'), ('A1', 'B2'), ('B1', 'B2')]
+    assert len(result) == 8
+    assert counters.processed_tasks == 6
+    assert counters.inferred_tasks == 2
+
+
+def test_symmetric_blocking(mocker, tmp_path):
+    """ Tests task counts for symmetric self-joins with blocking.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    config_path = config_with(tmp_path, join_blocking={'threshold': 0.1})
+    
+    # Keys without words are not similar to any key, including themselves
+    db = Database(str(tmp_path / 'companies.db'))
+    db.execute2list(
+        "CREATE TABLE companies AS SELECT * FROM (VALUES ('Acme Corp'), "
+        "('Acme Corporation'), ('Zeta Industries'), ('???')) t(name);")
+    query = Query(db, (
+        "SELECT * FROM companies c1, companies c2 "
+        "WHERE NLjoin(c1.name, c2.name, 'same company', 'equivalence');"))
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # Only the pair sharing the word "acme" is evaluated
+    prompts = []
+    def reply_content(kwargs):
+        prompts.append(kwargs['messages'][0]['content'])
+        return 'L0-R0.'
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, Constraints())
+    assert len(prompts) == 1
+    assert len(result) == 6
+    assert counters.processed_tasks == 1
+    assert counters.unprocessed_tasks == 0
+    assert counters.pruned_tasks == 5
+
+
+def test_elimination_cost(mocker):
+    """ Tests that elimination costs only consider evaluated tasks.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+    """
+    query_str = "SELECT * FROM cars WHERE NLfilter(description, 'a car');"
+    query = Query(cars_db, query_str)
+    engine = ExecutionEngine(cars_db, 1, model_config_path)
+    semantic_filter = engine._create_operators(query)[0]
+    semantic_filter.prepare()
+    
+    # Three tasks are rejected without LLM calls
+    semantic_filter.db.execute2list(
+        f'UPDATE {semantic_filter.tmp_table} SET result = FALSE '
+        'WHERE task_id > 2')
+    tasks = semantic_filter._retrieve_items(None, None)
+    semantic_filter._write_results(
+        [task_id for task_id, _ in tasks],
+        [item_text for _, item_text in tasks], [True, False])
+    mocker.patch.object(
+        semantic_filter.counters, 'total_input_tokens', return_value=200)
+    mocker.patch.object(
+        semantic_filter.counters, 'total_output_tokens', return_value=0)
+    assert semantic_filter.elimination_cost() == 200
+
+
+def test_sibling_filters(mocker, tmp_path):
+    """ Tests that joins skip keys rejected by semantic filters.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    db = Database(str(tmp_path / 'companies.db'))
+    names = [f'Company {chr(65 + i)}' for i in range(12)] + ['Acme Corp']
+    values_sql = ', '.join(f"('{name}')" for name in names)
+    db.execute2list(
+        f'CREATE TABLE customers AS SELECT * FROM '
+        f'(VALUES {values_sql}) t(name);')
+    db.execute2list(
+        "CREATE TABLE suppliers AS SELECT * FROM "
+        "(VALUES ('Acme Corporation'), ('Zeta Industries')) t(name);")
+    query = Query(db, (
+        "SELECT * FROM customers c, suppliers s "
+        "WHERE NLfilter(c.name, 'name starts with A') "
+        "AND NLjoin(c.name, s.name, 'same company');"))
+    constraints = Constraints()
+    config_path = config_with(tmp_path, filter_batch_sizes={'text': 20})
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # Only the customer accepted by the filter is joined
+    nr_evaluated = []
+    def mock_eval(self, item_texts):
+        nr_evaluated.append(len(item_texts))
+        return [(i, i.startswith('Acme')) for i in item_texts]
+    target = 'tdb.operators.semantic_filter.UnaryFilter._evaluate_predicate_parallel'
+    mocker.patch(target, mock_eval)
+    prompts = []
+    def reply_content(kwargs):
+        prompts.append((sum(nr_evaluated), kwargs['messages'][0]['content']))
+        return 'L0-R0.'
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 1
+    assert len(prompts) == 1
+    assert prompts[0][1][2]['text'] == 'Acme Corp'
+    assert counters.pruned_tasks == 24
+    
+    # Joins do not wait until filters evaluated all items
+    nr_evaluated.clear()
+    prompts.clear()
+    engine = ExecutionEngine(db, 1, model_config_path)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 1
+    assert prompts[0][0] < len(names)
+
+
+def test_filter_chain(mocker, tmp_path):
+    """ Tests that conjunctive filters on one table share rejected rows.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    config_path = config_with(tmp_path, filter_batch_sizes={'text': 2})
+    
+    db = Database(str(tmp_path / 'products.db'))
+    colors = ['blue', 'green', 'black', 'white', 'gray', 'pink', 'red', 'red']
+    values_sql = ', '.join(
+        f"('product {idx}', '{color}')" for idx, color in enumerate(colors))
+    db.execute2list(
+        f'CREATE TABLE products AS SELECT * FROM '
+        f'(VALUES {values_sql}) t(name, color);')
+    query = Query(db, (
+        "SELECT * FROM products p "
+        "WHERE NLfilter(p.name, 'is a product') "
+        "AND NLfilter(p.color, 'is red');"))
+    constraints = Constraints()
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # The selective filter on colors is evaluated first
+    evaluated_names = []
+    def reply_content(kwargs):
+        content = kwargs['messages'][0]['content']
+        items = [entry['text'] for entry in content[2::2]]
+        if 'is a product' in content[0]['text']:
+            evaluated_names.extend(items)
+            satisfied = [
+                idx for idx, item in enumerate(items) if item != 'product 7']
+        else:
+            satisfied = [idx for idx, item in enumerate(items) if item == 'red']
+        return ','.join(f'I{idx}' for idx in satisfied) + '.'
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, constraints)
+    assert len(result) == 1
+    assert result.iloc[0]['name'] == 'product 6'
+    assert evaluated_names == [
+        'product 0', 'product 1', 'product 6', 'product 7']
+    assert counters.pruned_tasks == 4
+
+
+def test_fused_filters(mocker, tmp_path):
+    """ Tests shared LLM calls for multiple filters on the same column.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    config_path = config_with(
+        tmp_path, filter_batch_sizes={'text': 2}, filter_fusion=True)
+    
+    db = Database(str(tmp_path / 'products.db'))
+    db.execute2list(
+        "CREATE TABLE products AS SELECT * FROM (VALUES "
+        "('red car'), ('blue car'), ('red bike'), ('blue bike')) t(name);")
+    query = Query(db, (
+        "SELECT * FROM products p "
+        "WHERE NLfilter(p.name, 'is red') "
+        "AND NOT NLfilter(p.name, 'is a bike');"))
+    constraints = Constraints()
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # Each call evaluates both conditions on two items
+    prompts = []
+    def reply_content(kwargs):
+        content = kwargs['messages'][0]['content']
+        prompts.append(content[0]['text'])
+        items = [entry['text'] for entry in content[2::2]]
+        return '\n'.join(
+            f'I{idx}:{int("red" in item)}{int("bike" in item)}' \
+            for idx, item in enumerate(items))
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, constraints)
+    assert len(prompts) == 2
+    assert all('C0: "is red"' in p and 'C1: "is a bike"' in p for p in prompts)
+    assert result['name'].tolist() == ['red car']
+    assert counters.processed_tasks == 8
+    
+    # Filters are only fused if enabled in the configuration
+    engine = ExecutionEngine(db, 1, model_config_path)
+    operators = engine._create_operators(query)
+    assert not any(isinstance(op, FusedFilter) for op in operators)
+
+
+def test_fused_parsing(mocker, tmp_path):
+    """ Tests that fused filters re-evaluate items with invalid replies.
+    
+    Args:
+        mocker: mocker fixture for creating mock objects.
+        tmp_path: temporary directory for database and configuration.
+    """
+    db = Database(str(tmp_path / 'products.db'))
+    db.execute2list(
+        "CREATE TABLE products AS SELECT * FROM (VALUES "
+        "('red car'), ('blue bike')) t(name);")
+    query = Query(db, (
+        "SELECT * FROM products p "
+        "WHERE NLfilter(p.name, 'is red') "
+        "AND NOT NLfilter(p.name, 'is a bike');"))
+    constraints = Constraints()
+    config_path = config_with(tmp_path, filter_fusion=True)
+    engine = ExecutionEngine(db, 1, config_path)
+    
+    # The first reply for the red car lacks the second verdict
+    items = []
+    def reply_content(kwargs):
+        item = kwargs['messages'][0]['content'][1]['text']
+        items.append(item)
+        if item == 'red car' and items.count(item) == 1:
+            return '1'
+        return f'"{int("red" in item)}{int("bike" in item)}."'
+    set_mock_completion(mocker, reply_content)
+    result, counters = engine.run(query, constraints)
+    assert items.count('red car') == 2
+    assert result['name'].tolist() == ['red car']
+    assert counters.parse_failures == 1
@@ -0,0 +1,63 @@
+'''
+Tests for pacing LLM calls according to rate limits.
+'''
+from litellm import RateLimitError
+from test.test_util import create_response
+from tdb.execution.dispatcher import LLMDispatcher
+from tdb.execution.rate_limits import RateLimiter, TokenBucket
+
+
+models_config = {
+    'models': [{
+        'modalities': ['text'], 'priority': 1,
+        'limits': {'rpm': 60, 'tpm': 6000},
+        'kwargs': {
+            'filter': {'model': 'test-model', 'max_tokens': 1},
+            'join': {'model': 'test-model'}}}]}
+
+
+def test_token_bucket():
+    """ Tests waiting times of token buckets. """
+    bucket = TokenBucket(60)
+    assert bucket.wait_time(60, 1.0) == 0
+    bucket.debit(60)
+    assert 0.9 < bucket.wait_time(1, 1.0) <= 1
+    assert 1.9 < bucket.wait_time(1, 0.5) <= 2
+
+
+def test_estimate_tokens():
+    """ Tests token estimates for LLM calls. """
+    rate_limiter = RateLimiter(models_config)
+    assert set(rate_limiter.model2buckets['test-model']) == {'rpm', 'tpm'}
+    kwargs = {
+        'model': 'test-model', 'max_tokens': 1,
+        'messages': [{'role': 'user', 'content': [
+            {'type': 'text', 'text': 'x' * 400},
+            {'type': 'image_url', 'image_url': {'url': ''}}]}]}
+    nr_tokens = rate_limiter.estimate_tokens(kwargs)
+    assert nr_tokens == 101 + RateLimiter.image_tokens + 1
+
+
+def test_retry(mocker):
+    """ Tests that calls are retried after rate limit errors. """
+    nr_calls = 0
+
+    async def mock_acompletion(**kwargs):
+        nonlocal nr_calls
+        nr_calls += 1
+        if nr_calls == 1:
+            raise RateLimitError('Too many requests', 'test', 'test-model')
+        return create_response('1')
+
+    mocker.patch('tdb.execution.dispatcher.acompletion', mock_acompletion)
+    mocker.patch.object(RateLimiter, 'base_delay_s', 0.01)
+    dispatcher = LLMDispatcher(1, models_config)
+    kwargs = {
+        'model': 'test-model', 'max_tokens': 1,
+        'messages': [{'role': 'user', 'content': 'test'}]}
+    response = dispatcher.submit(kwargs).result()
+    dispatcher.close()
+    assert response.choices[0].message.content == '1'
+    assert nr_calls == 2
+    rate_factor = dispatcher.rate_limiter.model2factor['test-model']
+    assert rate_factor < 1
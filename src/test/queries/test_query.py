@@ -58,4 +58,99 @@ def test_parsing():
             assert sem_pred.right_alias == 'c2'
             assert sem_pred.left_column == 'pic'
             assert sem_pred.right_column == 'pic'
-            assert sem_pred.condition == 'are similar'
\ No newline at end of file
+            assert sem_pred.condition == 'are similar'
+
+
+def test_monotone():
+    """ Tests the analysis of query monotonicity. """
+    monotone_queries = [
+        "select * from cars C1, cars C2 "
+        "where nlfilter(C1.pic, 'is red') and "
+        "nljoin(C1.pic, C2.pic, 'are similar')",
+        "select count(*), max(description) from cars "
+        "where nlfilter(pic, 'is red') and description <> 'x'"]
+    for sql in monotone_queries:
+        assert Query(cars_db, sql).monotone
+    
+    non_monotone_queries = [
+        "select * from cars "
+        "where not nlfilter(pic, 'is red')",
+        "select * from cars "
+        "where nlfilter(pic, 'is red') or description = 'x'",
+        "select avg(length(description)) from cars "
+        "where nlfilter(pic, 'is red')",
+        "select description, count(*) from cars "
+        "where nlfilter(pic, 'is red') group by description"]
+    for sql in non_monotone_queries:
+        assert not Query(cars_db, sql).monotone
+
+def test_semi_join_reducers():
+    """ Tests the derivation of semi-join reducers. """
+    sql = """
+    select * from cars C1, cars C2
+    where C1.description = C2.description and
+    C2.description = 'x' and nlfilter(C1.pic, 'is a red car');
+    """
+    query = Query(cars_db, sql)
+    assert len(query.alias2reducers['c1']) == 1
+    assert len(query.alias2reducers['c2']) == 1
+    c1_filters = query.alias2unary_sql['c1'].sql()
+    assert 'IN (SELECT "c2"."description" FROM cars AS c2' in c1_filters
+    assert "'x'" in c1_filters
+    nr_rows = cars_db.execute2list(
+        f'SELECT COUNT(*) FROM cars AS c1 WHERE {c1_filters}')[0][0]
+    assert nr_rows == 0
+    
+    # Reducers are only derived from conjuncts of the main query
+    sql = """
+    select * from cars C1, cars C2
+    where C1.description = C2.description or
+    nlfilter(C1.pic, 'is a red car');
+    """
+    query = Query(cars_db, sql)
+    assert query.alias2reducers == {'c1': [], 'c2': []}
+
+
+def test_anti_join_predicates():
+    """ Tests that anti join conditions do not filter preserved rows. """
+    sql = """
+    select C1.pic from cars C1 anti join cars C2
+    on C1.description = C2.description and C1.pic <> 'a'
+    and C2.pic <> 'b' where nlfilter(C1.pic, 'is a red car')
+    """
+    query = Query(cars_db, sql)
+    assert "'a'" not in query.alias2unary_sql['c1'].sql()
+    assert "'b'" in query.alias2unary_sql['c2'].sql()
+    
+    # Rows without matches in semi joins are dropped
+    query = Query(cars_db, sql.replace('anti join', 'semi join'))
+    assert "'a'" in query.alias2unary_sql['c1'].sql()
+    assert "'b'" in query.alias2unary_sql['c2'].sql()
+
+
+def test_unary_sql_predicates():
+    """ Tests the collection of pure SQL predicates per table. """
+    sql = """
+    with W as (
+        select * from cars C3
+        where C3.description like '%red%' or C3.description = 'x')
+    select * from cars C1 join cars C2
+    on C1.pic = C2.pic and lower(C2.pic) between 'a' and 'm'
+    left join cars C4 on C4.pic = C1.pic and C1.pic <> 'a'
+    and C4.description in ('x', 'y'), W
+    where nlfilter(C1.pic, 'is a red car') and random() < 0.5
+    and exists (select * from cars C5 where C1.description = 'x')
+    """
+    query = Query(cars_db, sql)
+    alias2sql = {
+        alias: pred.sql() for alias, pred in query.alias2unary_sql.items()}
+    assert alias2sql['c3'] == (
+        'TRUE AND ("c3"."description" LIKE \'%red%\' '
+        'OR "c3"."description" = \'x\')')
+    assert 'BETWEEN' in alias2sql['c2']
+    assert 'IN (\'x\', \'y\')' in alias2sql['c4']
+    # Conditions on preserved rows, volatile functions, and
+    # correlated sub-queries are not pushed down.
+    assert "'a'" not in alias2sql['c1']
+    assert 'RANDOM' not in alias2sql['c1'].upper()
+    assert 'description' not in alias2sql['c1']
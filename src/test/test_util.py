@@ -3,6 +3,8 @@ Created on Aug 6, 2025
 
 @author: immanueltrummer
 '''
+import json
+
 from litellm.types.utils import ModelResponse, Choices, Message
 from tdb.data.relational import Database
 from pathlib import Path
@@ -13,6 +15,24 @@ model_config_path = Path(root_dir, 'config', 'models.json')
 cars_db = Database(database_name=str(cars_db_path))
 
 
+def config_with(tmp_path, **overrides):
+    """ Writes a copy of the model configuration with changed properties.
+    
+    Args:
+        tmp_path: Directory in which to store the configuration.
+        overrides: Maps top-level configuration properties to new values.
+    
+    Returns:
+        Path to the modified configuration file.
+    """
+    with open(model_config_path) as file:
+        models_config = json.load(file)
+    models_config.update(overrides)
+    config_path = Path(tmp_path, 'models.json')
+    config_path.write_text(json.dumps(models_config))
+    return config_path
+
+
 def create_response(content):
     """ Creates a mock response object for LLM calls.
     
@@ -73,4 +93,28 @@ def set_mock_filter(mocker, default_value):
     mock_eval = lambda self, item_texts: \
         [(i, default_value) for i in item_texts]
     target = 'tdb.operators.semantic_filter.UnaryFilter._evaluate_predicate_parallel'
-    mocker.patch(target, mock_eval)
\ No newline at end of file
+    mocker.patch(target, mock_eval)
+
+
+def set_mock_completion(mocker, reply_content):
+    """ Mocks LLM calls issued via the dispatcher.
+    
+    Args:
+        mocker: Mocker fixture for creating mock objects.
+        reply_content: Function mapping call arguments to reply content.
+    """
+    async def mock_acompletion(**kwargs):
+        return create_response(reply_content(kwargs))
+    
+    target = 'tdb.execution.dispatcher.acompletion'
+    mocker.patch(target, mock_acompletion)
+
+
+def set_mock_join(mocker, content):
+    """ Mocks LLM calls of semantic joins to return fixed content.
+    
+    Args:
+        mocker: Mocker fixture for creating mock objects.
+        content: Content of the LLM reply (e.g., "L0-R0.").
+    """
+    set_mock_completion(mocker, lambda kwargs: content)
\ No newline at end of file